@@ -0,0 +1,66 @@
+"""Compare the streamed ``git log`` commit extractor with GitPython.
+
+Usage: python -m benchmarks.commit_extraction [--commits 30000] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import git
+from benchmarks.synthetic import generate_repository
+from repolens.packager import extract_commits
+
+
+def gitpython_commits(git_dir):
+    # The collection loop package_repository used before extract_commits
+    repo = git.Repo(git_dir)
+    commits = []
+    for commit in repo.iter_commits():
+        commits.append({
+            'hash': commit.hexsha,
+            'author': str(commit.author),
+            'message': commit.message,
+            'date': commit.committed_datetime.isoformat()
+        })
+    repo.close()
+    return commits
+
+
+def streamed_commits(git_dir):
+    return list(extract_commits(git_dir))
+
+
+def best_of(func, git_dir, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(git_dir)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--commits', type=int, default=30000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        git_dir = generate_repository(os.path.join(temp_dir, 'synthetic.git'), commits=args.commits)
+
+        gitpython_time, expected = best_of(gitpython_commits, git_dir, args.repeat)
+        streamed_time, actual = best_of(streamed_commits, git_dir, args.repeat)
+        if actual != expected:
+            raise SystemExit('Streamed extractor output differs from GitPython')
+
+    print(json.dumps({
+        'commits': args.commits,
+        'gitpython_seconds': round(gitpython_time, 3),
+        'streamed_seconds': round(streamed_time, 3),
+        'speedup': round(gitpython_time / streamed_time, 1),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Compare the NumPy history analytics with plain Python loops.
+
+Usage: python -m benchmarks.history_analytics [--commits 200000] [--authors 300] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from repolens import history
+from repolens.snapshot import Snapshot, write_snapshot
+
+START = datetime(2015, 1, 1, tzinfo=timezone.utc)
+
+
+def synthetic_commits(commits, authors, seed=0):
+    """Newest-first commit rows with skewed authorship and numstat counts."""
+    rng = random.Random(seed)
+    names = [f'Author {i}' for i in range(authors)]
+    weights = [1 / (i + 1) for i in range(authors)]
+    span = 8 * 365 * 24 * 3600
+    dates = sorted((rng.randrange(span) for _ in range(commits)), reverse=True)
+    zones = [timezone(timedelta(hours=h)) for h in (-8, -5, 0, 1, 2, 5, 9)]
+    return [{
+        'hash': f'{i:040x}',
+        'author': rng.choices(names, weights)[0],
+        'message': 'Synthetic commit\n',
+        'date': (START + timedelta(seconds=seconds)).astimezone(rng.choice(zones)).isoformat(),
+        'insertions': rng.randrange(200),
+        'deletions': rng.randrange(100),
+        'files_changed': rng.randrange(1, 10),
+    } for i, seconds in enumerate(dates)]
+
+
+def python_analytics(commits, top=10, threshold=0.5):
+    # The straightforward per-commit loops the analyzers would otherwise run
+    weekly = Counter()
+    churn = defaultdict(lambda: [0, 0])
+    stats = defaultdict(lambda: {'commits': 0, 'first': None, 'last': None, 'weeks': set(),
+                                 'insertions': 0, 'deletions': 0})
+    for commit in commits:
+        seconds = int(datetime.fromisoformat(commit['date']).timestamp())
+        week = (seconds + 3 * 24 * 3600) // (7 * 24 * 3600)
+        weekly[week] += 1
+        churn[week][0] += commit['insertions']
+        churn[week][1] += commit['deletions']
+        author = stats[commit['author']]
+        author['commits'] += 1
+        author['first'] = seconds if author['first'] is None else min(author['first'], seconds)
+        author['last'] = seconds if author['last'] is None else max(author['last'], seconds)
+        author['weeks'].add(week)
+        author['insertions'] += commit['insertions']
+        author['deletions'] += commit['deletions']
+
+    weeks = range(min(weekly), max(weekly) + 1)
+    ranked = sorted(stats.items(), key=lambda item: (-item[1]['commits'], item[0]))
+    covered, factor = 0, 0
+    for _, author in ranked:
+        covered += author['commits']
+        factor += 1
+        if covered >= threshold * len(commits):
+            break
+    return {
+        'commits_per_week': [weekly[w] for w in weeks],
+        'insertions_per_week': [churn[w][0] for w in weeks],
+        'top': [(name, a['commits'], a['first'], a['last'], len(a['weeks']), a['insertions'], a['deletions'])
+                for name, a in ranked[:top]],
+        'bus_factor': factor,
+    }
+
+
+def numpy_analytics(commits, top=10, threshold=0.5):
+    result = {
+        'histogram': history.weekly_histogram(commits),
+        'churn': history.weekly_churn(commits),
+        'contributors': history.contributors(commits, top),
+        'bus_factor': history.bus_factor(commits, threshold),
+    }
+    return {
+        'commits_per_week': result['histogram']['commits'],
+        'insertions_per_week': result['churn']['insertions'],
+        'top': [(c['author'], c['commits'], int(datetime.fromisoformat(c['first_commit']).timestamp()),
+                 int(datetime.fromisoformat(c['last_commit']).timestamp()), c['active_weeks'], c['insertions'],
+                 c['deletions']) for c in result['contributors']['contributors']],
+        'bus_factor': result['bus_factor']['commits']['bus_factor'],
+    }
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--commits', type=int, default=200000)
+    parser.add_argument('--authors', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    commits = synthetic_commits(args.commits, args.authors)
+    python_time, expected = best_of(lambda: python_analytics(commits), args.repeat)
+    rows_time, from_rows = best_of(lambda: numpy_analytics(history.History.from_commits(commits)), args.repeat)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'history.rls')
+        write_snapshot(path, {'name': 'synthetic'}, [], commits, [])
+
+        def from_snapshot():
+            with Snapshot(path) as snapshot:
+                return numpy_analytics(history.History.from_snapshot(snapshot))
+        columns_time, from_columns = best_of(from_snapshot, args.repeat)
+
+    if from_rows != expected or from_columns != expected:
+        raise SystemExit('NumPy analytics differ from the Python loops')
+
+    print(json.dumps({
+        'commits': args.commits,
+        'authors': args.authors,
+        'python_seconds': round(python_time, 3),
+        'numpy_from_rows_seconds': round(rows_time, 3),
+        'numpy_from_snapshot_seconds': round(columns_time, 3),
+        'speedup_from_rows': round(python_time / rows_time, 1),
+        'speedup_from_snapshot': round(python_time / columns_time, 1),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""Measure packaging, analysis, download and search throughput on a synthetic repository.
+
+Usage: python -m benchmarks.suite [--files 2000] [--depth 3] [--commits 2000] [--branches 4]
+                                  [--repeat 3] [--output results.json] [--baseline old.json]
+
+Everything runs offline: the repository is generated locally and the API
+is driven through the Flask test client. Each benchmark reports the best
+of ``--repeat`` timed runs plus the peak Python heap of one extra run
+traced with :mod:`tracemalloc`. With ``--baseline``, benchmarks more than
+``--tolerance`` slower than the earlier results are listed and the exit
+status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from flask import Flask
+from benchmarks.synthetic import generate_repository
+from repolens.analysis_cache import get_analysis_cache
+from repolens.analyzer import analysis_types, run_analyses
+from repolens.api import api_bp, init_app
+from repolens.models import Analysis, db
+from repolens.packager import package_repository
+from utils.analyzer import analyze_repository
+from utils.converter import convert_repository
+
+SEARCH_QUERIES = ({'q': 'value_1[0-9]+ = '}, {'q': 'revision 1$'}, {'path': 'dir1/*.py'},
+                  {'q': '(?i)VALUE_7', 'path': '*.js'})
+
+
+def create_app(temp_dir):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(temp_dir, 'repolens.db')
+    app.config['REPOLENS_MIRROR_DIR'] = os.path.join(temp_dir, 'mirrors')
+    app.config['REPOLENS_SNAPSHOT_DIR'] = os.path.join(temp_dir, 'snapshots')
+    app.config['REPOLENS_SEARCH_DB'] = os.path.join(temp_dir, 'search.db')
+    app.config['REPOLENS_JOBS_DB'] = os.path.join(temp_dir, 'jobs.db')
+    app.config['REPOLENS_BLOB_DB'] = os.path.join(temp_dir, 'blobs.db')
+    app.config['REPOLENS_ANALYSIS_CACHE_DB'] = None
+    app.register_blueprint(api_bp)
+    init_app(app)
+    return app
+
+
+def measure(func, repeat, setup=None):
+    """Return ``(best seconds, peak traced bytes, last result)`` of ``func``."""
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(timings), peak, result
+
+
+def record(results, name, seconds, peak, units=None, unit=None):
+    results[name] = {'seconds': round(seconds, 4), 'peak_memory_bytes': peak}
+    if units is not None:
+        results[name]['unit'] = unit
+        results[name]['per_second'] = round(units / seconds, 1) if seconds else None
+
+
+def _package(repo_path, **options):
+    repo_id, error = package_repository(repo_path, **options)
+    if error:
+        raise SystemExit(f'Packaging failed: {error}')
+    return repo_id
+
+
+def _reset_analyses():
+    Analysis.query.delete()
+    db.session.commit()
+    get_analysis_cache().clear()
+
+
+def _get(client, url, **params):
+    response = client.get(url, query_string=params)
+    if response.status_code != 200:
+        raise SystemExit(f'GET {url} failed with {response.status_code}')
+    return response
+
+
+def run(repo_path, repeat, app):
+    results = {}
+    client = app.test_client()
+
+    # The first package clones the mirror; later ones only fetch
+    start = time.perf_counter()
+    repo_id = _package(repo_path, incremental=False)
+    record(results, 'package_cold', time.perf_counter() - start, None)
+    seconds, peak, repo_id = measure(lambda: _package(repo_path, incremental=False), repeat)
+    files = len(subprocess.run(['git', '--git-dir', repo_path, 'ls-tree', '-r', '--name-only', 'HEAD'],
+                               capture_output=True, check=True).stdout.splitlines())
+    record(results, 'package_full', seconds, peak, files, 'files')
+    seconds, peak, _ = measure(lambda: _package(repo_path), repeat)
+    record(results, 'package_incremental_unchanged', seconds, peak)
+
+    types = list(analysis_types())
+    seconds, peak, _ = measure(lambda: run_analyses(repo_id, types), repeat, setup=_reset_analyses)
+    record(results, 'analyze_all', seconds, peak, len(types), 'analyses')
+
+    def analyze_legacy():
+        return analyze_repository(convert_repository(repo_path))
+    seconds, peak, _ = measure(analyze_legacy, repeat)
+    record(results, 'analyze_legacy', seconds, peak, files, 'files')
+
+    for fmt in ('json', 'ndjson', 'snapshot'):
+        url = f'/api/download/{repo_id}'
+        seconds, peak, response = measure(lambda: _get(client, url, format=fmt), repeat)
+        record(results, f'download_{fmt}', seconds, peak, len(response.get_data()), 'bytes')
+
+    def search_all():
+        return sum(len(_get(client, '/api/search', **query).get_json()['results']) for query in SEARCH_QUERIES)
+    seconds, peak, _ = measure(search_all, repeat)
+    record(results, 'search', seconds, peak, len(SEARCH_QUERIES), 'queries')
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    """Yield ``(name, old seconds, new seconds)`` for benchmarks that slowed down."""
+    for name, result in results.items():
+        old = baseline.get('results', {}).get(name)
+        if old and old['seconds'] and result['seconds'] > old['seconds'] * (1 + tolerance):
+            yield name, old['seconds'], result['seconds']
+
+
+def _revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, check=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--commits', type=int, default=2000)
+    parser.add_argument('--branches', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='Write the results to this JSON file as well.')
+    parser.add_argument('--baseline', help='Compare with results written by an earlier run.')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        repo_path = generate_repository(os.path.join(temp_dir, 'synthetic.git'), commits=args.commits,
+                                        files=args.files, depth=args.depth, branches=args.branches)
+        app = create_app(temp_dir)
+        with app.app_context():
+            db.create_all()
+            results = run(repo_path, args.repeat, app)
+            db.session.remove()
+
+    report = {
+        'revision': _revision(),
+        'python': platform.python_version(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'parameters': {'files': args.files, 'depth': args.depth, 'commits': args.commits,
+                       'branches': args.branches, 'repeat': args.repeat},
+        'results': results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        slower = list(regressions(results, baseline, args.tolerance))
+        for name, old, new in slower:
+            print(f'{name}: {old:.4f}s -> {new:.4f}s', file=sys.stderr)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
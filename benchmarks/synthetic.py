@@ -0,0 +1,61 @@
+import random
+import subprocess
+
+EPOCH = 1_600_000_000
+
+
+def _data(payload):
+    payload = payload.encode('utf-8')
+    return b'data %d\n%s\n' % (len(payload), payload)
+
+
+def _file_paths(files, depth, rng):
+    paths = []
+    for i in range(files):
+        dirs = [f'dir{rng.randrange(8)}' for _ in range(rng.randrange(depth + 1))]
+        ext = rng.choice(['py', 'js', 'md', 'txt', 'json', 'c'])
+        paths.append('/'.join(dirs + [f'file{i}.{ext}']))
+    return paths
+
+
+def _content(path, revision, rng):
+    lines = [f'# {path} revision {revision}']
+    lines += [f'value_{n} = {rng.randrange(1_000_000)}' for n in range(rng.randrange(1, 40))]
+    return '\n'.join(lines) + '\n'
+
+
+def generate_repository(path, commits=1000, files=100, depth=3, branches=1, authors=10, seed=0):
+    """Create a bare git repository with a synthetic history at ``path``.
+
+    The history is written through a single ``git fast-import`` stream, so
+    tens of thousands of commits take seconds. The first commit adds
+    ``files`` files spread over up to ``depth`` directory levels; every
+    later commit rewrites one to three of them. ``branches - 1`` extra
+    branches are cut at evenly spaced commits. Returns ``path``.
+    """
+    rng = random.Random(seed)
+    subprocess.run(['git', 'init', '-q', '--bare', '-b', 'main', path], check=True)
+    paths = _file_paths(files, depth, rng)
+    branch_points = {commits * (i + 1) // branches: f'branch-{i}' for i in range(branches - 1)}
+
+    process = subprocess.Popen(['git', '--git-dir', path, 'fast-import', '--quiet'], stdin=subprocess.PIPE)
+    stream = process.stdin
+    for n in range(1, commits + 1):
+        author = rng.randrange(authors)
+        signature = f'Author {author} <author{author}@example.com> {EPOCH + n * 3600} +0000'
+        stream.write(b'commit refs/heads/main\n')
+        stream.write(b'mark :%d\n' % n)
+        stream.write(f'author {signature}\ncommitter {signature}\n'.encode('utf-8'))
+        stream.write(_data(f'Commit {n}\n\nSynthetic change number {n}.\n'))
+        if n > 1:
+            stream.write(b'from :%d\n' % (n - 1))
+        changed = paths if n == 1 else rng.sample(paths, min(len(paths), rng.randint(1, 3)))
+        for file_path in changed:
+            stream.write(f'M 100644 inline {file_path}\n'.encode('utf-8'))
+            stream.write(_data(_content(file_path, n, rng)))
+        if n in branch_points:
+            stream.write(f'reset refs/heads/{branch_points[n]}\nfrom :{n}\n\n'.encode('utf-8'))
+    stream.close()
+    if process.wait() != 0:
+        raise RuntimeError('git fast-import failed')
+    return path
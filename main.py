@@ -1,6 +1,7 @@
 from flask import Flask, render_template
 from repolens.api import api_bp, init_app as init_api
-from repolens.database import db
+from repolens.database import db, init_app as init_db
+from repolens.aio import AsyncApp, serve
 import os
 
 def create_app():
@@ -10,8 +11,8 @@ def create_app():
     app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-    # Initialize SQLAlchemy with the app
-    db.init_app(app)
+    # Initialize SQLAlchemy with the app, its connection pool and SQLite pragmas
+    init_db(app)
 
     # Register blueprints
     app.register_blueprint(api_bp, url_prefix='/api')
@@ -26,8 +27,13 @@ def create_app():
     return app
 
 app = create_app()
+# Async serving mode: `uvicorn main:asgi_app`, or REPOLENS_ASYNC=1 python main.py
+asgi_app = AsyncApp(app)
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
-    app.run(host='0.0.0.0', port=5000)
+    if os.environ.get('REPOLENS_ASYNC') == '1':
+        serve(asgi_app, host='0.0.0.0', port=5000)
+    else:
+        app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,248 @@
+"""ASGI serving mode for the Flask app.
+
+Every route keeps its Flask view, so contracts are shared with the WSGI
+server. What changes is how requests wait: the event loop holds them as
+coroutines and only hands one to a thread once it can run, so a backlog
+of slow requests costs no threads and cannot starve fast endpoints.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import HTTPException
+from repolens.metrics import get_metrics
+
+# Request bodies are kept in memory up to this size, then spooled to disk
+SPOOL_BYTES = 1024 * 1024
+
+
+class LaneBusy(Exception):
+    pass
+
+
+class Lane:
+    """Threads reserved for a group of slow endpoints.
+
+    At most ``size`` requests of the lane run at once. Up to ``max_waiting``
+    more wait ``timeout`` seconds for a slot as coroutines; beyond that
+    :class:`LaneBusy` is raised. A lane without ``size`` only bounds its
+    threads, and excess requests queue on the executor.
+    """
+
+    def __init__(self, name, threads, size=None, max_waiting=None, timeout=None):
+        self.name = name
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix=f'repolens-{name}')
+        self.size = size
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.waiting = 0
+        self._slots = None
+
+    async def acquire(self):
+        if self.size is None:
+            return
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+        if self._slots.locked() and self.max_waiting is not None and self.waiting >= self.max_waiting:
+            raise LaneBusy(f'Too many {self.name} requests are waiting')
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise LaneBusy(f'Timed out waiting for a {self.name} slot')
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        if self._slots is not None:
+            self._slots.release()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def _latin1(value):
+    return value.encode('utf-8').decode('latin-1')
+
+
+def wsgi_environ(scope, body):
+    """Build the WSGI environ of an ASGI ``http`` scope."""
+    script_name = scope.get('root_path', '')
+    path = scope['path']
+    if script_name and path.startswith(script_name):
+        path = path[len(script_name):]
+    host, port = scope.get('server') or ('localhost', None)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': _latin1(script_name),
+        'PATH_INFO': _latin1(path),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': host,
+        'SERVER_PORT': str(port or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # The body is buffered whole, so it can be read to EOF without a Content-Length
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+class AsyncApp:
+    """ASGI application serving a Flask app from an event loop.
+
+    Views run on a shared pool of ``REPOLENS_ASYNC_WORKERS`` threads, except
+    ``/api/screenshot``, which has a lane sized like the browser pool: its
+    requests wait for a browser on the event loop instead of in a thread.
+    Streamed bodies are pulled one chunk per executor call, so a slow
+    client holds no thread between chunks.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        config = app.config
+        self.default_lane = Lane('async', config['REPOLENS_ASYNC_WORKERS'])
+        self.lanes = {
+            'api.take_screenshot': Lane('screenshot', config['REPOLENS_BROWSER_POOL_SIZE'],
+                                        size=config['REPOLENS_BROWSER_POOL_SIZE'],
+                                        max_waiting=config['REPOLENS_BROWSER_MAX_WAITING'],
+                                        timeout=config['REPOLENS_BROWSER_ACQUIRE_TIMEOUT']),
+        }
+        self._adapter = app.url_map.bind('localhost')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    def close(self):
+        for lane in (self.default_lane, *self.lanes.values()):
+            lane.close()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _endpoint(self, environ):
+        try:
+            return self._adapter.match(environ['PATH_INFO'], environ['REQUEST_METHOD'])[0]
+        except HTTPException:
+            return None
+
+    async def _http(self, scope, receive, send):
+        started = time.perf_counter()
+        body = await self._read_body(receive)
+        if body is None:
+            return
+        try:
+            environ = wsgi_environ(scope, body)
+            endpoint = self._endpoint(environ)
+            lane = self.lanes.get(endpoint, self.default_lane)
+            try:
+                await lane.acquire()
+            except LaneBusy as e:
+                await self._busy(scope, send, endpoint, str(e), started)
+                return
+            try:
+                await self._run_wsgi(environ, send, lane.executor)
+            finally:
+                lane.release()
+        finally:
+            body.close()
+
+    @staticmethod
+    async def _read_body(receive):
+        """Return the request body as a file, or None if the client went away."""
+        body = tempfile.SpooledTemporaryFile(SPOOL_BYTES)
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                body.seek(0)
+                return body
+
+    async def _busy(self, scope, send, endpoint, error, started):
+        payload = json.dumps({'error': error}).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': 503,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(payload)).encode('ascii'))]})
+        await send({'type': 'http.response.body', 'body': payload})
+        metrics = get_metrics(self.app)
+        if metrics is not None:
+            # Rejected before Flask saw the request, so its hooks did not time it
+            metrics.requests.observe(time.perf_counter() - started, scope['method'], endpoint, '503')
+
+    async def _run_wsgi(self, environ, send, executor):
+        loop = asyncio.get_running_loop()
+        # Streamed views keep Flask's context in context variables between
+        # chunks, so every call for this request runs in the same Context.
+        context = contextvars.Context()
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                   for name, value in headers]
+
+        def first_chunk():
+            iterable = self.app(environ, start_response)
+            chunks = iter(iterable)
+            return iterable, chunks, next(chunks, None)
+
+        iterable, chunks, chunk = await loop.run_in_executor(executor, context.run, first_chunk)
+        try:
+            response['sent'] = True
+            await send({'type': 'http.response.start', 'status': response['status'],
+                        'headers': response['headers']})
+            while chunk is not None:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await loop.run_in_executor(executor, context.run, next, chunks, None)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                await loop.run_in_executor(executor, context.run, close)
+
+
+def serve(asgi_app, host='0.0.0.0', port=5000):
+    """Serve ``asgi_app`` with uvicorn, installed with the ``asgi`` extra."""
+    try:
+        import uvicorn
+    except ImportError:
+        raise RuntimeError('The async serving mode requires the uvicorn package')
+    uvicorn.run(asgi_app, host=host, port=port, lifespan='on')
+
+
+def init_app(app):
+    app.config.setdefault('REPOLENS_ASYNC_WORKERS', int(os.environ.get('REPOLENS_ASYNC_WORKERS', 32)))
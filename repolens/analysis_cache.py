@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from repolens.database import apply_sqlite_pragmas, set_sqlite_journal_mode, sqlite_pragmas_enabled
+
+# Bump whenever an analyzer's output changes, so stale results are ignored
+CACHE_VERSION = 1
+
+
+def snapshot_key(repository, analysis_type, content=None):
+    """Cache key for an analysis of a repository snapshot, or None.
+
+    The key is derived from the packaged content (HEAD sha plus the clone
+    mode that bounded it), not from the row id, so separate snapshots of
+    the same content share results. ``content`` is JSON-serializable
+    material for whatever else the analysis reads that HEAD does not fix,
+    such as the branch list. Snapshots without a recorded HEAD are not
+    cached.
+    """
+    metadata = repository.packaged_data or {}
+    if not metadata.get('head'):
+        return None
+    material = json.dumps([CACHE_VERSION, metadata['head'], metadata.get('clone'), analysis_type, content],
+                          sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class LRUStore:
+    """In-process store evicting least recently used entries past ``max_bytes``."""
+
+    name = 'memory'
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return json.loads(entry)
+
+    def set(self, key, value):
+        entry = json.dumps(value)
+        if len(entry) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = entry
+            self._bytes += len(entry)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteStore:
+    """Store shared by every process that points at the same SQLite file."""
+
+    name = 'sqlite'
+
+    def __init__(self, path, pragmas=True):
+        self.path = path
+        self.pragmas = pragmas
+        self._schema_ready = False
+
+    def _connect(self):
+        if not self._schema_ready:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if self.pragmas:
+            apply_sqlite_pragmas(conn)
+        if not self._schema_ready:
+            if self.pragmas:
+                set_sqlite_journal_mode(conn)
+            conn.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                         'created_at REAL NOT NULL)')
+            self._schema_ready = True
+        return conn
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO results (key, value, created_at) VALUES (?, ?, ?)',
+                         (key, json.dumps(value), time.time()))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM results')
+
+
+class AnalysisCache:
+    """Looks results up through a list of stores, fastest first.
+
+    A hit in a slower tier is copied into the faster ones. Any object with
+    ``get(key)``, ``set(key, value)``, ``clear()`` and a ``name`` can be
+    used as a tier.
+    """
+
+    def __init__(self, stores):
+        self.stores = stores
+        self._lock = threading.Lock()
+        self._hits = {store.name: 0 for store in stores}
+        self._misses = 0
+
+    def get(self, key):
+        for i, store in enumerate(self.stores):
+            value = store.get(key)
+            if value is not None:
+                for faster in self.stores[:i]:
+                    faster.set(key, value)
+                with self._lock:
+                    self._hits[store.name] += 1
+                return value
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def set(self, key, value):
+        for store in self.stores:
+            store.set(key, value)
+
+    def clear(self):
+        for store in self.stores:
+            store.clear()
+        with self._lock:
+            self._hits = dict.fromkeys(self._hits, 0)
+            self._misses = 0
+
+    def stats(self):
+        with self._lock:
+            hits = dict(self._hits)
+            misses = self._misses
+        lookups = sum(hits.values()) + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': sum(hits.values()) / lookups if lookups else 0.0,
+        }
+
+
+def get_analysis_cache(app=None):
+    app = app or current_app
+    return app.extensions['repolens_analysis_cache']
+
+
+def init_app(app):
+    app.config.setdefault('REPOLENS_ANALYSIS_CACHE_BYTES', int(os.environ.get(
+        'REPOLENS_ANALYSIS_CACHE_BYTES', 16 * 1024 * 1024)))
+    app.config.setdefault('REPOLENS_ANALYSIS_CACHE_DB', os.environ.get(
+        'REPOLENS_ANALYSIS_CACHE_DB', os.path.join(os.path.expanduser('~'), '.cache', 'repolens', 'analysis.db')))
+
+    stores = [LRUStore(app.config['REPOLENS_ANALYSIS_CACHE_BYTES'])]
+    if app.config['REPOLENS_ANALYSIS_CACHE_DB']:
+        stores.append(SQLiteStore(app.config['REPOLENS_ANALYSIS_CACHE_DB'], sqlite_pragmas_enabled(app)))
+    app.extensions['repolens_analysis_cache'] = AnalysisCache(stores)
@@ -1,29 +1,470 @@
-from repolens.models import Repository, Analysis, db
+import hashlib
+from collections import Counter
+from sqlalchemy import select, func
+from repolens.models import Repository, RepositoryFile, RepositoryCommit, RepositoryBranch, Analysis, db
+from repolens.storage import (iter_file_rows, iter_commit_rows, iter_file_history, list_branches,
+                              summarize_file_history, is_normalized, count_rows)
+from repolens.analysis_cache import get_analysis_cache, snapshot_key
+from repolens.snapshot import get_snapshot_store
+from repolens import history
+from repolens.metrics import span
 
-def analyze_repository(repo_id, analysis_type):
-    repository = Repository.query.get(repo_id)
-    if not repository:
+# Data an analyzer can consume, in the order the runner streams it
+SOURCES = ('files', 'commits', 'branches', 'file_history')
+
+_analyzers = {}
+
+
+class Analyzer:
+    """Base class for analyses computed in one pass over a snapshot.
+
+    Subclasses list the data they read in ``consumes`` and override the
+    matching ``add_*`` methods. A fresh instance is created for every run;
+    the runner feeds it each file row (every stored file column, see
+    :func:`repolens.storage.iter_file_rows`), commit row (see
+    :func:`repolens.storage.iter_commit_rows`), branch name and file
+    history row (see :func:`repolens.storage.iter_file_history`),
+    then stores the JSON-serializable value returned by :meth:`result`.
+
+    When the snapshot's columnar file is available, :meth:`columns` is
+    tried first. Otherwise, for snapshots in the normalized tables,
+    :meth:`query` may compute the result with SQL aggregates. The rows are
+    only fed if neither returns a result.
+
+    Results are cached by snapshot content; bump ``version`` whenever the
+    shape or meaning of :meth:`result` changes.
+    """
+
+    consumes = ()
+    version = 1
+
+    @classmethod
+    def fingerprint(cls, repository):
+        """Cache key material: the version plus what HEAD does not fix."""
+        return [cls.version, *(_source_fingerprint(repository, source) for source in cls.consumes)]
+
+    def columns(self, snapshot):
+        """Return the result computed from a :class:`repolens.snapshot.Snapshot`, or None."""
+        return None
+
+    def query(self, repository):
+        """Return the result computed in the database for a normalized snapshot, or None."""
         return None
 
-    result = {}
-
-    if analysis_type == 'file_count':
-        result['total_files'] = len(repository.packaged_data['files'])
-    elif analysis_type == 'commit_count':
-        result['total_commits'] = len(repository.packaged_data['commits'])
-    elif analysis_type == 'branch_count':
-        result['total_branches'] = len(repository.packaged_data['branches'])
-    elif analysis_type == 'file_types':
-        file_types = {}
-        for file in repository.packaged_data['files']:
-            ext = file['path'].split('.')[-1] if '.' in file['path'] else 'unknown'
-            file_types[ext] = file_types.get(ext, 0) + 1
-        result['file_types'] = file_types
+    def add_file(self, file):
+        pass
+
+    def add_commit(self, commit):
+        pass
+
+    def add_branch(self, branch):
+        pass
+
+    def add_file_history(self, row):
+        pass
+
+    def result(self):
+        raise NotImplementedError
+
+
+def register_analyzer(analysis_type):
+    """Register an :class:`Analyzer` subclass under ``analysis_type``."""
+    def decorator(cls):
+        unknown = set(cls.consumes) - set(SOURCES)
+        if unknown:
+            raise ValueError(f"Unknown analyzer sources: {', '.join(sorted(unknown))}")
+        _analyzers[analysis_type] = cls
+        return cls
+    return decorator
+
+
+def analysis_types():
+    return tuple(_analyzers)
+
+
+@register_analyzer('file_count')
+class FileCount(Analyzer):
+    consumes = ('files',)
+
+    def __init__(self):
+        self.total = 0
+
+    def add_file(self, file):
+        self.total += 1
+
+    def result(self):
+        return {'total_files': self.total}
+
+    def columns(self, snapshot):
+        return {'total_files': snapshot.counts['files']}
+
+    def query(self, repository):
+        return {'total_files': count_rows(repository, RepositoryFile)}
+
+
+@register_analyzer('commit_count')
+class CommitCount(Analyzer):
+    consumes = ('commits',)
+
+    def __init__(self):
+        self.total = 0
+
+    def add_commit(self, commit):
+        self.total += 1
+
+    def result(self):
+        return {'total_commits': self.total}
+
+    def columns(self, snapshot):
+        return {'total_commits': snapshot.counts['commits']}
+
+    def query(self, repository):
+        return {'total_commits': count_rows(repository, RepositoryCommit)}
+
+
+@register_analyzer('branch_count')
+class BranchCount(Analyzer):
+    consumes = ('branches',)
+
+    def __init__(self):
+        self.total = 0
+
+    def add_branch(self, branch):
+        self.total += 1
+
+    def result(self):
+        return {'total_branches': self.total}
+
+    def columns(self, snapshot):
+        return {'total_branches': snapshot.counts['branches']}
+
+    def query(self, repository):
+        return {'total_branches': count_rows(repository, RepositoryBranch)}
+
+
+@register_analyzer('file_types')
+class FileTypes(Analyzer):
+    consumes = ('files',)
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def add_file(self, file):
+        self.counts[file['extension']] += 1
+
+    def result(self):
+        return {'file_types': dict(self.counts)}
+
+    def columns(self, snapshot):
+        exts = snapshot.strings('table.exts')
+        return {'file_types': {exts[ext]: count for ext, count in Counter(snapshot.column('file.ext')).items()}}
+
+    def query(self, repository):
+        return {'file_types': dict(db.session.execute(
+            select(RepositoryFile.extension, func.count())
+            .where(RepositoryFile.repository_id == repository.id)
+            .group_by(RepositoryFile.extension)).all())}
+
+
+@register_analyzer('lines_of_code')
+class LinesOfCode(Analyzer):
+    # Line statistics are collected while packaging; files packaged without
+    # them (legacy rows, blobless clones) are reported as unscanned.
+    consumes = ('files',)
+    FIELDS = ('lines', 'code_lines', 'comment_lines', 'blank_lines')
+
+    def __init__(self):
+        self.totals = dict.fromkeys(self.FIELDS, 0)
+        self.binary_files = 0
+        self.unscanned_files = 0
+        self.languages = {}
+
+    def add_file(self, file):
+        if file['binary'] is None:
+            self.unscanned_files += 1
+            return
+        if file['binary']:
+            self.binary_files += 1
+            return
+        stats = self.languages.setdefault(file['language'] or 'unknown',
+                                          dict.fromkeys(('files',) + self.FIELDS, 0))
+        stats['files'] += 1
+        for field in self.FIELDS:
+            stats[field] += file[field] or 0
+            self.totals[field] += file[field] or 0
+
+    def columns(self, snapshot):
+        languages = [*snapshot.strings('table.languages'), 'unknown']
+        stats = [snapshot.column(f'file.{field}') for field in self.FIELDS]
+        for language, binary, *values in zip(snapshot.column('file.language'), snapshot.column('file.binary'),
+                                             *stats):
+            if binary == -1:
+                self.unscanned_files += 1
+                continue
+            if binary:
+                self.binary_files += 1
+                continue
+            # A missing language (-1) indexes the trailing 'unknown'
+            totals = self.languages.setdefault(languages[language], dict.fromkeys(('files',) + self.FIELDS, 0))
+            totals['files'] += 1
+            for field, value in zip(self.FIELDS, values):
+                totals[field] += value
+                self.totals[field] += value
+        return self.result()
+
+    def query(self, repository):
+        sums = [func.coalesce(func.sum(getattr(RepositoryFile, field)), 0) for field in self.FIELDS]
+        rows = db.session.execute(
+            select(RepositoryFile.language, RepositoryFile.binary, func.count(), *sums)
+            .where(RepositoryFile.repository_id == repository.id)
+            .group_by(RepositoryFile.language, RepositoryFile.binary))
+        for language, binary, files, *values in rows:
+            if binary is None:
+                self.unscanned_files += files
+                continue
+            if binary:
+                self.binary_files += files
+                continue
+            totals = self.languages.setdefault(language or 'unknown', dict.fromkeys(('files',) + self.FIELDS, 0))
+            totals['files'] += files
+            for field, value in zip(self.FIELDS, values):
+                totals[field] += value
+                self.totals[field] += value
+        return self.result()
+
+    def result(self):
+        return {'total_lines': self.totals['lines'], 'code_lines': self.totals['code_lines'],
+                'comment_lines': self.totals['comment_lines'], 'blank_lines': self.totals['blank_lines'],
+                'binary_files': self.binary_files, 'unscanned_files': self.unscanned_files,
+                'languages': self.languages}
+
+
+class HistoryAnalyzer(Analyzer):
+    """Base for analyses over the commit history as NumPy arrays.
+
+    Subclasses implement :meth:`summarize`, which receives a
+    :class:`repolens.history.History` loaded from the snapshot's columns
+    or, failing that, from the commit rows.
+    """
+
+    consumes = ('commits',)
+
+    def __init__(self):
+        self.commits = []
+
+    def add_commit(self, commit):
+        self.commits.append({key: commit[key] for key in ('date', 'author', 'insertions', 'deletions')})
+
+    def columns(self, snapshot):
+        return self.summarize(history.History.from_snapshot(snapshot))
+
+    def result(self):
+        return self.summarize(history.History.from_commits(self.commits))
+
+    def summarize(self, commits):
+        raise NotImplementedError
+
+
+@register_analyzer('contributors')
+class Contributors(HistoryAnalyzer):
+    TOP = 10
+
+    def summarize(self, commits):
+        return history.contributors(commits, self.TOP)
+
+
+@register_analyzer('commit_frequency')
+class CommitFrequency(HistoryAnalyzer):
+    def summarize(self, commits):
+        return history.weekly_histogram(commits)
+
+
+@register_analyzer('churn')
+class Churn(HistoryAnalyzer):
+    def summarize(self, commits):
+        return history.weekly_churn(commits)
+
+
+@register_analyzer('bus_factor')
+class BusFactor(HistoryAnalyzer):
+    def summarize(self, commits):
+        return history.bus_factor(commits)
+
+
+@register_analyzer('hotspots')
+class Hotspots(Analyzer):
+    """The files changed most often, by the most authors.
+
+    Rows arrive ordered by path, so one file is totalled at a time and
+    only the leading files are kept; memory does not grow with the tree.
+    """
+
+    consumes = ('file_history',)
+    TOP = 20
+
+    def __init__(self):
+        self.files = 0
+        self.changes = 0
+        self.current = None
+        self.leaders = []
+
+    def add_file_history(self, row):
+        current = self.current
+        if current is None or current['path'] != row['path']:
+            self._finish()
+            current = self.current = {'path': row['path'], 'changes': 0, 'authors': {}, 'insertions': 0,
+                                      'deletions': 0, 'last_modified': row['last_modified']}
+        current['changes'] += row['commits']
+        current['authors'][row['author']] = current['authors'].get(row['author'], 0) + row['commits']
+        current['insertions'] += row['insertions']
+        current['deletions'] += row['deletions']
+        current['last_modified'] = max(current['last_modified'], row['last_modified'])
+
+    def _finish(self):
+        current = self.current
+        if current is None:
+            return
+        self.files += 1
+        self.changes += current['changes']
+        authors = current['authors']
+        # Most commits first, ties broken by name for a stable order
+        current.update(authors=len(authors), top_author=min(authors, key=lambda name: (-authors[name], name)))
+        self.leaders.append(current)
+        if len(self.leaders) >= 2 * self.TOP:
+            self._trim()
+
+    def _trim(self):
+        self.leaders.sort(key=lambda item: (-item['changes'], -item['authors'], item['path']))
+        del self.leaders[self.TOP:]
+
+    def result(self):
+        self._finish()
+        self.current = None
+        self._trim()
+        return {'files': self.files, 'total_changes': self.changes, 'hotspots': self.leaders}
+
+
+def _source_fingerprint(repository, source):
+    # Files and commits follow from HEAD and the clone mode, which are
+    # already part of the key; branches and file history do not.
+    if source == 'branches':
+        return hashlib.sha256('\0'.join(list_branches(repository)).encode('utf-8')).hexdigest()
+    if source == 'file_history':
+        return list(summarize_file_history(repository))
+    return None
+
+
+def _feed(analyzers, source, snapshot, repository):
+    consumers = [a for a in analyzers if source in a.consumes]
+    if not consumers:
+        return
+    if source == 'files':
+        for file in snapshot.iter_file_rows() if snapshot else iter_file_rows(repository):
+            for analyzer in consumers:
+                analyzer.add_file(file)
+    elif source == 'commits':
+        for commit in snapshot.iter_commit_rows() if snapshot else iter_commit_rows(repository):
+            for analyzer in consumers:
+                analyzer.add_commit(commit)
+    elif source == 'branches':
+        for branch in snapshot.branches() if snapshot else list_branches(repository):
+            for analyzer in consumers:
+                analyzer.add_branch(branch)
     else:
+        # Not part of the columnar snapshot
+        for row in iter_file_history(repository):
+            for analyzer in consumers:
+                analyzer.add_file_history(row)
+
+
+def _compute(repository, types):
+    if not types:
+        return {}
+    analyzers = {analysis_type: _analyzers[analysis_type]() for analysis_type in types}
+    store = get_snapshot_store()
+    # Only an already built snapshot is worth reading; rebuilding one costs
+    # more than the SQL aggregates or the row stream below.
+    snapshot = store.open(repository, build=False) if store else None
+    try:
+        results = {}
+        for analysis_type, analyzer in analyzers.items():
+            result = analyzer.columns(snapshot) if snapshot is not None else None
+            if result is None and is_normalized(repository):
+                result = analyzer.query(repository)
+            if result is not None:
+                results[analysis_type] = result
+        # Each source is streamed once and fed to every remaining analyzer
+        pending = [a for t, a in analyzers.items() if t not in results]
+        for source in SOURCES:
+            _feed(pending, source, snapshot, repository)
+        for analysis_type, analyzer in analyzers.items():
+            if analysis_type not in results:
+                results[analysis_type] = analyzer.result()
+        return results
+    finally:
+        if snapshot is not None:
+            snapshot.close()
+
+
+def run_analyses(repo_id, types):
+    """Run several analyses of one snapshot and return ``{type: analysis_id}``.
+
+    Returns None for an unknown repository or analysis type. Analyses that
+    already exist for the snapshot are reused, cached results are used
+    where available, and everything else is computed in a single pass.
+    New ``Analysis`` rows are committed in one transaction.
+    """
+    types = list(dict.fromkeys(types))
+    if not types or any(analysis_type not in _analyzers for analysis_type in types):
+        return None
+    with span('analyze'):
+        return _run_analyses(repo_id, types)
+
+
+def _run_analyses(repo_id, types):
+    repository = db.session.get(Repository, repo_id)
+    if not repository:
         return None
 
-    analysis = Analysis(repository_id=repo_id, analysis_type=analysis_type, result=result)
-    db.session.add(analysis)
-    db.session.commit()
+    # Snapshots are immutable, so an earlier analysis of this row by the same
+    # analyzer version is reused as is; other snapshots with the same content
+    # share the cached result.
+    analysis_ids = {}
+    existing = (Analysis.query.filter(Analysis.repository_id == repo_id, Analysis.analysis_type.in_(types))
+                .order_by(Analysis.id))
+    for analysis in existing:
+        if analysis.analyzer_version == _analyzers[analysis.analysis_type].version:
+            analysis_ids[analysis.analysis_type] = analysis.id
 
-    return analysis.id
+    cache = get_analysis_cache()
+    keys = {t: snapshot_key(repository, t, _analyzers[t].fingerprint(repository))
+            for t in types if t not in analysis_ids}
+    results = {}
+    with span('analyze', 'cache'):
+        for analysis_type, key in keys.items():
+            result = cache.get(key) if key else None
+            if result is not None:
+                results[analysis_type] = result
+
+    with span('analyze', 'compute'):
+        computed = _compute(repository, [t for t in keys if t not in results])
+    for analysis_type, result in computed.items():
+        if keys[analysis_type]:
+            cache.set(keys[analysis_type], result)
+    results.update(computed)
+
+    analyses = [Analysis(repository_id=repo_id, analysis_type=t, analyzer_version=_analyzers[t].version,
+                         result=results[t]) for t in keys]
+    if analyses:
+        with span('analyze', 'save'):
+            db.session.add_all(analyses)
+            db.session.commit()
+    for analysis in analyses:
+        analysis_ids[analysis.analysis_type] = analysis.id
+
+    return {analysis_type: analysis_ids[analysis_type] for analysis_type in types}
+
+
+def analyze_repository(repo_id, analysis_type):
+    analysis_ids = run_analyses(repo_id, [analysis_type])
+    return analysis_ids[analysis_type] if analysis_ids else None
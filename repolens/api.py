@@ -1,20 +1,21 @@
-from flask import Blueprint, jsonify, request, current_app, send_file
-from repolens.packager import package_repository
-from repolens.analyzer import analyze_repository
+from flask import Blueprint, Response, jsonify, request, current_app, send_file, stream_with_context, url_for
+from repolens.analyzer import run_analyses
+from repolens.packager import validate_package_options
 from repolens.models import Repository, Analysis
+from repolens import database
 from repolens.database import db
-from flask_caching import Cache
-import tempfile
-import json
+from repolens.storage import delete_package, iter_dependencies, list_packages, latest_snapshot
+from repolens import (jobs, mirror, export, compare, browser, analysis_cache, batch, loc, snapshot, search, context,
+                      metrics, listing, blobs, aio, dependencies)
+import io
 import os
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.chrome.options import Options
-from sqlalchemy.orm import joinedload
+from datetime import timezone
+from sqlalchemy.orm import joinedload, load_only
 
-api_bp = Blueprint('api', __name__)
-cache = Cache(config={'CACHE_TYPE': 'SimpleCache'})
+api_bp = Blueprint('api', __name__, url_prefix='/api')
+
+# Request fields passed through to package_repository as keyword arguments
+PACKAGE_OPTIONS = ('incremental', 'listing', 'depth', 'since', 'partial')
 
 @api_bp.route('/package', methods=['POST'])
 def package():
@@ -22,31 +23,120 @@ def package():
     if not data or 'repo_url' not in data:
         return jsonify({'error': 'Missing repo_url'}), 400
 
-    with current_app.app_context():
-        repo_id, error = package_repository(data['repo_url'])
+    options = {key: data[key] for key in PACKAGE_OPTIONS if key in data}
+    error = validate_package_options(**options)
+    if error:
+        return jsonify({'error': error}), 400
+
+    job_id = jobs.get_queue().submit('package', {'repo_url': data['repo_url'], 'options': options})
+    response = jsonify({'job_id': job_id, 'status': jobs.QUEUED})
+    response.headers['Location'] = url_for('api.get_job', job_id=job_id)
+    return response, 202
+
+@api_bp.route('/package/batch', methods=['POST'])
+def package_batch():
+    data = request.json
+    repo_urls = data.get('repo_urls') if data else None
+    if not repo_urls or not isinstance(repo_urls, list) or not all(isinstance(url, str) for url in repo_urls):
+        return jsonify({'error': 'Missing repo_urls'}), 400
+
+    options = {key: data[key] for key in PACKAGE_OPTIONS if key in data}
+    error = validate_package_options(**options)
     if error:
-        return jsonify({'error': error}), 500
-    
-    repository = Repository.query.get(repo_id)
-    return jsonify({'repo_id': repo_id, 'repo_name': repository.name}), 201
+        return jsonify({'error': error}), 400
+    if 'workers' in data:
+        if not isinstance(data['workers'], int) or isinstance(data['workers'], bool) or data['workers'] < 1:
+            return jsonify({'error': 'workers must be a positive integer'}), 400
+        options['max_workers'] = data['workers']
+
+    job_id = jobs.get_queue().submit('package_batch', {'repo_urls': repo_urls, 'options': options})
+    response = jsonify({'job_id': job_id, 'status': jobs.QUEUED})
+    response.headers['Location'] = url_for('api.get_job', job_id=job_id)
+    return response, 202
+
+@api_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.get_queue().get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+
+    return jsonify({
+        'id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'result': job['result'],
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at']
+    })
 
 @api_bp.route('/analyze', methods=['POST'])
 def analyze():
     data = request.json
-    if not data or 'repo_id' not in data or 'analysis_type' not in data:
+    if not data or 'repo_id' not in data or not ('analysis_type' in data or 'analysis_types' in data):
         return jsonify({'error': 'Missing repo_id or analysis_type'}), 400
 
-    with current_app.app_context():
-        analysis_id = analyze_repository(data['repo_id'], data['analysis_type'])
-    if not analysis_id:
+    # A list of types is analyzed in one pass and answered with one id per type
+    types = data.get('analysis_types', data.get('analysis_type'))
+    single = isinstance(types, str)
+    if single:
+        types = [types]
+    if not isinstance(types, list) or not all(isinstance(t, str) for t in types):
+        return jsonify({'error': 'Invalid repo_id or analysis_type'}), 400
+
+    analysis_ids = run_analyses(data['repo_id'], types)
+    if not analysis_ids:
         return jsonify({'error': 'Invalid repo_id or analysis_type'}), 400
 
-    return jsonify({'analysis_id': analysis_id}), 201
+    if single:
+        return jsonify({'analysis_id': analysis_ids[types[0]]}), 201
+    return jsonify({'analysis_ids': analysis_ids}), 201
+
+@api_bp.route('/analysis-cache/stats', methods=['GET'])
+def get_analysis_cache_stats():
+    return jsonify(analysis_cache.get_analysis_cache().stats())
+
+def _listing_response(key, items, next_cursor):
+    response = jsonify({key: items, 'next_cursor': next_cursor})
+    # Rows never change once written, so a page only changes when rows are
+    # added or removed; hashing the body lets polling clients get a 304.
+    response.add_etag()
+    return response.make_conditional(request)
+
+@api_bp.route('/repositories', methods=['GET'])
+def list_repositories():
+    try:
+        fields = listing.parse_fields(request.args.get('fields'), listing.REPOSITORY_FIELDS,
+                                      listing.DEFAULT_REPOSITORY_FIELDS)
+        items, next_cursor = listing.list_repositories(
+            fields, request.args.get('name'), request.args.get('url'), request.args.get('since'),
+            request.args.get('limit', listing.DEFAULT_LIMIT, type=int), request.args.get('cursor'))
+    except listing.ListingError as e:
+        return jsonify({'error': str(e)}), 400
+    return _listing_response('repositories', items, next_cursor)
+
+@api_bp.route('/analyses', methods=['GET'])
+def list_analyses():
+    try:
+        fields = listing.parse_fields(request.args.get('fields'), listing.ANALYSIS_FIELDS,
+                                      listing.DEFAULT_ANALYSIS_FIELDS)
+        items, next_cursor = listing.list_analyses(
+            fields, request.args.get('repository_id', type=int), request.args.get('analysis_type'),
+            request.args.get('since'), request.args.get('limit', listing.DEFAULT_LIMIT, type=int),
+            request.args.get('cursor'))
+    except listing.ListingError as e:
+        return jsonify({'error': str(e)}), 400
+    return _listing_response('analyses', items, next_cursor)
+
+# Columns the single-repository endpoints return; packaged_data is left unloaded
+_SUMMARY_COLUMNS = (Repository.name, Repository.url, Repository.created_at)
 
 @api_bp.route('/repository/<int:repo_id>', methods=['GET'])
 def get_repository(repo_id):
     with current_app.app_context():
-        repository = Repository.query.get(repo_id)
+        repository = db.session.get(Repository, repo_id, options=[load_only(*_SUMMARY_COLUMNS)])
     if not repository:
         return jsonify({'error': 'Repository not found'}), 404
 
@@ -57,6 +147,46 @@ def get_repository(repo_id):
         'created_at': repository.created_at.isoformat()
     })
 
+@api_bp.route('/repository/<int:repo_id>', methods=['DELETE'])
+def delete_repository(repo_id):
+    repository = db.session.get(Repository, repo_id)
+    if not repository:
+        return jsonify({'error': 'Repository not found'}), 404
+
+    store = snapshot.get_snapshot_store()
+    if store is not None:
+        store.remove(repository)
+    blob_store = blobs.get_blob_store()
+    if blob_store is not None:
+        blob_store.remove_snapshot(repository.id)
+    repo_url = repository.url
+    delete_package(repository)
+    dependencies.get_dependency_index().invalidate()
+    index = search.get_search_index()
+    if index is not None:
+        # Search serves the newest remaining snapshot of the URL, if any
+        previous = latest_snapshot(repo_url)
+        index.forget(repo_id, repo_url, previous, search.mirror_path(previous) if previous else None)
+    # Blobs shared with other snapshots keep their references
+    collected = blob_store.collect() if blob_store is not None else 0
+    return jsonify({'deleted': repo_id, 'blobs_collected': collected})
+
+@api_bp.route('/blobs/<sha>', methods=['GET'])
+def get_blob(sha):
+    store = blobs.get_blob_store()
+    if store is None:
+        return jsonify({'error': 'The blob store is disabled'}), 404
+    content = store.get(sha)
+    if content is None:
+        return jsonify({'error': 'Blob not found'}), 404
+    response = Response(content, mimetype='application/octet-stream')
+    # Content-addressed, so the sha is a strong validator that never goes stale
+    response.set_etag(sha)
+    response.cache_control.public = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
 @api_bp.route('/analysis/<int:analysis_id>', methods=['GET'])
 def get_analysis(analysis_id):
     with current_app.app_context():
@@ -76,7 +206,7 @@ def get_analysis(analysis_id):
 @api_bp.route('/repository/repolens', methods=['GET'])
 def get_repolens_repository():
     with current_app.app_context():
-        repository = Repository.query.filter_by(name='repolens').first()
+        repository = Repository.query.options(load_only(*_SUMMARY_COLUMNS)).filter_by(name='repolens').first()
     if not repository:
         return jsonify({'error': 'RepoLens repository not found'}), 404
 
@@ -88,19 +218,126 @@ def get_repolens_repository():
     })
 
 @api_bp.route('/download/<int:repo_id>', methods=['GET'])
-@cache.cached(timeout=300)  # Cache for 5 minutes
 def download_repository_content(repo_id):
-    with current_app.app_context():
-        repository = Repository.query.get(repo_id)
+    repository = db.session.get(Repository, repo_id)
     if not repository:
         return jsonify({'error': 'Repository not found'}), 404
 
-    # Create a temporary file to store the repository content
-    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.txt') as temp_file:
-        json.dump(repository.packaged_data, temp_file, indent=2)
+    fmt = request.args.get('format', 'json')
+    compression = request.args.get('compression', 'none')
+    try:
+        export.check_options(fmt, compression)
+    except export.ExportError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # The package is generated on the fly; a Range request needs the total
+    # length up front, which costs one extra generation pass but no memory.
+    complete_length = None
+    if request.range:
+        complete_length = sum(len(chunk) for chunk in export.package_stream(repository, fmt, compression))
+
+    response = Response(stream_with_context(export.package_stream(repository, fmt, compression)),
+                        mimetype=export.package_mimetype(fmt, compression))
+    response.headers['Content-Disposition'] = (
+        f'attachment; filename="{export.package_filename(repository, fmt, compression)}"')
+    response.set_etag(export.package_etag(repository, fmt, compression))
+    if repository.created_at:
+        response.last_modified = repository.created_at.replace(tzinfo=timezone.utc)
+    return response.make_conditional(request, accept_ranges=True, complete_length=complete_length)
+
+@api_bp.route('/compare', methods=['GET'])
+def compare_repositories():
+    base_id = request.args.get('base', type=int)
+    target_id = request.args.get('target', type=int)
+    if base_id is None or target_id is None:
+        return jsonify({'error': 'Missing base or target'}), 400
+    base = db.session.get(Repository, base_id)
+    target = db.session.get(Repository, target_id)
+    if not base or not target:
+        return jsonify({'error': 'Repository not found'}), 404
+
+    fmt = request.args.get('format', 'json')
+    try:
+        compare.check_comparable(base, target, fmt)
+    except compare.CompareError as e:
+        return jsonify({'error': str(e)}), 400
+
+    response = Response(stream_with_context(export.buffered(compare.compare_stream(base, target, fmt))),
+                        mimetype=compare.FORMATS[fmt])
+    response.set_etag(compare.compare_etag(base, target, fmt))
+    return response.make_conditional(request)
+
+@api_bp.route('/context/<int:repo_id>', methods=['GET'])
+def get_repository_context(repo_id):
+    repository = db.session.get(Repository, repo_id)
+    if not repository:
+        return jsonify({'error': 'Repository not found'}), 404
+
+    budget = request.args.get('budget', context.DEFAULT_BUDGET, type=int)
+    chunk_tokens = request.args.get('chunk_tokens', context.DEFAULT_CHUNK_TOKENS, type=int)
+    try:
+        context.check_options(budget, chunk_tokens)
+    except context.ContextError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        records = context.get_context_packer().pack(repository, budget, chunk_tokens)
+    except context.ContextError as e:
+        # The mirror was evicted or the snapshot came from a partial clone
+        return jsonify({'error': str(e)}), 409
+    return Response(stream_with_context(export.buffered(context.context_stream(records))),
+                    mimetype='application/x-ndjson')
 
-    # Send the file as an attachment
-    return send_file(temp_file.name, as_attachment=True, download_name=f"{repository.name}_content.txt")
+@api_bp.route('/search', methods=['GET'])
+def search_repositories():
+    index = search.get_search_index()
+    if index is None:
+        return jsonify({'error': 'Search is disabled'}), 404
+
+    limit = request.args.get('limit', search.DEFAULT_LIMIT, type=int)
+    if not 1 <= limit <= search.MAX_LIMIT:
+        return jsonify({'error': f'limit must be between 1 and {search.MAX_LIMIT}'}), 400
+    try:
+        results, next_cursor = index.search(request.args.get('q'), request.args.get('path'),
+                                            request.args.get('repo_url'), limit, request.args.get('cursor'))
+    except search.SearchError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'results': results, 'next_cursor': next_cursor})
+
+def _transitive():
+    return request.args.get('transitive', '0').lower() not in ('0', 'false', '')
+
+@api_bp.route('/dependencies/<int:repo_id>', methods=['GET'])
+def get_dependencies(repo_id):
+    repository = db.session.get(Repository, repo_id, options=[load_only(*_SUMMARY_COLUMNS)])
+    if not repository:
+        return jsonify({'error': 'Repository not found'}), 404
+
+    direct = list(iter_dependencies(repository))
+    result = {'repository_id': repo_id, 'packages': list_packages(repository), 'dependencies': direct}
+    if _transitive():
+        max_depth = request.args.get('max_depth', dependencies.DEFAULT_MAX_DEPTH, type=int)
+        try:
+            dependencies.check_depth(max_depth)
+        except dependencies.DependencyError as e:
+            return jsonify({'error': str(e)}), 400
+        # Followed through the packages other packaged repositories publish
+        keys = sorted({(row['ecosystem'], row['name']) for row in direct})
+        result['transitive'] = dependencies.get_dependency_index().dependencies(keys, max_depth)
+    return jsonify(result)
+
+@api_bp.route('/dependents', methods=['GET'])
+def get_dependents():
+    max_depth = request.args.get('max_depth', dependencies.DEFAULT_MAX_DEPTH, type=int)
+    try:
+        keys = dependencies.package_keys(request.args.get('name'), request.args.get('ecosystem'))
+        dependencies.check_depth(max_depth)
+    except dependencies.DependencyError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Only the latest snapshot of each repository URL counts
+    found = dependencies.get_dependency_index().dependents(keys, _transitive(), max_depth)
+    return jsonify({'packages': [{'ecosystem': ecosystem, 'name': name} for ecosystem, name in keys],
+                    'dependents': found})
 
 @api_bp.route('/screenshot', methods=['POST'])
 def take_screenshot():
@@ -109,33 +346,35 @@ def take_screenshot():
         return jsonify({'error': 'Missing url'}), 400
 
     url = data['url']
-    
-    # Set up Chrome options
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-
-    # Set up the Chrome WebDriver
-    service = Service(ChromeDriverManager().install())
-    driver = webdriver.Chrome(service=service, options=chrome_options)
 
     try:
-        # Navigate to the URL and take a screenshot
-        driver.get(url)
-        screenshot = driver.get_screenshot_as_png()
-
-        # Save the screenshot to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as temp_file:
-            temp_file.write(screenshot)
-            temp_file_path = temp_file.name
-
-        # Send the file as an attachment
-        return send_file(temp_file_path, mimetype='image/png', as_attachment=True, download_name='screenshot.png')
+        with metrics.span('screenshot'), browser.get_browser_pool().driver() as driver:
+            # Navigate to the URL and take a screenshot
+            with metrics.span('screenshot', 'navigate'):
+                driver.get(url)
+            with metrics.span('screenshot', 'capture'):
+                screenshot = driver.get_screenshot_as_png()
+    except browser.PoolBusy as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        driver.quit()
+
+    # Send the screenshot straight from memory
+    return send_file(io.BytesIO(screenshot), mimetype='image/png', as_attachment=True, download_name='screenshot.png')
 
 def init_app(app):
-    cache.init_app(app)
+    if 'sqlalchemy' not in app.extensions:
+        database.init_app(app)
+    metrics.init_app(app)
+    mirror.init_app(app)
+    loc.init_app(app)
+    jobs.init_app(app)
+    browser.init_app(app)
+    aio.init_app(app)
+    analysis_cache.init_app(app)
+    snapshot.init_app(app)
+    blobs.init_app(app)
+    search.init_app(app)
+    context.init_app(app)
+    dependencies.init_app(app)
+    batch.init_app(app)
@@ -0,0 +1,140 @@
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from repolens.database import db
+from repolens.mirror import MirrorCache, get_mirror_cache
+from repolens.packager import (base_snapshot, collect_repository, store_repository,
+                               validate_package_options)
+from repolens.utils import GitError
+
+
+def _collect(mirror_root, repo_url, base, options):
+    # Runs in a worker process: git and filesystem work only, no database.
+    started = time.perf_counter()
+    try:
+        collected = collect_repository(repo_url, base, mirror_cache=MirrorCache(mirror_root), **options)
+    except GitError as e:
+        return None, f"Error cloning repository: {str(e)}", time.perf_counter() - started
+    return collected, None, time.perf_counter() - started
+
+
+def package_batch(repo_urls, max_workers=None, progress=None, incremental=True, **options):
+    """Package many repositories concurrently and summarize the outcome.
+
+    Cloning, tree listing and history extraction run in a pool of worker
+    processes; results are written to the database from the calling
+    process as they arrive. One failing repository does not stop the
+    others. Must be called inside an application context.
+    """
+    started = time.perf_counter()
+    repo_urls = list(dict.fromkeys(repo_urls))
+    max_workers = max_workers or current_app.config['REPOLENS_BATCH_WORKERS']
+    mirror_root = get_mirror_cache().root
+    results = {url: {'repo_url': url, 'repo_id': None, 'repo_name': None, 'error': None} for url in repo_urls}
+    counters = {'total': len(repo_urls), 'completed': 0, 'failed': 0}
+
+    if progress is not None:
+        progress('packaging', **counters)
+
+    error = validate_package_options(incremental, **options)
+    if error:
+        for result in results.values():
+            result['error'] = error
+        counters['failed'] = counters['completed'] = len(repo_urls)
+        repo_urls = []
+
+    # Spawned workers do not inherit the parent's threads, locks or
+    # database connections.
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers or None, mp_context=context) as pool:
+        futures = {
+            pool.submit(_collect, mirror_root, url, base_snapshot(url) if incremental else None, options): url
+            for url in repo_urls
+        }
+        try:
+            for future in as_completed(futures):
+                url = futures[future]
+                result = results[url]
+                try:
+                    collected, error, seconds = future.result()
+                except Exception as e:
+                    collected, error, seconds = None, f"{type(e).__name__}: {e}", None
+                if collected is not None:
+                    try:
+                        repository = store_repository(collected)
+                    except Exception as e:
+                        # Leave the session usable for the repositories still to come
+                        db.session.rollback()
+                        error = f"Error storing repository: {type(e).__name__}: {e}"
+                    else:
+                        result.update(repo_id=repository.id, repo_name=repository.name,
+                                      files=_file_count(collected), commits=_commit_count(collected))
+                result.update(error=error, seconds=round(seconds, 3) if seconds is not None else None)
+                counters['completed'] += 1
+                counters['failed'] += error is not None
+                if progress is not None:
+                    progress(**counters)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    if progress is not None:
+        progress('done', **counters)
+    elapsed = time.perf_counter() - started
+    succeeded = counters['completed'] - counters['failed']
+    return {
+        'results': list(results.values()),
+        'total': counters['total'],
+        'succeeded': succeeded,
+        'failed': counters['failed'],
+        'elapsed_seconds': round(elapsed, 3),
+        'repos_per_second': round(succeeded / elapsed, 3) if elapsed else None,
+    }
+
+
+def _file_count(collected):
+    if 'changes' in collected:
+        return len(collected['changes']['changed_files'])
+    return len(collected['files'])
+
+
+def _commit_count(collected):
+    if 'changes' in collected:
+        return len(collected['changes']['new_commits'])
+    return len(collected['commits'])
+
+
+@click.command('package-batch')
+@click.argument('repo_urls', nargs=-1)
+@click.option('--file', '-f', 'url_file', type=click.File('r'), help='Read repository URLs from a file, one per line.')
+@click.option('--workers', '-w', type=int, default=None, help='Number of worker processes.')
+@click.option('--depth', type=int, default=None, help='Only package the most recent commits.')
+@click.option('--since', default=None, help='Only package commits after this ISO 8601 date.')
+@click.option('--partial', is_flag=True, help='Use blobless (--filter=blob:none) clones.')
+@click.option('--full', is_flag=True, help='Do not build on previous snapshots.')
+@with_appcontext
+def package_batch_command(repo_urls, url_file, workers, depth, since, partial, full):
+    """Package many repositories in parallel and print a JSON summary."""
+    urls = list(repo_urls)
+    if url_file:
+        urls += [line.strip() for line in url_file if line.strip() and not line.startswith('#')]
+    if not urls:
+        raise click.UsageError('No repository URLs given')
+
+    summary = package_batch(urls, max_workers=workers, incremental=not full,
+                            depth=depth, since=since, partial=partial)
+    click.echo(json.dumps(summary, indent=2))
+    if summary['failed']:
+        sys.exit(1)
+
+
+def init_app(app):
+    app.config.setdefault('REPOLENS_BATCH_WORKERS', int(os.environ.get('REPOLENS_BATCH_WORKERS', os.cpu_count() or 1)))
+    app.cli.add_command(package_batch_command)
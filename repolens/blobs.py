@@ -0,0 +1,195 @@
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+from repolens.database import db, apply_sqlite_pragmas, set_sqlite_journal_mode, sqlite_pragmas_enabled
+from repolens.models import RepositoryFile
+from repolens.search import read_blobs
+
+# Blobs over this size are not stored
+MAX_BLOB_BYTES = 16 * 1024 * 1024
+# Shas read from git per ``cat-file`` process
+READ_BATCH = 5000
+
+
+class BlobStore:
+    """Content-addressed store of file contents, keyed by git blob sha.
+
+    Lives in its own SQLite file. Each blob is stored once, compressed,
+    however many snapshots (or forks) contain it. A snapshot holds one
+    reference per distinct blob; ``refs`` counts the snapshots holding a
+    blob, and :meth:`collect` deletes blobs nobody refers to any more.
+    Packaging a snapshot only reads and writes the blobs that are new to
+    the store.
+    """
+
+    def __init__(self, path, max_blob_bytes=MAX_BLOB_BYTES, pragmas=True):
+        self.path = path
+        self.max_blob_bytes = max_blob_bytes
+        self.pragmas = pragmas
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def _connect(self):
+        if not self._schema_ready:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if self.pragmas:
+            apply_sqlite_pragmas(conn)
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    if self.pragmas:
+                        set_sqlite_journal_mode(conn)
+                    self._create_schema(conn)
+                    self._schema_ready = True
+        return conn
+
+    def _create_schema(self, conn):
+        conn.execute('CREATE TABLE IF NOT EXISTS blobs (id INTEGER PRIMARY KEY, sha TEXT NOT NULL UNIQUE, '
+                     'size INTEGER NOT NULL, data BLOB NOT NULL, refs INTEGER NOT NULL DEFAULT 0)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_blobs_unreferenced ON blobs (refs) WHERE refs <= 0')
+        # Keyed by Repository id; a reused id first releases the stale references
+        conn.execute('CREATE TABLE IF NOT EXISTS snapshot_blobs (snapshot INTEGER NOT NULL, sha TEXT NOT NULL, '
+                     'PRIMARY KEY (snapshot, sha)) WITHOUT ROWID')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_snapshot_blobs_sha ON snapshot_blobs (sha)')
+
+    @contextmanager
+    def _transaction(self, conn):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    @staticmethod
+    def _release(conn, snapshot):
+        conn.execute('UPDATE blobs SET refs = refs - 1 WHERE sha IN '
+                     '(SELECT sha FROM snapshot_blobs WHERE snapshot = ?)', (snapshot,))
+        conn.execute('DELETE FROM snapshot_blobs WHERE snapshot = ?', (snapshot,))
+
+    def _reference(self, conn, snapshot, shas):
+        # Record the snapshot's references, including to blobs not stored
+        # yet, and return the shas still missing. Present blobs are counted
+        # in the same transaction, so a concurrent collect() cannot delete
+        # one between the check and the reference.
+        with self._transaction(conn):
+            self._release(conn, snapshot)
+            conn.executemany('INSERT OR IGNORE INTO snapshot_blobs (snapshot, sha) VALUES (?, ?)',
+                             ((snapshot, sha) for sha in shas))
+            conn.execute('UPDATE blobs SET refs = refs + 1 WHERE sha IN '
+                         '(SELECT sha FROM snapshot_blobs WHERE snapshot = ?)', (snapshot,))
+            return [sha for sha, in conn.execute(
+                'SELECT sha FROM snapshot_blobs WHERE snapshot = ? AND sha NOT IN (SELECT sha FROM blobs) '
+                'ORDER BY sha', (snapshot,))]
+
+    def add_snapshot(self, repository, git_dir):
+        """Store the blobs of the repository's files and reference them.
+
+        Only blobs not yet in the store are read from ``git_dir``. Returns
+        ``{'blobs', 'written', 'bytes_written'}``: distinct blobs referenced,
+        blobs newly stored and their uncompressed size.
+        """
+        shas = set(db.session.scalars(select(RepositoryFile.blob).distinct().where(
+            RepositoryFile.repository_id == repository.id, RepositoryFile.blob.is_not(None))))
+        conn = self._connect()
+        try:
+            missing = self._reference(conn, repository.id, shas)
+            written = size = 0
+            # Blobs are written as they are read, in batches, so memory stays
+            # bounded. A new blob starts with one reference per snapshot
+            # already holding it, so another packager writing the same blob
+            # is harmless. Unreadable blobs keep their reference rows and
+            # are counted if a later snapshot stores them.
+            for start in range(0, len(missing), READ_BATCH):
+                rows = [(sha, len(content), zlib.compress(content, 1), sha)
+                        for sha, content in read_blobs(git_dir, missing[start:start + READ_BATCH],
+                                                       self.max_blob_bytes, binary=True)
+                        if content is not None]
+                with self._transaction(conn):
+                    conn.executemany('INSERT OR IGNORE INTO blobs (sha, size, data, refs) VALUES '
+                                     '(?, ?, ?, (SELECT COUNT(*) FROM snapshot_blobs WHERE sha = ?))', rows)
+                written += len(rows)
+                size += sum(row[1] for row in rows)
+            referenced = conn.execute('SELECT COUNT(*) FROM snapshot_blobs s JOIN blobs b ON b.sha = s.sha '
+                                      'WHERE s.snapshot = ?', (repository.id,)).fetchone()[0]
+        finally:
+            conn.close()
+        return {'blobs': referenced, 'written': written, 'bytes_written': size}
+
+    def remove_snapshot(self, repository_id):
+        """Drop the snapshot's references; the blobs stay until :meth:`collect`."""
+        conn = self._connect()
+        try:
+            with self._transaction(conn):
+                self._release(conn, repository_id)
+        finally:
+            conn.close()
+
+    def collect(self):
+        """Delete unreferenced blobs and return how many were removed."""
+        conn = self._connect()
+        try:
+            with self._transaction(conn):
+                return conn.execute('DELETE FROM blobs WHERE refs <= 0').rowcount
+        finally:
+            conn.close()
+
+    def get(self, sha):
+        """Return the content of blob ``sha``, or None when it is not stored."""
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT data FROM blobs WHERE sha = ?', (sha,)).fetchone()
+        finally:
+            conn.close()
+        return zlib.decompress(row[0]) if row else None
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            blobs, size, stored, unreferenced = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(data)), 0), '
+                'COALESCE(SUM(refs <= 0), 0) FROM blobs').fetchone()
+            snapshots = conn.execute('SELECT COUNT(DISTINCT snapshot) FROM snapshot_blobs').fetchone()[0]
+        finally:
+            conn.close()
+        return {'blobs': blobs, 'bytes': size, 'stored_bytes': stored, 'unreferenced': unreferenced,
+                'snapshots': snapshots}
+
+
+def get_blob_store(app=None):
+    """Return the app's blob store, or None when it is disabled."""
+    app = app or current_app
+    return app.extensions.get('repolens_blobs')
+
+
+@click.command('blobs-gc')
+@with_appcontext
+def blobs_gc_command():
+    """Delete stored blobs no snapshot refers to and print the store's stats."""
+    store = get_blob_store()
+    if store is None:
+        raise click.UsageError('The blob store is disabled (REPOLENS_BLOB_DB is not set)')
+    click.echo(f'Removed {store.collect()} unreferenced blobs')
+    click.echo(json.dumps(store.stats()))
+
+
+def init_app(app):
+    app.config.setdefault('REPOLENS_BLOB_DB', os.environ.get(
+        'REPOLENS_BLOB_DB', os.path.join(os.path.expanduser('~'), '.cache', 'repolens', 'blobs.db')))
+    app.config.setdefault('REPOLENS_BLOB_MAX_BYTES', int(os.environ.get('REPOLENS_BLOB_MAX_BYTES', MAX_BLOB_BYTES)))
+    if app.config['REPOLENS_BLOB_DB']:
+        app.extensions['repolens_blobs'] = BlobStore(app.config['REPOLENS_BLOB_DB'],
+                                                     app.config['REPOLENS_BLOB_MAX_BYTES'],
+                                                     sqlite_pragmas_enabled(app))
+    else:
+        app.extensions.pop('repolens_blobs', None)
+    app.cli.add_command(blobs_gc_command)
@@ -0,0 +1,214 @@
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.chrome.options import Options
+from webdriver_manager.chrome import ChromeDriverManager
+
+
+class PoolBusy(Exception):
+    pass
+
+
+class _PooledDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+
+
+class BrowserPool:
+    """A bounded pool of reusable WebDriver instances.
+
+    At most ``size`` drivers exist at once and each one serves one request at
+    a time. Up to ``max_waiting`` further requests may wait ``acquire_timeout``
+    seconds for a driver; beyond that :class:`PoolBusy` is raised. Drivers are
+    health-checked when handed out and replaced after ``max_uses`` requests or
+    after any error during use.
+    """
+
+    def __init__(self, factory, size=2, max_uses=50, max_waiting=10, acquire_timeout=30):
+        self.factory = factory
+        self.size = size
+        self.max_uses = max_uses
+        self.max_waiting = max_waiting
+        self.acquire_timeout = acquire_timeout
+        self._idle = []
+        self._total = 0
+        self._waiting = 0
+        self._condition = threading.Condition()
+
+    def warm(self):
+        """Start drivers until the pool holds ``size`` of them."""
+        while True:
+            with self._condition:
+                if self._total >= self.size:
+                    return
+                self._total += 1
+            try:
+                pooled = _PooledDriver(self.factory())
+            except Exception:
+                self._discard(None)
+                raise
+            self._release(pooled)
+
+    def warm_in_background(self, on_error=None):
+        """Run :meth:`warm` in a daemon thread so startup is not held up by it."""
+        def run():
+            try:
+                self.warm()
+            except Exception as e:
+                if on_error is not None:
+                    on_error(e)
+
+        thread = threading.Thread(target=run, name='repolens-browser-warm', daemon=True)
+        thread.start()
+        return thread
+
+    @contextmanager
+    def driver(self):
+        pooled = self._acquire()
+        try:
+            yield pooled.driver
+        except BaseException:
+            self._discard(pooled)
+            raise
+        pooled.uses += 1
+        if pooled.uses >= self.max_uses:
+            self._discard(pooled)
+        else:
+            self._reset(pooled)
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._condition:
+            if self._waiting >= self.max_waiting and not self._idle and self._total >= self.size:
+                raise PoolBusy('Too many screenshot requests are waiting')
+            self._waiting += 1
+            try:
+                while not self._idle and self._total >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolBusy('Timed out waiting for a browser')
+                    self._condition.wait(remaining)
+                if self._idle:
+                    pooled = self._idle.pop()
+                else:
+                    pooled = None
+                    self._total += 1
+            finally:
+                self._waiting -= 1
+
+        if pooled is not None and self._healthy(pooled):
+            return pooled
+        if pooled is not None:
+            self._quit(pooled)
+        try:
+            return _PooledDriver(self.factory())
+        except Exception:
+            self._discard(None)
+            raise
+
+    @staticmethod
+    def _healthy(pooled):
+        try:
+            pooled.driver.current_url
+        except Exception:
+            return False
+        return True
+
+    def _reset(self, pooled):
+        try:
+            pooled.driver.delete_all_cookies()
+            pooled.driver.get('about:blank')
+        except Exception:
+            self._discard(pooled)
+            return
+        self._release(pooled)
+
+    def _release(self, pooled):
+        with self._condition:
+            self._idle.append(pooled)
+            self._condition.notify()
+
+    def _discard(self, pooled):
+        if pooled is not None:
+            self._quit(pooled)
+        with self._condition:
+            self._total -= 1
+            self._condition.notify()
+
+    @staticmethod
+    def _quit(pooled):
+        try:
+            pooled.driver.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._total -= len(idle)
+        for pooled in idle:
+            self._quit(pooled)
+
+
+class ChromeFactory:
+    """Builds headless Chrome drivers, resolving the driver binary only once."""
+
+    def __init__(self, driver_path=None, page_load_timeout=30):
+        self.driver_path = driver_path
+        self.page_load_timeout = page_load_timeout
+        self._lock = threading.Lock()
+
+    def _resolve_driver_path(self):
+        with self._lock:
+            if self.driver_path is None:
+                self.driver_path = ChromeDriverManager().install()
+        return self.driver_path
+
+    def __call__(self):
+        chrome_options = Options()
+        chrome_options.add_argument("--headless")
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--disable-dev-shm-usage")
+
+        service = Service(self._resolve_driver_path())
+        driver = webdriver.Chrome(service=service, options=chrome_options)
+        driver.set_page_load_timeout(self.page_load_timeout)
+        return driver
+
+
+def get_browser_pool(app=None):
+    app = app or current_app
+    return app.extensions['repolens_browsers']
+
+
+def init_app(app):
+    app.config.setdefault('CHROMEDRIVER_PATH', os.environ.get('CHROMEDRIVER_PATH'))
+    app.config.setdefault('REPOLENS_BROWSER_POOL_SIZE', int(os.environ.get('REPOLENS_BROWSER_POOL_SIZE', 2)))
+    app.config.setdefault('REPOLENS_BROWSER_MAX_USES', int(os.environ.get('REPOLENS_BROWSER_MAX_USES', 50)))
+    app.config.setdefault('REPOLENS_BROWSER_MAX_WAITING', int(os.environ.get('REPOLENS_BROWSER_MAX_WAITING', 10)))
+    app.config.setdefault('REPOLENS_BROWSER_ACQUIRE_TIMEOUT',
+                          float(os.environ.get('REPOLENS_BROWSER_ACQUIRE_TIMEOUT', 30)))
+    app.config.setdefault('REPOLENS_BROWSER_PAGE_TIMEOUT', float(os.environ.get('REPOLENS_BROWSER_PAGE_TIMEOUT', 30)))
+    # Start the pool's browsers (and resolve the driver binary) at startup
+    # rather than on the first screenshot request
+    app.config.setdefault('REPOLENS_BROWSER_WARM', os.environ.get('REPOLENS_BROWSER_WARM', '0') != '0')
+
+    factory = ChromeFactory(app.config['CHROMEDRIVER_PATH'], app.config['REPOLENS_BROWSER_PAGE_TIMEOUT'])
+    pool = BrowserPool(
+        factory,
+        size=app.config['REPOLENS_BROWSER_POOL_SIZE'],
+        max_uses=app.config['REPOLENS_BROWSER_MAX_USES'],
+        max_waiting=app.config['REPOLENS_BROWSER_MAX_WAITING'],
+        acquire_timeout=app.config['REPOLENS_BROWSER_ACQUIRE_TIMEOUT'],
+    )
+    # Idle browsers would otherwise outlive the server process
+    atexit.register(pool.close)
+    app.extensions['repolens_browsers'] = pool
+    if app.config['REPOLENS_BROWSER_WARM']:
+        pool.warm_in_background(lambda e: app.logger.warning('Could not warm the browser pool: %s', e))
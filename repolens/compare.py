@@ -0,0 +1,172 @@
+import contextlib
+import hashlib
+import json
+from repolens.storage import iter_file_rows, iter_commits, is_normalized
+from repolens.snapshot import get_snapshot_store
+
+FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+FILE_STATUSES = ('added', 'removed', 'resized', 'modified')
+COMMIT_STATUSES = ('added', 'removed')
+
+
+class CompareError(Exception):
+    pass
+
+
+def check_comparable(base, target, fmt='json'):
+    if fmt not in FORMATS:
+        raise CompareError(f"Invalid format: {fmt}")
+    if base.url != target.url:
+        raise CompareError("Only snapshots of the same repository URL can be compared")
+
+
+@contextlib.contextmanager
+def _sources(repository):
+    """Yield ``(files, commits)`` iterables for the repository.
+
+    Files must come ordered by path. Normalized rows are read from the
+    snapshot file when one has already been built, and from the database
+    otherwise. Legacy packages keep files in packaging order; they are
+    loaded whole anyway, so they are sorted in memory.
+    """
+    if not is_normalized(repository):
+        yield (sorted(iter_file_rows(repository), key=lambda f: f['path']),
+               lambda: iter_commits(repository))
+        return
+    store = get_snapshot_store()
+    snapshot = store.open(repository, build=False) if store else None
+    if snapshot is None:
+        yield iter_file_rows(repository), lambda: iter_commits(repository)
+        return
+    with snapshot:
+        yield snapshot.iter_file_rows(), snapshot.iter_commits
+
+
+def _ordered(files):
+    previous = None
+    for file in files:
+        # Paths are compared by code point, which is also how SQLite and a
+        # "C" collation order them; anything else would silently break the merge.
+        if previous is not None and file['path'] <= previous:
+            raise CompareError(f"Files are not ordered by path: {file['path']!r} after {previous!r}")
+        previous = file['path']
+        yield file
+
+
+def _file_change(old, new):
+    if old['size'] != new['size']:
+        return 'resized'
+    if old.get('blob') and new.get('blob') and old['blob'] != new['blob']:
+        return 'modified'
+    return None
+
+
+def diff_files(base_files, target_files):
+    """Merge two path-ordered file streams and yield the differences.
+
+    Each record has ``path``, ``status`` (one of :data:`FILE_STATUSES`),
+    ``old_size`` and ``new_size``. Files whose size is unchanged are only
+    reported as ``modified`` when both sides recorded differing blob ids.
+    Runs in linear time and constant memory.
+    """
+    base_files, target_files = _ordered(base_files), _ordered(target_files)
+    old, new = next(base_files, None), next(target_files, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old['path'] < new['path']):
+            yield {'path': old['path'], 'status': 'removed', 'old_size': old['size'], 'new_size': None}
+            old = next(base_files, None)
+        elif old is None or new['path'] < old['path']:
+            yield {'path': new['path'], 'status': 'added', 'old_size': None, 'new_size': new['size']}
+            new = next(target_files, None)
+        else:
+            status = _file_change(old, new)
+            if status:
+                yield {'path': new['path'], 'status': status, 'old_size': old['size'], 'new_size': new['size']}
+            old, new = next(base_files, None), next(target_files, None)
+
+
+def diff_commits(base_commits, target_commits):
+    """Yield commits only in the target (``added``), then only in the base.
+
+    ``base_commits`` and ``target_commits`` are callables returning fresh
+    commit iterators; the base is read twice and only a set of its hashes is
+    kept in memory. Commits the base had but the target lacks come from
+    rewritten history or from a depth or date window moving on.
+    """
+    missing = {commit['hash'] for commit in base_commits()}
+    known = frozenset(missing)
+    for commit in target_commits():
+        if commit['hash'] in known:
+            missing.discard(commit['hash'])
+        else:
+            yield dict(commit, status='added')
+    if missing:
+        for commit in base_commits():
+            if commit['hash'] in missing:
+                yield dict(commit, status='removed')
+
+
+def _describe(repository):
+    return {
+        'id': repository.id,
+        'head': (repository.packaged_data or {}).get('head'),
+        'created_at': repository.created_at.isoformat() if repository.created_at else None,
+    }
+
+
+def _changes(base, target, summary):
+    with _sources(base) as (base_files, base_commits), _sources(target) as (target_files, target_commits):
+        for change in diff_files(base_files, target_files):
+            summary['files'][change['status']] += 1
+            yield 'file', change
+        for commit in diff_commits(base_commits, target_commits):
+            summary['commits'][commit['status']] += 1
+            yield 'commit', commit
+
+
+def _empty_summary():
+    return {'files': dict.fromkeys(FILE_STATUSES, 0), 'commits': dict.fromkeys(COMMIT_STATUSES, 0)}
+
+
+def iter_compare_ndjson(base, target):
+    """Yield one JSON record per line: the header, each change, then the summary."""
+    yield json.dumps({'type': 'comparison', 'url': target.url, 'base': _describe(base),
+                      'target': _describe(target)}) + '\n'
+    summary = _empty_summary()
+    for kind, change in _changes(base, target, summary):
+        yield json.dumps(dict(change, type=kind)) + '\n'
+    yield json.dumps(dict(summary, type='summary')) + '\n'
+
+
+def iter_compare_json(base, target):
+    """Yield the comparison as one JSON document, ending with its summary."""
+    yield (f'{{"url": {json.dumps(target.url)}, "base": {json.dumps(_describe(base))}, '
+           f'"target": {json.dumps(_describe(target))}, "files": [')
+    summary = _empty_summary()
+    separator, in_commits = '', False
+    # Every file change is produced before the first commit change
+    for kind, change in _changes(base, target, summary):
+        if kind == 'commit' and not in_commits:
+            yield '], "commits": ['
+            separator, in_commits = '', True
+        yield separator + json.dumps(change)
+        separator = ', '
+    if not in_commits:
+        yield '], "commits": ['
+    yield f'], "summary": {json.dumps(summary)}}}'
+
+
+def compare_stream(base, target, fmt='json'):
+    """Yield the comparison of two snapshots as text in ``fmt``."""
+    if fmt == 'json':
+        return iter_compare_json(base, target)
+    return iter_compare_ndjson(base, target)
+
+
+def compare_etag(base, target, fmt):
+    # Both snapshots are immutable, so their identities fix the output
+    key = ':'.join(f"{r['id']}:{r['head']}:{r['created_at']}" for r in (_describe(base), _describe(target)))
+    return hashlib.sha1(f'{key}:{fmt}'.encode('utf-8')).hexdigest()
@@ -0,0 +1,315 @@
+import json
+import os
+import re
+import threading
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from repolens.loc import detect_language
+from repolens.search import read_blobs, mirror_path
+from repolens.storage import iter_file_rows
+
+DEFAULT_BUDGET = 100_000
+MAX_BUDGET = 2_000_000
+DEFAULT_CHUNK_TOKENS = 2_000
+# Files larger than this are never packed, whatever the budget
+MAX_FILE_BYTES = 512 * 1024
+# Blobs are read from git in batches of about this many bytes
+BATCH_BYTES = 4 * 1024 * 1024
+# Token counts of this many blobs are remembered between requests
+TOKEN_CACHE_SIZE = 200_000
+
+# Roughly how a BPE tokenizer splits source text: short letter runs with
+# an optional leading space, up to three digits, short punctuation runs and
+# runs of whitespace. No piece is longer than MAX_TOKEN_BYTES, which bounds
+# the token count of a file from below by its size.
+_TOKEN = re.compile(rb' ?[A-Za-z]{1,8}| ?[0-9]{1,3}| ?[^\sA-Za-z0-9\x80-\xff]{1,3}|[\x80-\xff]{1,3}|\s{1,16}')
+MAX_TOKEN_BYTES = 16
+
+README = re.compile(r'readme(\.[a-z]+)?$', re.IGNORECASE)
+ENTRY_POINTS = frozenset([
+    'main.py', '__main__.py', 'app.py', 'manage.py', 'wsgi.py', 'cli.py', 'index.js', 'index.ts', 'app.js',
+    'server.js', 'main.go', 'main.rs', 'lib.rs', 'main.c', 'main.cpp', 'Main.java', 'Program.cs',
+])
+MANIFESTS = frozenset([
+    'pyproject.toml', 'setup.py', 'setup.cfg', 'requirements.txt', 'package.json', 'tsconfig.json',
+    'Cargo.toml', 'go.mod', 'pom.xml', 'build.gradle', 'Gemfile', 'Makefile', 'Dockerfile', 'CMakeLists.txt',
+])
+DOC_LANGUAGES = frozenset([
+    'Markdown', 'reStructuredText', 'Text', 'JSON', 'YAML', 'TOML', 'INI', 'XML', 'HTML',
+])
+# Generated, vendored and lock files carry little signal for their size
+EXCLUDED_DIRS = frozenset(['node_modules', 'vendor', 'third_party', 'dist', 'build', '__pycache__'])
+EXCLUDED_NAMES = frozenset([
+    'package-lock.json', 'yarn.lock', 'pnpm-lock.yaml', 'poetry.lock', 'Pipfile.lock', 'Cargo.lock',
+    'Gemfile.lock', 'composer.lock', 'go.sum',
+])
+EXCLUDED_SUFFIXES = ('.min.js', '.min.css', '.map')
+_TEST_PATH = re.compile(r'(^|/)(tests?|spec)/|(^|/)test_[^/]*$|_test\.[^/]+$|\.(test|spec)\.[^/]+$')
+
+SKIP_REASONS = ('excluded', 'unavailable', 'binary', 'too_large', 'budget')
+
+
+class ContextError(Exception):
+    pass
+
+
+def count_tokens(data):
+    """Approximate the number of tokens a BPE tokenizer produces for ``data`` (bytes)."""
+    return len(_TOKEN.findall(data))
+
+
+class TokenCache:
+    """Token counts keyed by blob sha, evicting the least recently used past ``max_entries``."""
+
+    def __init__(self, max_entries=TOKEN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, sha, data):
+        with self._lock:
+            tokens = self._entries.get(sha)
+            if tokens is not None:
+                self._entries.move_to_end(sha)
+                return tokens
+        tokens = count_tokens(data)
+        with self._lock:
+            self._entries[sha] = tokens
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return tokens
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def excluded(path):
+    parts = path.split('/')
+    return (parts[-1] in EXCLUDED_NAMES or path.endswith(EXCLUDED_SUFFIXES)
+            or any(part in EXCLUDED_DIRS for part in parts[:-1]))
+
+
+def priority(path):
+    """Return the packing tier of ``path``; lower tiers are packed first.
+
+    0 top-level README, 1 entry points and build manifests, 2 source code,
+    3 documentation and configuration, 4 tests, 5 anything unrecognised.
+    """
+    name = path.rsplit('/', 1)[-1]
+    if README.match(name):
+        return 0 if '/' not in path else 3
+    if name in ENTRY_POINTS or (name in MANIFESTS and path.count('/') <= 1):
+        return 1
+    if _TEST_PATH.search(path):
+        return 4
+    language = detect_language(path)
+    if language is None:
+        return 5
+    return 3 if language in DOC_LANGUAGES else 2
+
+
+def order_files(files):
+    """Return ``(included, excluded)`` file rows, the former in packing order.
+
+    Within a tier smaller files come first, so a tight budget covers as
+    many files as possible.
+    """
+    included, dropped = [], []
+    for file in files:
+        (dropped if excluded(file['path']) else included).append(file)
+    included.sort(key=lambda f: (priority(f['path']), f['size'] or 0, f['path']))
+    return included, dropped
+
+
+def split_chunks(data, tokens, chunk_tokens):
+    """Yield ``(start_line, end_line, tokens, data)`` pieces of a blob.
+
+    A blob within ``chunk_tokens`` is one chunk; larger ones are cut at
+    line boundaries, and a single line over the limit is a chunk of its own.
+    """
+    lines = data.splitlines(keepends=True)
+    if tokens <= chunk_tokens:
+        yield 1, max(len(lines), 1), tokens, data
+        return
+    start, size, piece = 1, 0, []
+    for number, line in enumerate(lines, 1):
+        line_tokens = count_tokens(line)
+        if piece and size + line_tokens > chunk_tokens:
+            yield start, number - 1, size, b''.join(piece)
+            start, size, piece = number, 0, []
+        piece.append(line)
+        size += line_tokens
+    if piece:
+        yield start, len(lines), size, b''.join(piece)
+
+
+def _batches(files, max_bytes):
+    """Group the distinct blobs of ordered file rows into read batches."""
+    batch, size, seen = [], 0, set()
+    for file in files:
+        if file['blob'] in seen or (file['size'] or 0) > max_bytes:
+            continue
+        seen.add(file['blob'])
+        batch.append(file['blob'])
+        size += file['size'] or 0
+        if size >= BATCH_BYTES:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+class ContextPacker:
+    """Streams a packaged repository as token-counted chunks of file content."""
+
+    def __init__(self, workers=1, token_cache_size=TOKEN_CACHE_SIZE, max_file_bytes=MAX_FILE_BYTES):
+        self.workers = workers
+        self.tokens = TokenCache(token_cache_size)
+        self.max_file_bytes = max_file_bytes
+
+    def _read_batch(self, git_dir, shas):
+        # Blobs missing from the mirror stay mapped to None
+        blobs = dict.fromkeys(shas)
+        for sha, data in read_blobs(git_dir, shas, self.max_file_bytes):
+            blobs[sha] = (data, None if data is None else self.tokens.count(sha, data))
+        return blobs
+
+    def _read(self, git_dir, files):
+        """Yield ``{sha: (content, tokens) or None}`` per batch, in packing order.
+
+        Up to ``workers`` batches are read ahead, each by its own ``git
+        cat-file`` process; the generator can be closed at any point.
+        """
+        batches = _batches(files, self.max_file_bytes)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque()
+            try:
+                for batch in batches:
+                    pending.append(pool.submit(self._read_batch, git_dir, batch))
+                    if len(pending) > self.workers:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def pack(self, repository, budget=DEFAULT_BUDGET, chunk_tokens=DEFAULT_CHUNK_TOKENS):
+        """Return an iterator of context records for the repository, ending with a summary.
+
+        Files are visited in :func:`order_files` order and packed whole
+        while they fit the remaining ``budget``; a file that does not fit is
+        skipped and smaller ones after it may still be packed. A blob shared
+        by several paths is packed once and referenced as a duplicate.
+        Raises :class:`ContextError` up front when the repository's blobs
+        cannot be read.
+        """
+        git_dir = mirror_path(repository)
+        if git_dir is None:
+            raise ContextError("Repository contents are not available")
+        return self._pack(repository, git_dir, budget, chunk_tokens)
+
+    def _fit(self, sha, size, remaining, chunk_tokens, blobs, reader):
+        """Return ``(chunks, None)`` for a blob that fits ``remaining``, else ``(None, reason)``.
+
+        ``blobs`` holds the current batch from ``reader`` and is refilled in
+        place; batches arrive in packing order, so an earlier one is never
+        needed again.
+        """
+        if size > self.max_file_bytes:
+            return None, 'too_large'
+        if size > remaining * MAX_TOKEN_BYTES:
+            # Cannot fit, so it is not worth reading
+            return None, 'budget'
+        while sha not in blobs:
+            batch = next(reader, None)
+            if batch is None:
+                return None, 'unavailable'
+            blobs.clear()
+            blobs.update(batch)
+        blob = blobs.pop(sha)
+        if blob is None:
+            return None, 'unavailable'
+        data, tokens = blob
+        if data is None:
+            return None, 'binary'
+        if tokens > remaining:
+            return None, 'budget'
+        pieces = list(split_chunks(data, tokens, chunk_tokens))
+        # Splitting at line ends can add a token or two
+        if sum(piece[2] for piece in pieces) > remaining:
+            return None, 'budget'
+        return pieces, None
+
+    def _pack(self, repository, git_dir, budget, chunk_tokens):
+        files, dropped = order_files(list(iter_file_rows(repository)))
+        skipped = Counter(excluded=len(dropped))
+        remaining = budget
+        packed, rejected = {}, {}
+        included = duplicates = 0
+
+        yield {'type': 'context', 'id': repository.id, 'url': repository.url,
+               'head': (repository.packaged_data or {}).get('head'), 'budget': budget,
+               'chunk_tokens': chunk_tokens}
+
+        readable = [f for f in files if f.get('blob')]
+        skipped['unavailable'] = len(files) - len(readable)
+        blobs = {}
+        reader = self._read(git_dir, readable)
+        try:
+            for file in readable:
+                sha = file['blob']
+                if sha in rejected:
+                    skipped[rejected[sha]] += 1
+                    continue
+                if sha in packed:
+                    duplicates += 1
+                    yield {'type': 'duplicate', 'path': file['path'], 'same_as': packed[sha]}
+                    continue
+                pieces, reason = self._fit(sha, file['size'] or 0, remaining, chunk_tokens, blobs, reader)
+                if reason:
+                    rejected[sha] = reason
+                    skipped[reason] += 1
+                    continue
+                packed[sha] = file['path']
+                remaining -= sum(piece[2] for piece in pieces)
+                included += 1
+                language = detect_language(file['path'])
+                for number, (start, end, tokens, piece) in enumerate(pieces, 1):
+                    yield {'type': 'chunk', 'path': file['path'], 'language': language, 'chunk': number,
+                           'chunks': len(pieces), 'start_line': start, 'end_line': end, 'tokens': tokens,
+                           'content': piece.decode('utf-8', 'replace')}
+        finally:
+            reader.close()
+
+        yield {'type': 'summary', 'tokens': budget - remaining, 'files': {
+            'included': included, 'duplicates': duplicates,
+            'skipped': {reason: skipped[reason] for reason in SKIP_REASONS}}}
+
+
+def check_options(budget, chunk_tokens):
+    if budget is None or not 1 <= budget <= MAX_BUDGET:
+        raise ContextError(f"budget must be between 1 and {MAX_BUDGET}")
+    if chunk_tokens is None or chunk_tokens < 1:
+        raise ContextError("chunk_tokens must be a positive integer")
+
+
+def context_stream(records):
+    """Yield context records as NDJSON text, one record per line."""
+    for record in records:
+        yield json.dumps(record) + '\n'
+
+
+def get_context_packer(app=None):
+    app = app or current_app
+    return app.extensions['repolens_context']
+
+
+def init_app(app):
+    app.config.setdefault('REPOLENS_CONTEXT_WORKERS', int(os.environ.get(
+        'REPOLENS_CONTEXT_WORKERS', min(4, os.cpu_count() or 1))))
+    app.config.setdefault('REPOLENS_CONTEXT_TOKEN_CACHE_SIZE', int(os.environ.get(
+        'REPOLENS_CONTEXT_TOKEN_CACHE_SIZE', TOKEN_CACHE_SIZE)))
+    app.extensions['repolens_context'] = ContextPacker(app.config['REPOLENS_CONTEXT_WORKERS'],
+                                                       app.config['REPOLENS_CONTEXT_TOKEN_CACHE_SIZE'])
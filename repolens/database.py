@@ -1,3 +1,87 @@
+import os
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
 
 db = SQLAlchemy()
+
+# Set on every SQLite connection, the app database and the side stores
+# alike, unless ``REPOLENS_SQLITE_PRAGMAS`` is off. NORMAL sync only risks
+# the last commits on power loss, not corruption.
+SQLITE_PRAGMAS = (
+    ('synchronous', 'NORMAL'),
+    ('temp_store', 'MEMORY'),
+    ('cache_size', -64 * 1024),
+    ('mmap_size', 256 * 1024 * 1024),
+)
+
+# WAL lets readers carry on while a packaging commit writes. The journal
+# mode is stored in the database file, so it is set once per database
+# rather than on every connection.
+SQLITE_JOURNAL_MODE = 'WAL'
+
+
+def apply_sqlite_pragmas(conn):
+    """Apply :data:`SQLITE_PRAGMAS` to a DB-API SQLite connection."""
+    cursor = conn.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS:
+            cursor.execute(f'PRAGMA {name} = {value}')
+    finally:
+        cursor.close()
+
+
+def set_sqlite_journal_mode(conn):
+    """Switch the database behind ``conn`` to :data:`SQLITE_JOURNAL_MODE`.
+
+    Must run outside a transaction.
+    """
+    conn.execute(f'PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}').close()
+
+
+def sqlite_pragmas_enabled(app):
+    """Whether SQLite connections made for ``app`` get the pragmas above."""
+    return app.config.setdefault('REPOLENS_SQLITE_PRAGMAS', os.environ.get('REPOLENS_SQLITE_PRAGMAS', '1') != '0')
+
+
+def _on_connect(dbapi_connection, connection_record):
+    apply_sqlite_pragmas(dbapi_connection)
+
+
+def _on_first_connect(dbapi_connection, connection_record):
+    set_sqlite_journal_mode(dbapi_connection)
+
+
+def _in_memory(url):
+    return url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'
+
+
+def init_app(app):
+    """Initialise ``db`` with pool settings and, for SQLite, the pragmas.
+
+    Pool sizes apply to every backend with a connection pool; an in-memory
+    SQLite database has a single shared connection instead.
+    """
+    app.config.setdefault('REPOLENS_DB_POOL_SIZE', int(os.environ.get('REPOLENS_DB_POOL_SIZE', 5)))
+    app.config.setdefault('REPOLENS_DB_MAX_OVERFLOW', int(os.environ.get('REPOLENS_DB_MAX_OVERFLOW', 10)))
+    app.config.setdefault('REPOLENS_DB_POOL_TIMEOUT', float(os.environ.get('REPOLENS_DB_POOL_TIMEOUT', 30)))
+    # Connections older than this are replaced, before a server or proxy drops them
+    app.config.setdefault('REPOLENS_DB_POOL_RECYCLE', int(os.environ.get('REPOLENS_DB_POOL_RECYCLE', 1800)))
+
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI')
+    url = make_url(uri) if uri else None
+    options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    if url is not None and not (url.get_backend_name() == 'sqlite' and _in_memory(url)):
+        options.setdefault('pool_size', app.config['REPOLENS_DB_POOL_SIZE'])
+        options.setdefault('max_overflow', app.config['REPOLENS_DB_MAX_OVERFLOW'])
+        options.setdefault('pool_timeout', app.config['REPOLENS_DB_POOL_TIMEOUT'])
+        options.setdefault('pool_recycle', app.config['REPOLENS_DB_POOL_RECYCLE'])
+        options.setdefault('pool_pre_ping', True)
+
+    db.init_app(app)
+    if sqlite_pragmas_enabled(app):
+        with app.app_context():
+            for engine in db.engines.values():
+                if engine.dialect.name == 'sqlite':
+                    event.listen(engine, 'first_connect', _on_first_connect)
+                    event.listen(engine, 'connect', _on_connect)
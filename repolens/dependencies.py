@@ -0,0 +1,409 @@
+import json
+import posixpath
+import re
+import threading
+import tomllib
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy import func, select
+from repolens.database import db
+from repolens.models import Repository, RepositoryDependency, RepositoryPackage
+from repolens.search import read_blobs
+
+ECOSYSTEMS = ('pypi', 'npm', 'go', 'cargo')
+# Manifests over this size are not parsed
+MAX_MANIFEST_BYTES = 1024 * 1024
+# Vendored copies would credit a repository with its dependencies' manifests
+EXCLUDED_DIRS = frozenset(['node_modules', 'vendor', 'third_party', 'site-packages', '.venv', 'venv'])
+DEFAULT_MAX_DEPTH = 10
+MAX_DEPTH = 50
+
+_REQUIREMENTS_NAME = re.compile(r'^requirements[\w.-]*\.txt$')
+_REQUIREMENT = re.compile(r'^([A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?)\s*(?:\[[^\]]*\])?\s*(.*)$', re.S)
+
+
+class DependencyError(Exception):
+    pass
+
+
+def normalize(ecosystem, name):
+    """Return the name registries of ``ecosystem`` treat as identical to ``name``."""
+    if ecosystem == 'pypi':
+        return re.sub(r'[-_.]+', '-', name).lower()
+    if ecosystem == 'cargo':
+        return name.replace('_', '-').lower()
+    if ecosystem == 'npm':
+        return name.lower()
+    return name
+
+
+def _pep508(requirement):
+    """Return ``(name, spec)`` of a PEP 508 requirement, or None."""
+    match = _REQUIREMENT.match(requirement.strip())
+    if not match:
+        return None
+    # Environment markers do not change which package is required
+    spec = match.group(2).split(';', 1)[0].strip().strip('()').strip()
+    return match.group(1), spec or None
+
+
+def _version(spec):
+    """Return the version of a Poetry or Cargo dependency entry."""
+    if isinstance(spec, str):
+        return spec
+    if isinstance(spec, dict):
+        return spec.get('version')
+    return None
+
+
+def _parse_requirements(path, text):
+    kind = 'dev' if re.search(r'dev|test|lint|doc', posixpath.basename(path)) else 'runtime'
+    dependencies = []
+    for line in text.replace('\\\n', ' ').splitlines():
+        line = line.split(' #', 1)[0].strip()
+        # Options (-r, -e, --hash ...), local paths and bare URLs name no package
+        if not line or line.startswith(('#', '-', '.', '/')) or ('://' in line and '@' not in line):
+            continue
+        requirement = _pep508(line)
+        if requirement:
+            dependencies.append((*requirement, kind))
+    return 'pypi', None, dependencies
+
+
+def _pep508_all(requirements, kind):
+    # Entries that are not strings, like {include-group = "..."}, are skipped
+    return [(*parsed, kind) for parsed in (_pep508(r) for r in requirements if isinstance(r, str)) if parsed]
+
+
+def _parse_pyproject(path, text):
+    data = tomllib.loads(text)
+    project = data.get('project', {})
+    poetry = data.get('tool', {}).get('poetry', {})
+    dependencies = _pep508_all(project.get('dependencies', []), 'runtime')
+    for requirements in project.get('optional-dependencies', {}).values():
+        dependencies += _pep508_all(requirements, 'optional')
+    for requirements in data.get('dependency-groups', {}).values():
+        dependencies += _pep508_all(requirements, 'dev')
+    for name, spec in poetry.get('dependencies', {}).items():
+        if name.lower() != 'python':
+            optional = isinstance(spec, dict) and spec.get('optional')
+            dependencies.append((name, _version(spec), 'optional' if optional else 'runtime'))
+    groups = [poetry.get('dev-dependencies', {})]
+    groups += [group.get('dependencies', {}) for group in poetry.get('group', {}).values()]
+    for group in groups:
+        dependencies += [(name, _version(spec), 'dev') for name, spec in group.items()]
+    return 'pypi', project.get('name') or poetry.get('name'), dependencies
+
+
+def _parse_package_json(path, text):
+    data = json.loads(text)
+    dependencies = []
+    for section, kind in (('dependencies', 'runtime'), ('devDependencies', 'dev'),
+                          ('peerDependencies', 'peer'), ('optionalDependencies', 'optional')):
+        dependencies += [(name, spec if isinstance(spec, str) else None, kind)
+                         for name, spec in (data.get(section) or {}).items()]
+    return 'npm', data.get('name'), dependencies
+
+
+def _parse_go_mod(path, text):
+    module = None
+    dependencies = []
+    in_require = False
+    for raw in text.splitlines():
+        line = raw.split('//', 1)[0].strip()
+        kind = 'indirect' if '// indirect' in raw else 'runtime'
+        if in_require:
+            if line == ')':
+                in_require = False
+            elif line:
+                name, *version = line.split()
+                dependencies.append((name.strip('"'), version[0] if version else None, kind))
+        elif line.startswith('module '):
+            module = line.split()[1].strip('"')
+        elif line.startswith('require') and line[len('require'):].strip() == '(':
+            in_require = True
+        elif line.startswith('require '):
+            name, *version = line.split()[1:]
+            dependencies.append((name.strip('"'), version[0] if version else None, kind))
+    return 'go', module, dependencies
+
+
+def _parse_cargo(path, text):
+    data = tomllib.loads(text)
+    tables = [(data, 'dependencies', 'runtime'), (data, 'dev-dependencies', 'dev'),
+              (data, 'build-dependencies', 'build')]
+    for target in data.get('target', {}).values():
+        tables += [(target, 'dependencies', 'runtime'), (target, 'dev-dependencies', 'dev'),
+                   (target, 'build-dependencies', 'build')]
+    dependencies = []
+    for table, section, kind in tables:
+        for name, spec in table.get(section, {}).items():
+            # A renamed dependency names the real crate in ``package``
+            crate = spec.get('package', name) if isinstance(spec, dict) else name
+            dependencies.append((crate, _version(spec), kind))
+    return 'cargo', data.get('package', {}).get('name'), dependencies
+
+
+PARSERS = {
+    'pyproject.toml': _parse_pyproject,
+    'package.json': _parse_package_json,
+    'go.mod': _parse_go_mod,
+    'Cargo.toml': _parse_cargo,
+}
+
+
+def _parser(path):
+    parts = path.split('/')
+    if any(part in EXCLUDED_DIRS for part in parts[:-1]):
+        return None
+    name = parts[-1]
+    if name in PARSERS:
+        return PARSERS[name]
+    if _REQUIREMENTS_NAME.match(name) or (len(parts) > 1 and parts[-2] == 'requirements' and name.endswith('.txt')):
+        return _parse_requirements
+    return None
+
+
+def is_manifest(path):
+    return _parser(path) is not None
+
+
+def parse_manifest(path, text):
+    """Parse the manifest at ``path``.
+
+    Returns ``{'path', 'ecosystem', 'package', 'dependencies'}`` with
+    normalized names, where ``package`` is the name the manifest publishes
+    (or None) and each dependency is ``{'name', 'spec', 'kind'}``. Returns
+    None for files that are not manifests or cannot be parsed.
+    """
+    parser = _parser(path)
+    if parser is None:
+        return None
+    try:
+        ecosystem, package, dependencies = parser(path, text)
+    except (ValueError, TypeError, AttributeError):
+        # Malformed TOML or JSON, or sections of the wrong type
+        return None
+    seen = set()
+    normalized = []
+    for name, spec, kind in dependencies:
+        if not isinstance(name, str) or not name:
+            continue
+        key = (normalize(ecosystem, name), kind)
+        if key not in seen:
+            seen.add(key)
+            normalized.append({'name': key[0], 'spec': spec if isinstance(spec, str) else None, 'kind': kind})
+    return {'path': path, 'ecosystem': ecosystem,
+            'package': normalize(ecosystem, package) if isinstance(package, str) and package else None,
+            'dependencies': normalized}
+
+
+def extract_manifests(git_dir, files):
+    """Return :func:`parse_manifest` results for the manifests among ``files``."""
+    manifests = [f for f in files if f.get('blob') and is_manifest(f['path'])]
+    if not manifests:
+        return []
+    contents = dict(read_blobs(git_dir, sorted({f['blob'] for f in manifests}), MAX_MANIFEST_BYTES))
+    parsed = []
+    for file in manifests:
+        content = contents.get(file['blob'])
+        if content is not None:
+            manifest = parse_manifest(file['path'], content.decode('utf-8', 'replace'))
+            if manifest is not None:
+                parsed.append(manifest)
+    return parsed
+
+
+class DependencyGraph:
+    """Adjacency lists over the latest snapshot of every repository URL.
+
+    Packages are ``(ecosystem, name)`` keys. Repositories point at the
+    packages they require and are pointed at by the packages they publish,
+    so transitive queries are breadth-first walks over dicts.
+    """
+
+    def __init__(self):
+        self.latest = {}
+        self.repositories = {}
+        self.requires = {}
+        self.dependents = defaultdict(dict)
+        self.publishes = {}
+        self.publishers = defaultdict(set)
+        self.max_id = 0
+
+    def add(self, repository_id, name, url, dependencies, packages):
+        """Add a snapshot, replacing an older snapshot of the same URL."""
+        self.max_id = max(self.max_id, repository_id)
+        previous = self.latest.get(url)
+        if previous is not None:
+            if previous > repository_id:
+                return
+            self._remove(previous)
+        self.latest[url] = repository_id
+        self.repositories[repository_id] = (name, url)
+        self.requires[repository_id] = dependencies
+        for key, spec, kind, manifest in dependencies:
+            self.dependents[key].setdefault(repository_id, []).append(
+                {'manifest': manifest, 'spec': spec, 'kind': kind})
+        self.publishes[repository_id] = packages
+        for key in packages:
+            self.publishers[key].add(repository_id)
+
+    def _remove(self, repository_id):
+        del self.repositories[repository_id]
+        for key, _, _, _ in self.requires.pop(repository_id):
+            self.dependents[key].pop(repository_id, None)
+            if not self.dependents[key]:
+                del self.dependents[key]
+        for key in self.publishes.pop(repository_id):
+            self.publishers[key].discard(repository_id)
+            if not self.publishers[key]:
+                del self.publishers[key]
+
+    def _repository(self, repository_id):
+        name, url = self.repositories[repository_id]
+        return {'id': repository_id, 'name': name, 'url': url}
+
+    def dependents_of(self, keys, transitive=False, max_depth=DEFAULT_MAX_DEPTH):
+        """Return repositories requiring any of ``keys``, nearest first.
+
+        Transitively, a repository that requires a package published by a
+        dependent is a dependent too, one level further out.
+        """
+        found = {}
+        seen = set(keys)
+        frontier = list(keys)
+        depth = 1
+        while frontier and depth <= max_depth:
+            following = []
+            for key in frontier:
+                for repository_id, requirements in self.dependents.get(key, {}).items():
+                    if repository_id in found:
+                        continue
+                    found[repository_id] = {'repository': self._repository(repository_id), 'depth': depth,
+                                            'via': {'ecosystem': key[0], 'name': key[1]},
+                                            'requirements': requirements}
+                    for package in self.publishes[repository_id] if transitive else ():
+                        if package not in seen:
+                            seen.add(package)
+                            following.append(package)
+            frontier = following
+            depth += 1
+        return sorted(found.values(), key=lambda item: (item['depth'], item['repository']['name'],
+                                                        item['repository']['id']))
+
+    def dependencies_of(self, keys, max_depth=DEFAULT_MAX_DEPTH):
+        """Return the packages reachable from ``keys`` through their publishers.
+
+        ``keys`` are the direct dependencies, at depth 1; a package published
+        by a packaged repository adds that repository's own dependencies.
+        """
+        found = {}
+        frontier = list(keys)
+        for key in frontier:
+            found[key] = 1
+        depth = 1
+        while frontier and depth < max_depth:
+            following = []
+            for key in frontier:
+                for repository_id in self.publishers.get(key, ()):
+                    for package, _, _, _ in self.requires[repository_id]:
+                        if package not in found:
+                            found[package] = depth + 1
+                            following.append(package)
+            frontier = following
+            depth += 1
+        return [{'ecosystem': key[0], 'name': key[1], 'depth': found[key],
+                 'published_by': [self._repository(i) for i in sorted(self.publishers.get(key, ()))]}
+                for key in sorted(found, key=lambda key: (found[key], key))]
+
+
+def _load(graph, after=None):
+    """Add snapshots to ``graph``: every URL's latest, or all newer than ``after``."""
+    if after is None:
+        ids = select(func.max(Repository.id)).group_by(Repository.url)
+    else:
+        ids = select(Repository.id).where(Repository.id > after)
+    requires = defaultdict(list)
+    for repository_id, manifest, ecosystem, name, spec, kind in db.session.execute(
+            select(RepositoryDependency.repository_id, RepositoryDependency.manifest, RepositoryDependency.ecosystem,
+                   RepositoryDependency.name, RepositoryDependency.spec, RepositoryDependency.kind)
+            .where(RepositoryDependency.repository_id.in_(ids))):
+        requires[repository_id].append(((ecosystem, name), spec, kind, manifest))
+    publishes = defaultdict(list)
+    for repository_id, ecosystem, name in db.session.execute(
+            select(RepositoryPackage.repository_id, RepositoryPackage.ecosystem, RepositoryPackage.name)
+            .where(RepositoryPackage.repository_id.in_(ids))):
+        publishes[repository_id].append((ecosystem, name))
+    for repository_id, name, url in db.session.execute(
+            select(Repository.id, Repository.name, Repository.url).where(Repository.id.in_(ids))
+            .order_by(Repository.id)):
+        graph.add(repository_id, name, url, requires[repository_id], publishes[repository_id])
+
+
+class DependencyIndex:
+    """Keeps a :class:`DependencyGraph` in step with the database.
+
+    Before each query the newest repository id and the repository count are
+    compared with the graph's: newly packaged snapshots are added to it, and
+    anything else (deleted snapshots) rebuilds it from scratch.
+    """
+
+    def __init__(self):
+        self._graph = None
+        self._count = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        max_id, count = db.session.execute(select(func.max(Repository.id), func.count(Repository.id))).one()
+        max_id = max_id or 0
+        graph = self._graph
+        if graph is not None and (max_id, count) == (graph.max_id, self._count):
+            return
+        added = db.session.scalar(select(func.count(Repository.id)).where(Repository.id > graph.max_id)) \
+            if graph is not None else None
+        if graph is None or max_id < graph.max_id or count - self._count != added:
+            graph = DependencyGraph()
+            _load(graph)
+        else:
+            _load(graph, after=graph.max_id)
+        graph.max_id = max_id
+        self._graph = graph
+        self._count = count
+
+    def invalidate(self):
+        with self._lock:
+            self._graph = None
+
+    def dependents(self, keys, transitive=False, max_depth=DEFAULT_MAX_DEPTH):
+        with self._lock:
+            self._refresh()
+            return self._graph.dependents_of(keys, transitive, max_depth)
+
+    def dependencies(self, keys, max_depth=DEFAULT_MAX_DEPTH):
+        with self._lock:
+            self._refresh()
+            return self._graph.dependencies_of(keys, max_depth)
+
+
+def package_keys(name, ecosystem=None):
+    """Return the ``(ecosystem, name)`` keys a query for ``name`` matches."""
+    if not name:
+        raise DependencyError("Missing name")
+    if ecosystem is not None and ecosystem not in ECOSYSTEMS:
+        raise DependencyError(f"Unknown ecosystem: {ecosystem}; expected one of {', '.join(ECOSYSTEMS)}")
+    return [(e, normalize(e, name)) for e in ([ecosystem] if ecosystem else ECOSYSTEMS)]
+
+
+def check_depth(max_depth):
+    if not 1 <= max_depth <= MAX_DEPTH:
+        raise DependencyError(f"max_depth must be between 1 and {MAX_DEPTH}")
+
+
+def get_dependency_index(app=None):
+    app = app or current_app
+    return app.extensions['repolens_dependencies']
+
+
+def init_app(app):
+    app.extensions['repolens_dependencies'] = DependencyIndex()
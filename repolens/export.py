@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import zlib
+from repolens.storage import iter_files, iter_commits, list_branches
+from repolens.snapshot import get_snapshot_store
+
+FORMATS = {
+    'json': ('application/json', 'txt'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'snapshot': ('application/vnd.repolens.snapshot', 'rls'),
+}
+COMPRESSIONS = {
+    'none': (None, ''),
+    'gzip': ('application/gzip', '.gz'),
+    'zstd': ('application/zstd', '.zst'),
+}
+
+# Serialized output is buffered into chunks of roughly this many bytes
+CHUNK_SIZE = 64 * 1024
+
+
+class ExportError(Exception):
+    pass
+
+
+def _metadata(repository):
+    metadata = dict(repository.packaged_data or {})
+    for key in ('files', 'commits', 'branches'):
+        metadata.pop(key, None)
+    metadata.setdefault('name', repository.name)
+    metadata.setdefault('url', repository.url)
+    return metadata
+
+
+def _indented(value, level):
+    # json.dumps(..., indent=2) of a nested value, shifted to sit at ``level``
+    return json.dumps(value, indent=2).replace('\n', '\n' + '  ' * level)
+
+
+def _json_array(key, items, last):
+    yield f'  {json.dumps(key)}: '
+    empty = True
+    for item in items:
+        yield ('[\n    ' if empty else ',\n    ') + _indented(item, 2)
+        empty = False
+    yield '[]' if empty else '\n  ]'
+    yield '\n' if last else ',\n'
+
+
+def iter_package_json(repository):
+    """Yield the package as text identical to ``json.dump(package, indent=2)``."""
+    yield '{\n'
+    for key, value in _metadata(repository).items():
+        yield f'  {json.dumps(key)}: {_indented(value, 1)},\n'
+    yield from _json_array('files', iter_files(repository), last=False)
+    yield from _json_array('commits', iter_commits(repository), last=False)
+    yield from _json_array('branches', list_branches(repository), last=True)
+    yield '}'
+
+
+def iter_package_ndjson(repository):
+    """Yield the package as one JSON record per line, metadata first."""
+    yield json.dumps(dict(_metadata(repository), type='repository')) + '\n'
+    for file in iter_files(repository):
+        yield json.dumps(dict(file, type='file')) + '\n'
+    for commit in iter_commits(repository):
+        yield json.dumps(dict(commit, type='commit')) + '\n'
+    for branch in list_branches(repository):
+        yield json.dumps({'type': 'branch', 'name': branch}) + '\n'
+
+
+def buffered(pieces):
+    """Encode text pieces as UTF-8 and join them into chunks of about :data:`CHUNK_SIZE` bytes."""
+    buffer = []
+    size = 0
+    for piece in pieces:
+        data = piece.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= CHUNK_SIZE:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _compressor(compression):
+    if compression == 'gzip':
+        # A gzip stream with a zeroed header timestamp, so repeated
+        # downloads are byte-identical and byte ranges stay valid.
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        import zstandard
+    except ImportError:
+        raise ExportError('zstd compression requires the zstandard package')
+    return zstandard.ZstdCompressor().compressobj()
+
+
+def _compressed(chunks, compression):
+    compressor = _compressor(compression)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _snapshot_chunks(repository):
+    store = get_snapshot_store()
+    path = store.path_for(repository)
+    if not os.path.exists(path):
+        path = store.build(repository)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def check_options(fmt, compression):
+    if fmt not in FORMATS:
+        raise ExportError(f"Invalid format: {fmt}")
+    if fmt == 'snapshot' and get_snapshot_store() is None:
+        raise ExportError("Snapshot downloads are disabled")
+    if compression not in COMPRESSIONS:
+        raise ExportError(f"Invalid compression: {compression}")
+    if compression != 'none':
+        _compressor(compression)
+
+
+def package_stream(repository, fmt='json', compression='none'):
+    """Yield the serialized package as byte chunks, optionally compressed."""
+    if fmt == 'snapshot':
+        chunks = _snapshot_chunks(repository)
+    elif fmt == 'json':
+        chunks = buffered(iter_package_json(repository))
+    else:
+        chunks = buffered(iter_package_ndjson(repository))
+    if compression != 'none':
+        chunks = _compressed(chunks, compression)
+    return chunks
+
+
+def package_mimetype(fmt, compression):
+    return COMPRESSIONS[compression][0] or FORMATS[fmt][0]
+
+
+def package_filename(repository, fmt, compression):
+    return f"{repository.name}_content.{FORMATS[fmt][1]}{COMPRESSIONS[compression][1]}"
+
+
+def package_etag(repository, fmt, compression):
+    # Snapshots are never modified after packaging, so the row identity and
+    # its recorded HEAD fully determine the output.
+    head = (repository.packaged_data or {}).get('head', '')
+    created = repository.created_at.isoformat() if repository.created_at else ''
+    key = f'{repository.id}:{head}:{created}:{fmt}:{compression}'
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
@@ -0,0 +1,236 @@
+from array import array
+from datetime import datetime, timezone
+import numpy as np
+
+WEEK = 7 * 24 * 3600
+# The Unix epoch was a Thursday; shifting by three days makes weeks start
+# on Monday, like ISO weeks.
+_WEEK_SHIFT = 3 * 24 * 3600
+_MISSING = -1
+_MISSING_DATE = -(2 ** 63)
+
+
+class History:
+    """Commit history held as parallel NumPy arrays, newest commit first.
+
+    ``dates`` are UTC seconds since the epoch, ``authors`` index into
+    ``names`` and the line statistics are -1 where they were not collected.
+    Commits without a date are dropped.
+    """
+
+    def __init__(self, dates, authors, names, insertions, deletions):
+        self.dates = dates
+        self.authors = authors
+        self.names = names
+        self.insertions = insertions
+        self.deletions = deletions
+
+    def __len__(self):
+        return len(self.dates)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Build the arrays straight from a snapshot's memory-mapped columns."""
+        dates = np.frombuffer(snapshot.column('commit.date'), dtype=np.int64)
+        keep = dates != _MISSING_DATE
+        names = list(snapshot.strings('table.authors'))
+        authors = np.frombuffer(snapshot.column('commit.author'), dtype=np.int32)[keep]
+        # Commits without an author are attributed to an extra name
+        if (authors == _MISSING).any():
+            authors = np.where(authors == _MISSING, len(names), authors)
+            names.append('unknown')
+        return cls(dates[keep] // 1_000_000, authors, names,
+                   np.frombuffer(snapshot.column('commit.insertions'), dtype=np.int64)[keep],
+                   np.frombuffer(snapshot.column('commit.deletions'), dtype=np.int64)[keep])
+
+    @classmethod
+    def from_commits(cls, commits):
+        """Build the arrays from commit dicts (see :func:`repolens.storage.iter_commit_rows`)."""
+        index = {}
+        dates, authors, insertions, deletions = [], [], [], []
+        for commit in commits:
+            if not commit.get('date'):
+                continue
+            dates.append(int(datetime.fromisoformat(commit['date']).astimezone(timezone.utc).timestamp()))
+            authors.append(index.setdefault(commit.get('author') or 'unknown', len(index)))
+            insertions.append(_MISSING if commit.get('insertions') is None else commit['insertions'])
+            deletions.append(_MISSING if commit.get('deletions') is None else commit['deletions'])
+        return cls(np.array(dates, dtype=np.int64), np.array(authors, dtype=np.int32), list(index),
+                   np.array(insertions, dtype=np.int64), np.array(deletions, dtype=np.int64))
+
+    def weeks(self):
+        """Return the Monday-based week number of every commit."""
+        return (self.dates + _WEEK_SHIFT) // WEEK
+
+
+class FileHistory:
+    """Per-file change statistics accumulated over ``git log --numstat``.
+
+    Each ``(path, author)`` pair gets one slot in flat arrays holding its
+    commits, lines added and removed, and newest change in UTC seconds;
+    author names are interned. Memory grows with the number of pairs, not
+    with the length of the history. Binary changes count as commits
+    without lines.
+    """
+
+    def __init__(self):
+        self.authors = {}
+        self.slots = {}
+        self.commits = array('q')
+        self.insertions = array('q')
+        self.deletions = array('q')
+        self.last = array('q')
+
+    def __len__(self):
+        return len(self.slots)
+
+    def add(self, commit, paths):
+        """Count one commit's ``(path, added, deleted)`` entries."""
+        date = int(datetime.fromisoformat(commit['date']).astimezone(timezone.utc).timestamp())
+        author = self.authors.setdefault(commit['author'], len(self.authors))
+        for path, added, deleted in paths:
+            slot = self.slots.setdefault((path, author), len(self.slots))
+            if slot == len(self.commits):
+                for values in (self.commits, self.insertions, self.deletions):
+                    values.append(0)
+                self.last.append(date)
+            self.commits[slot] += 1
+            self.insertions[slot] += added or 0
+            self.deletions[slot] += deleted or 0
+            if date > self.last[slot]:
+                self.last[slot] = date
+
+    def paths(self):
+        return {path for path, _ in self.slots}
+
+    def rows(self):
+        """Yield one dict per pair, ``last_modified`` as a naive UTC datetime."""
+        names = list(self.authors)
+        for (path, author), slot in self.slots.items():
+            yield {'path': path, 'author': names[author], 'commits': self.commits[slot],
+                   'insertions': self.insertions[slot], 'deletions': self.deletions[slot],
+                   'last_modified': datetime.fromtimestamp(self.last[slot], timezone.utc).replace(tzinfo=None)}
+
+
+def week_start(week):
+    return datetime.fromtimestamp(int(week) * WEEK - _WEEK_SHIFT, timezone.utc).date().isoformat()
+
+
+def rolling_mean(values, window):
+    """Mean over a trailing window; the first ``window - 1`` entries average what exists."""
+    totals = np.cumsum(values, dtype=np.float64)
+    totals[window:] = totals[window:] - totals[:-window]
+    counts = np.minimum(np.arange(1, len(values) + 1), window)
+    return totals / counts
+
+
+def _round(values):
+    return [round(float(value), 2) for value in values]
+
+
+def weekly_histogram(history, windows=(4, 12)):
+    """Commits per week from the first to the last week, with rolling means."""
+    if not len(history):
+        return {'weeks': [], 'commits': [], 'rolling_mean': {str(w): [] for w in windows}, 'summary': None}
+    weeks = history.weeks()
+    first = int(weeks.min())
+    counts = np.bincount(weeks - first)
+    busiest = int(counts.argmax())
+    return {
+        'weeks': [week_start(first + i) for i in range(len(counts))],
+        'commits': counts.tolist(),
+        'rolling_mean': {str(window): _round(rolling_mean(counts, window)) for window in windows},
+        'summary': {
+            'mean': round(float(counts.mean()), 2),
+            'median': float(np.median(counts)),
+            'active_weeks': int(np.count_nonzero(counts)),
+            'busiest_week': week_start(first + busiest),
+            'busiest_week_commits': int(counts[busiest]),
+        },
+    }
+
+
+def weekly_churn(history, windows=(4, 12)):
+    """Lines added and removed per week, over commits with line statistics."""
+    measured = history.insertions != _MISSING
+    result = {'commits_measured': int(measured.sum()), 'commits_unmeasured': int((~measured).sum())}
+    if not measured.any():
+        result.update(weeks=[], insertions=[], deletions=[], rolling_mean={str(w): [] for w in windows},
+                      total_insertions=0, total_deletions=0)
+        return result
+    weeks = history.weeks()[measured]
+    first = int(weeks.min())
+    insertions = np.bincount(weeks - first, weights=history.insertions[measured]).astype(np.int64)
+    deletions = np.bincount(weeks - first, weights=history.deletions[measured]).astype(np.int64)
+    churn = insertions + deletions
+    result.update(
+        weeks=[week_start(first + i) for i in range(len(insertions))],
+        insertions=insertions.tolist(),
+        deletions=deletions.tolist(),
+        rolling_mean={str(window): _round(rolling_mean(churn, window)) for window in windows},
+        total_insertions=int(insertions.sum()),
+        total_deletions=int(deletions.sum()),
+    )
+    return result
+
+
+def contributors(history, top=10):
+    """The ``top`` authors by commit count with their activity span and churn."""
+    if not len(history):
+        return {'total_authors': 0, 'contributors': []}
+    n = len(history.names)
+    commits = np.bincount(history.authors, minlength=n)
+    first = np.full(n, np.iinfo(np.int64).max)
+    last = np.full(n, np.iinfo(np.int64).min)
+    np.minimum.at(first, history.authors, history.dates)
+    np.maximum.at(last, history.authors, history.dates)
+    measured = history.insertions != _MISSING
+    insertions = np.bincount(history.authors[measured], weights=history.insertions[measured], minlength=n)
+    deletions = np.bincount(history.authors[measured], weights=history.deletions[measured], minlength=n)
+    weeks = history.weeks()
+    active = np.unique(history.authors.astype(np.int64) * (int(weeks.max()) + 1) + weeks)
+    active_weeks = np.bincount(active // (int(weeks.max()) + 1), minlength=n)
+
+    # Most commits first, ties broken by name for a stable order
+    order = np.lexsort((np.array(history.names, dtype=object).astype(str), -commits))[:top]
+    order = order[commits[order] > 0]
+    return {
+        'total_authors': int(np.count_nonzero(commits)),
+        'contributors': [{
+            'author': history.names[i],
+            'commits': int(commits[i]),
+            'share': round(float(commits[i]) / len(history), 4),
+            'first_commit': _isoformat(first[i]),
+            'last_commit': _isoformat(last[i]),
+            'active_weeks': int(active_weeks[i]),
+            'insertions': int(insertions[i]),
+            'deletions': int(deletions[i]),
+        } for i in order],
+    }
+
+
+def bus_factor(history, threshold=0.5):
+    """Smallest number of authors responsible for ``threshold`` of the work.
+
+    Work is measured in commits and, where line statistics exist, in
+    lines changed.
+    """
+    result = {'threshold': threshold}
+    n = len(history.names)
+    measured = history.insertions != _MISSING
+    lines = np.bincount(history.authors[measured],
+                        weights=history.insertions[measured] + history.deletions[measured], minlength=n)
+    for key, work in (('commits', np.bincount(history.authors, minlength=n)), ('lines', lines)):
+        total = work.sum()
+        if not total:
+            result[key] = {'bus_factor': 0, 'authors': []}
+            continue
+        order = np.argsort(-work, kind='stable')
+        covered = np.cumsum(work[order]) / total
+        factor = int(np.searchsorted(covered, threshold)) + 1
+        result[key] = {'bus_factor': factor, 'authors': [history.names[i] for i in order[:factor]]}
+    return result
+
+
+def _isoformat(seconds):
+    return datetime.fromtimestamp(int(seconds), timezone.utc).isoformat()
@@ -0,0 +1,369 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from flask import current_app
+from repolens.packager import package_repository
+from repolens.batch import package_batch
+from repolens.models import Repository
+from repolens.database import db, apply_sqlite_pragmas, set_sqlite_journal_mode, sqlite_pragmas_enabled
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+_handlers = {}
+
+
+class JobTimeout(Exception):
+    pass
+
+
+def job_handler(kind):
+    """Register a function as the handler for jobs of the given kind."""
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+class JobStore:
+    """SQLite-backed persistent job queue.
+
+    Every call opens its own short-lived connection so the store can be shared
+    between worker threads and between processes pointing at the same file.
+    A running job is leased to the worker that claimed it (its ``owner``),
+    which keeps renewing ``heartbeat_at``; only jobs whose lease ran out
+    are put back on the queue.
+    """
+
+    def __init__(self, path, pragmas=True):
+        self.path = path
+        self.pragmas = pragmas
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def _connect(self):
+        if not self._schema_ready:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if self.pragmas:
+            apply_sqlite_pragmas(conn)
+        conn.row_factory = sqlite3.Row
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    if self.pragmas:
+                        set_sqlite_journal_mode(conn)
+                    self._create_schema(conn)
+                    self._schema_ready = True
+        return conn
+
+    def _create_schema(self, conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress TEXT NOT NULL DEFAULT '{}',
+                result TEXT,
+                error TEXT,
+                timeout REAL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                owner TEXT,
+                heartbeat_at REAL
+            )
+        ''')
+        # Stores created before leases existed
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+        for column, kind in (('owner', 'TEXT'), ('heartbeat_at', 'REAL')):
+            if column not in columns:
+                conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {kind}')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs (status, created_at)')
+
+    def enqueue(self, kind, params, timeout=None):
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, kind, params, status, timeout, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, kind, json.dumps(params), QUEUED, timeout, time.time())
+            )
+        return job_id
+
+    def claim(self, owner=None):
+        """Atomically move the oldest queued job to running, leased to ``owner``, and return it."""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1', (QUEUED,)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            now = time.time()
+            conn.execute(
+                'UPDATE jobs SET status = ?, started_at = ?, owner = ?, heartbeat_at = ? WHERE id = ?',
+                (RUNNING, now, owner, now, row['id'])
+            )
+            conn.execute('COMMIT')
+            return self._to_dict(row)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def update_progress(self, job_id, progress):
+        # Progress is a sign of life, so it renews the lease too
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE jobs SET progress = ?, heartbeat_at = ? WHERE id = ? AND status = ?',
+                (json.dumps(progress), time.time(), job_id, RUNNING)
+            )
+
+    def heartbeat(self, owner):
+        """Renew the lease on every job ``owner`` is running."""
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status = ?',
+                         (time.time(), owner, RUNNING))
+
+    def finish(self, job_id, result, owner=None):
+        self._complete(job_id, DONE, owner, result=json.dumps(result))
+
+    def fail(self, job_id, error, owner=None):
+        self._complete(job_id, FAILED, owner, error=error)
+
+    def _complete(self, job_id, status, owner=None, result=None, error=None):
+        # Only running jobs can complete, so a job already expired by the
+        # watchdog keeps its timeout error when the worker eventually returns.
+        # Given an owner, a worker that lost its lease cannot complete a job
+        # another worker has claimed since.
+        query = 'UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ? AND status = ?'
+        params = [status, result, error, time.time(), job_id, RUNNING]
+        if owner is not None:
+            query += ' AND owner = ?'
+            params.append(owner)
+        with self._connect() as conn:
+            conn.execute(query, params)
+
+    def expire(self):
+        """Fail running jobs that have outlived their timeout."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                '''UPDATE jobs SET status = ?, error = ?, finished_at = ?
+                   WHERE status = ? AND timeout IS NOT NULL AND started_at + timeout < ?''',
+                (FAILED, 'Job timed out', now, RUNNING, now)
+            )
+
+    def requeue_expired(self, lease):
+        """Put running jobs not renewed for ``lease`` seconds back on the queue.
+
+        Their worker died or lost touch with the store; jobs a live worker
+        keeps renewing, in this process or another, are left alone.
+        """
+        with self._connect() as conn:
+            conn.execute(
+                '''UPDATE jobs SET status = ?, started_at = NULL, owner = NULL, heartbeat_at = NULL
+                   WHERE status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)''',
+                (QUEUED, RUNNING, time.time() - lease)
+            )
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    @staticmethod
+    def _to_dict(row):
+        return {
+            'id': row['id'],
+            'kind': row['kind'],
+            'params': json.loads(row['params']),
+            'status': row['status'],
+            'progress': json.loads(row['progress']),
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+            'timeout': row['timeout'],
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at'],
+        }
+
+
+class Progress:
+    """Progress callback handed to job handlers.
+
+    Counters are flushed to the store at most every ``interval`` seconds, and
+    every call checks the job deadline so long-running stages can be aborted.
+    """
+
+    def __init__(self, store, job_id, timeout=None, interval=0.5):
+        self.store = store
+        self.job_id = job_id
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.interval = interval
+        self.state = {}
+        self._flushed_at = 0.0
+
+    def __call__(self, stage=None, **counters):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise JobTimeout('Job timed out')
+        changed_stage = stage is not None and stage != self.state.get('stage')
+        if stage is not None:
+            self.state['stage'] = stage
+        self.state.update(counters)
+        now = time.monotonic()
+        if changed_stage or now - self._flushed_at >= self.interval:
+            self.store.update_progress(self.job_id, self.state)
+            self._flushed_at = now
+
+    @property
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
+
+
+class JobQueue:
+    """A bounded pool of worker threads draining a :class:`JobStore`.
+
+    Workers start lazily on the first submission so that importing the app
+    (or running the test suite) does not spawn threads. Alongside them a
+    heartbeat thread renews the queue's leases every third of ``lease``
+    seconds.
+    """
+
+    def __init__(self, app, store, max_workers=2, timeout=None, poll_interval=1.0, lease=60.0):
+        self.app = app
+        self.store = store
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._wakeup = threading.Condition()
+        self._halt = threading.Event()
+        self._threads = []
+        self._started = False
+        self._stopping = False
+        self._lock = threading.Lock()
+
+    def submit(self, kind, params, timeout=None):
+        if kind not in _handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = self.store.enqueue(kind, params, timeout or self.timeout)
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        self.store.expire()
+        return self.store.get(job_id)
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self._stopping = False
+            self._halt.clear()
+            self.store.requeue_expired(self.lease)
+            targets = [(self._heartbeat, 'repolens-job-heartbeat')] if self.max_workers else []
+            targets += [(self._work, f'repolens-job-{i}') for i in range(self.max_workers)]
+            for target, name in targets:
+                thread = threading.Thread(target=target, name=name, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        self._stopping = True
+        self._halt.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._started = False
+
+    def run_pending(self):
+        """Process queued jobs in the calling thread until the queue is empty."""
+        while self._run_one():
+            pass
+
+    def _heartbeat(self):
+        # Waits on its own event so it never takes a submit() wakeup meant for a worker
+        while not self._halt.is_set():
+            self.store.heartbeat(self.owner)
+            self._halt.wait(self.lease / 3)
+
+    def _work(self):
+        while not self._stopping:
+            if not self._run_one():
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+
+    def _run_one(self):
+        self.store.expire()
+        self.store.requeue_expired(self.lease)
+        job = self.store.claim(self.owner)
+        if job is None:
+            return False
+
+        progress = Progress(self.store, job['id'], job['timeout'])
+        try:
+            with self.app.app_context():
+                result = _handlers[job['kind']](job['params'], progress)
+        except JobTimeout as e:
+            self.store.fail(job['id'], str(e), self.owner)
+        except Exception as e:
+            self.store.fail(job['id'], f"{type(e).__name__}: {e}", self.owner)
+        else:
+            self.store.finish(job['id'], result, self.owner)
+        return True
+
+
+@job_handler('package')
+def _package_job(params, progress):
+    repo_id, error = package_repository(params['repo_url'], progress=progress, **params.get('options', {}))
+    if error:
+        raise RuntimeError(error)
+    repository = db.session.get(Repository, repo_id)
+    return {'repo_id': repo_id, 'repo_name': repository.name}
+
+
+@job_handler('package_batch')
+def _package_batch_job(params, progress):
+    return package_batch(params['repo_urls'], progress=progress, **params.get('options', {}))
+
+
+def get_queue(app=None):
+    app = app or current_app
+    return app.extensions['repolens_jobs']
+
+
+def init_app(app):
+    # Shared by every worker and CLI run on the host, wherever it was started from
+    app.config.setdefault('REPOLENS_JOBS_DB', os.environ.get(
+        'REPOLENS_JOBS_DB', os.path.join(os.path.expanduser('~'), '.cache', 'repolens', 'jobs.db')))
+    app.config.setdefault('REPOLENS_JOB_WORKERS', int(os.environ.get('REPOLENS_JOB_WORKERS', 2)))
+    app.config.setdefault('REPOLENS_JOB_TIMEOUT', float(os.environ.get('REPOLENS_JOB_TIMEOUT', 1800)))
+    # Seconds without a heartbeat before another worker may take a running job over
+    app.config.setdefault('REPOLENS_JOB_LEASE', float(os.environ.get('REPOLENS_JOB_LEASE', 60)))
+
+    store = JobStore(app.config['REPOLENS_JOBS_DB'], sqlite_pragmas_enabled(app))
+    app.extensions['repolens_jobs'] = JobQueue(
+        app, store,
+        max_workers=app.config['REPOLENS_JOB_WORKERS'],
+        timeout=app.config['REPOLENS_JOB_TIMEOUT'] or None,
+        lease=app.config['REPOLENS_JOB_LEASE'],
+    )
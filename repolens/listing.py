@@ -0,0 +1,111 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.orm import load_only
+from repolens.database import db
+from repolens.models import Repository, Analysis
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+# Fields returned unless ``fields`` asks otherwise; the JSON columns are
+# only read from the database when requested.
+REPOSITORY_FIELDS = ('id', 'name', 'url', 'created_at', 'packaged_data')
+DEFAULT_REPOSITORY_FIELDS = ('id', 'name', 'url', 'created_at')
+ANALYSIS_FIELDS = ('id', 'repository_id', 'analysis_type', 'created_at', 'result')
+DEFAULT_ANALYSIS_FIELDS = ('id', 'repository_id', 'analysis_type', 'created_at')
+
+
+class ListingError(Exception):
+    pass
+
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(json.dumps([last_id]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        last_id, = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        raise ListingError("Invalid cursor")
+    if not isinstance(last_id, int) or isinstance(last_id, bool):
+        raise ListingError("Invalid cursor")
+    return last_id
+
+
+def parse_fields(fields, allowed, default):
+    """Return the requested field names from a comma separated ``fields`` value."""
+    if not fields:
+        return default
+    names = tuple(dict.fromkeys(name.strip() for name in fields.split(',') if name.strip()))
+    unknown = [name for name in names if name not in allowed]
+    if unknown or not names:
+        raise ListingError(f"Unknown fields: {', '.join(unknown)}; expected some of {', '.join(allowed)}")
+    return names
+
+
+def parse_since(since):
+    try:
+        return datetime.fromisoformat(since)
+    except (TypeError, ValueError):
+        raise ListingError("since must be an ISO 8601 date")
+
+
+def _page(model, fields, filters, limit, cursor):
+    """Return ``(rows, next_cursor)`` for one page, newest first.
+
+    Ids grow with insertion, so ordering by id descending is creation order
+    and the last id seen is enough to resume: no OFFSET, and each page
+    costs the same however deep it is.
+    """
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ListingError(f"limit must be between 1 and {MAX_LIMIT}")
+    # Only the selected columns are loaded; the rest stay deferred
+    query = (select(model).options(load_only(*(getattr(model, name) for name in fields)))
+             .where(*filters).order_by(model.id.desc()).limit(limit + 1))
+    if cursor:
+        query = query.where(model.id < decode_cursor(cursor))
+    rows = list(db.session.scalars(query))
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].id)
+
+
+def _serialize(row, fields):
+    item = {}
+    for name in fields:
+        value = getattr(row, name)
+        item[name] = value.isoformat() if isinstance(value, datetime) else value
+    return item
+
+
+def list_repositories(fields=DEFAULT_REPOSITORY_FIELDS, name=None, url=None, since=None,
+                      limit=DEFAULT_LIMIT, cursor=None):
+    """Return ``(items, next_cursor)`` for packaged snapshots matching the filters."""
+    filters = []
+    if name is not None:
+        filters.append(Repository.name == name)
+    if url is not None:
+        filters.append(Repository.url == url)
+    if since is not None:
+        filters.append(Repository.created_at >= parse_since(since))
+    rows, next_cursor = _page(Repository, fields, filters, limit, cursor)
+    return [_serialize(row, fields) for row in rows], next_cursor
+
+
+def list_analyses(fields=DEFAULT_ANALYSIS_FIELDS, repository_id=None, analysis_type=None, since=None,
+                  limit=DEFAULT_LIMIT, cursor=None):
+    """Return ``(items, next_cursor)`` for analyses matching the filters."""
+    filters = []
+    if repository_id is not None:
+        filters.append(Analysis.repository_id == repository_id)
+    if analysis_type is not None:
+        filters.append(Analysis.analysis_type == analysis_type)
+    if since is not None:
+        filters.append(Analysis.created_at >= parse_since(since))
+    rows, next_cursor = _page(Analysis, fields, filters, limit, cursor)
+    return [_serialize(row, fields) for row in rows], next_cursor
@@ -0,0 +1,239 @@
+import multiprocessing
+import os
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from repolens.utils import GitError, write_lines
+
+# Blob contents are read and counted this many bytes at a time
+CHUNK_SIZE = 64 * 1024
+# Like git, treat a file as binary when its first 8000 bytes contain a NUL
+SNIFF_BYTES = 8000
+# Blobs handed to each worker task; smaller scans run in the calling process
+BATCH_SIZE = 2000
+
+_C = ((b'//',), (b'/*', b'*/'))
+_HASH = ((b'#',), None)
+_DASHES = ((b'--',), None)
+_MARKUP = ((), (b'<!--', b'-->'))
+
+# language -> (line comment prefixes, (block start, block end) or None)
+LANGUAGES = {
+    'C': _C, 'C++': _C, 'C#': _C, 'Go': _C, 'Java': _C, 'JavaScript': _C, 'Kotlin': _C,
+    'Rust': _C, 'Scala': _C, 'Swift': _C, 'TypeScript': _C, 'Dart': _C,
+    'CSS': ((), (b'/*', b'*/')), 'SCSS': _C, 'Less': _C,
+    'PHP': ((b'//', b'#'), (b'/*', b'*/')),
+    'Python': _HASH, 'Ruby': _HASH, 'Shell': _HASH, 'Perl': _HASH, 'R': _HASH, 'YAML': _HASH,
+    'TOML': _HASH, 'Makefile': _HASH, 'Dockerfile': _HASH, 'CMake': _HASH, 'Nix': ((b'#',), (b'/*', b'*/')),
+    'SQL': ((b'--',), (b'/*', b'*/')), 'Haskell': ((b'--',), (b'{-', b'-}')), 'Lua': _DASHES,
+    'Elixir': _HASH, 'Erlang': ((b'%',), None), 'Clojure': ((b';',), None), 'Lisp': ((b';',), None),
+    'Vim script': ((b'"',), None), 'Fortran': ((b'!',), None), 'MATLAB': ((b'%',), None),
+    'HTML': _MARKUP, 'XML': _MARKUP, 'Vue': _MARKUP,
+    'INI': ((b';', b'#'), None), 'Batch': ((b'REM', b'rem', b'::'), None),
+    'Markdown': ((), None), 'reStructuredText': ((), None), 'JSON': ((), None), 'Text': ((), None),
+}
+
+EXTENSIONS = {
+    'c': 'C', 'h': 'C', 'cc': 'C++', 'cpp': 'C++', 'cxx': 'C++', 'hpp': 'C++', 'hh': 'C++',
+    'cs': 'C#', 'go': 'Go', 'java': 'Java', 'js': 'JavaScript', 'mjs': 'JavaScript', 'cjs': 'JavaScript',
+    'jsx': 'JavaScript', 'kt': 'Kotlin', 'kts': 'Kotlin', 'rs': 'Rust', 'scala': 'Scala', 'swift': 'Swift',
+    'ts': 'TypeScript', 'tsx': 'TypeScript', 'dart': 'Dart', 'css': 'CSS', 'scss': 'SCSS', 'less': 'Less',
+    'php': 'PHP', 'py': 'Python', 'pyi': 'Python', 'rb': 'Ruby', 'sh': 'Shell', 'bash': 'Shell',
+    'zsh': 'Shell', 'pl': 'Perl', 'pm': 'Perl', 'r': 'R', 'yml': 'YAML', 'yaml': 'YAML', 'toml': 'TOML',
+    'mk': 'Makefile', 'cmake': 'CMake', 'nix': 'Nix', 'sql': 'SQL', 'hs': 'Haskell', 'lua': 'Lua',
+    'ex': 'Elixir', 'exs': 'Elixir', 'erl': 'Erlang', 'clj': 'Clojure', 'lisp': 'Lisp', 'el': 'Lisp',
+    'vim': 'Vim script', 'f90': 'Fortran', 'm': 'MATLAB', 'html': 'HTML', 'htm': 'HTML', 'xml': 'XML',
+    'vue': 'Vue', 'ini': 'INI', 'cfg': 'INI', 'bat': 'Batch', 'cmd': 'Batch', 'md': 'Markdown',
+    'rst': 'reStructuredText', 'json': 'JSON', 'txt': 'Text',
+}
+
+FILENAMES = {
+    'Makefile': 'Makefile', 'GNUmakefile': 'Makefile', 'Dockerfile': 'Dockerfile',
+    'CMakeLists.txt': 'CMake', 'Gemfile': 'Ruby', 'Rakefile': 'Ruby',
+}
+
+
+def detect_language(path):
+    """Return the language name for ``path``, or None when it is not recognised."""
+    name = os.path.basename(path)
+    if name in FILENAMES:
+        return FILENAMES[name]
+    if '.' not in name:
+        return None
+    return EXTENSIONS.get(name.rsplit('.', 1)[1].lower())
+
+
+class LineCounter:
+    """Counts lines of one file fed to it in arbitrary byte chunks.
+
+    Comment detection is line based: a line is a comment when it starts
+    with a line comment prefix or lies inside a block comment. Comment
+    markers inside string literals are not recognised.
+    """
+
+    def __init__(self, language=None):
+        self.line_comments, self.block = LANGUAGES.get(language, ((), None))
+        self.binary = False
+        self.lines = self.code = self.comment = self.blank = 0
+        self._pending = b''
+        self._sniffed = 0
+        self._in_block = False
+
+    def feed(self, chunk):
+        if self.binary:
+            return
+        if self._sniffed < SNIFF_BYTES:
+            if b'\0' in chunk[:SNIFF_BYTES - self._sniffed]:
+                self.binary = True
+                return
+            self._sniffed += len(chunk)
+        lines = (self._pending + chunk).split(b'\n')
+        self._pending = lines.pop()
+        for line in lines:
+            self._count(line)
+
+    def close(self):
+        if self._pending and not self.binary:
+            self._count(self._pending)
+        self._pending = b''
+        if self.binary:
+            return {'binary': True, 'lines': None, 'code_lines': None, 'comment_lines': None,
+                    'blank_lines': None}
+        return {'binary': False, 'lines': self.lines, 'code_lines': self.code,
+                'comment_lines': self.comment, 'blank_lines': self.blank}
+
+    def _count(self, line):
+        self.lines += 1
+        line = line.strip()
+        if not line:
+            self.blank += 1
+            return
+        if self._in_block:
+            end = line.find(self.block[1])
+            if end == -1:
+                self.comment += 1
+                return
+            self._in_block = False
+            line = line[end + len(self.block[1]):].strip()
+            if not line:
+                self.comment += 1
+                return
+        self._classify(line)
+
+    def _classify(self, line):
+        if self.line_comments and line.startswith(self.line_comments):
+            self.comment += 1
+            return
+        if self.block and line.startswith(self.block[0]):
+            end = line.find(self.block[1], len(self.block[0]))
+            if end == -1:
+                self._in_block = True
+                self.comment += 1
+                return
+            line = line[end + len(self.block[1]):].strip()
+            if not line:
+                self.comment += 1
+                return
+        self._classify_code(line)
+
+    def _classify_code(self, line):
+        self.code += 1
+        # A block comment opened after code and left open swallows the
+        # following lines.
+        if self.block:
+            start = line.rfind(self.block[0])
+            if start != -1 and line.find(self.block[1], start + len(self.block[0])) == -1:
+                self._in_block = True
+
+
+def count_lines(chunks, language=None):
+    """Count the lines of a file given as an iterable of byte chunks."""
+    counter = LineCounter(language)
+    for chunk in chunks:
+        counter.feed(chunk)
+    return counter.close()
+
+
+def scan_blobs(git_dir, entries, chunk_size=CHUNK_SIZE):
+    """Count the lines of ``(blob_sha, language)`` entries from one git process.
+
+    Blob contents are streamed from ``git cat-file --batch`` and counted
+    ``chunk_size`` bytes at a time, so no file is ever held in memory
+    whole. Returns one stats dict per entry, in order.
+    """
+    errors = tempfile.TemporaryFile()
+    process = subprocess.Popen(['git', '--git-dir', git_dir, 'cat-file', '--batch'],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=errors)
+    # Requests are written from a thread so a large batch cannot fill both
+    # pipes and deadlock.
+    writer = threading.Thread(target=write_lines, args=(process.stdin, [sha for sha, _ in entries]),
+                              daemon=True)
+    writer.start()
+    results = []
+    try:
+        for sha, language in entries:
+            header = process.stdout.readline().split()
+            if len(header) != 3 or header[1] != b'blob':
+                raise GitError(f"Cannot read blob {sha}: {b' '.join(header).decode('ascii', 'replace')}")
+            remaining = int(header[2])
+            counter = LineCounter(language)
+            while remaining:
+                chunk = process.stdout.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise GitError(f"Unexpected end of output while reading blob {sha}")
+                remaining -= len(chunk)
+                counter.feed(chunk)
+            process.stdout.read(1)
+            results.append(counter.close())
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        writer.join()
+        process.stdout.close()
+        errors.close()
+    return results
+
+
+def scan_files(git_dir, files, workers=1, progress=None, batch_size=BATCH_SIZE):
+    """Add language and line statistics to file dicts carrying a ``blob`` sha.
+
+    Each distinct ``(blob, language)`` pair is counted once. Batches of
+    blobs are spread over ``workers`` processes, each streaming from its
+    own ``git cat-file``. Files without a blob are left untouched.
+    """
+    unique = {}
+    for file in files:
+        file['language'] = detect_language(file['path'])
+        if file.get('blob'):
+            unique.setdefault((file['blob'], file['language']), None)
+    entries = list(unique)
+    batches = [entries[i:i + batch_size] for i in range(0, len(entries), batch_size)]
+
+    scanned = 0
+    if workers > 1 and len(batches) > 1:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=min(workers, len(batches)), mp_context=context) as pool:
+            results = pool.map(scan_blobs, [git_dir] * len(batches), batches)
+            for batch, stats in zip(batches, results):
+                unique.update(zip(batch, stats))
+                scanned += len(batch)
+                if progress is not None:
+                    progress(scanned=scanned)
+    else:
+        for batch in batches:
+            unique.update(zip(batch, scan_blobs(git_dir, batch)))
+            scanned += len(batch)
+            if progress is not None:
+                progress(scanned=scanned)
+
+    for file in files:
+        stats = unique.get((file.get('blob'), file['language']))
+        if stats is not None:
+            file.update(stats)
+    return files
+
+
+def init_app(app):
+    app.config.setdefault('REPOLENS_SCAN_WORKERS', int(os.environ.get('REPOLENS_SCAN_WORKERS', os.cpu_count() or 1)))
@@ -0,0 +1,198 @@
+import bisect
+import contextlib
+import cProfile
+import os
+import threading
+import time
+from flask import Response, current_app, g, has_app_context, request
+
+# Upper bounds in seconds; wide enough for a sub-millisecond lookup and a
+# half-hour clone alike.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+PROFILE_HEADER = 'X-Repolens-Profile'
+
+_DISABLED = contextlib.nullcontext()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Histogram:
+    """A Prometheus histogram with one series per combination of label values."""
+
+    def __init__(self, name, help, labelnames, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts plus the overflow bucket, then the sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        """Return ``{labels: (cumulative bucket counts, count, sum)}``."""
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        result = {}
+        for labels, values in series.items():
+            cumulative, total = [], 0
+            for count in values[:-1]:
+                total += count
+                cumulative.append(total)
+            result[labels] = (cumulative, total, values[-1])
+        return result
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for labels, (cumulative, count, total) in sorted(self.samples().items()):
+            pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels)]
+            for bound, value in zip(self.buckets + (float('inf'),), cumulative):
+                bucket = ','.join(pairs + [f'le="{_format(bound)}"'])
+                lines.append(f'{self.name}_bucket{{{bucket}}} {value}')
+            suffix = '{' + ','.join(pairs) + '}' if pairs else ''
+            lines.append(f'{self.name}_sum{suffix} {total!r}')
+            lines.append(f'{self.name}_count{suffix} {count}')
+        return lines
+
+
+class Metrics:
+    """Timing histograms for requests, operations and their stages."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.requests = Histogram('repolens_request_duration_seconds', 'Time spent handling HTTP requests.',
+                                  ('method', 'endpoint', 'status'), buckets)
+        self.operations = Histogram('repolens_operation_duration_seconds',
+                                    'Time spent in packaging, analysis and screenshot operations.',
+                                    ('operation',), buckets)
+        self.stages = Histogram('repolens_stage_duration_seconds', 'Time spent in each stage of an operation.',
+                                ('operation', 'stage'), buckets)
+
+    def record(self, operation, stages, total=None):
+        """Record ``{stage: seconds}`` for one run of ``operation``."""
+        for stage, seconds in stages.items():
+            self.stages.observe(seconds, operation, stage)
+        if total is not None:
+            self.operations.observe(total, operation)
+
+    def render(self):
+        lines = []
+        for histogram in (self.requests, self.operations, self.stages):
+            lines += histogram.render()
+        return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+    """Accumulates wall-clock time per stage of one operation.
+
+    Works without an application, so the git side of packaging can be
+    timed in a worker process and the picklable :attr:`stages` recorded by
+    the parent.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def get_metrics(app=None):
+    """Return the app's metrics, or None when they are disabled or there is no app."""
+    if app is None:
+        if not has_app_context():
+            return None
+        app = current_app
+    return app.extensions.get('repolens_metrics')
+
+
+@contextlib.contextmanager
+def _span(metrics, operation, stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        if stage is None:
+            metrics.operations.observe(elapsed, operation)
+        else:
+            metrics.stages.observe(elapsed, operation, stage)
+
+
+def span(operation, stage=None):
+    """Time a block as ``stage`` of ``operation``, or as the whole operation.
+
+    Returns a shared no-op context manager when metrics are disabled.
+    """
+    metrics = get_metrics()
+    if metrics is None:
+        return _DISABLED
+    return _span(metrics, operation, stage)
+
+
+def _start_request():
+    g.repolens_request_started = time.perf_counter()
+    profile_dir = current_app.config['REPOLENS_PROFILE_DIR']
+    if profile_dir and request.headers.get(PROFILE_HEADER):
+        g.repolens_profile = cProfile.Profile()
+        g.repolens_profile.enable()
+
+
+def _finish_request(response):
+    profile = g.pop('repolens_profile', None)
+    if profile is not None:
+        # Streamed bodies are produced after this point and are not included
+        profile.disable()
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{threading.get_ident()}-{request.endpoint}.prof"
+        profile_dir = current_app.config['REPOLENS_PROFILE_DIR']
+        os.makedirs(profile_dir, exist_ok=True)
+        profile.dump_stats(os.path.join(profile_dir, name))
+        response.headers[PROFILE_HEADER] = name
+    started = g.pop('repolens_request_started', None)
+    metrics = get_metrics()
+    if started is not None and metrics is not None:
+        metrics.requests.observe(time.perf_counter() - started, request.method,
+                                 request.endpoint or 'unmatched', str(response.status_code))
+    return response
+
+
+def metrics_view():
+    return Response(get_metrics().render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    app.config.setdefault('REPOLENS_METRICS', os.environ.get('REPOLENS_METRICS', '1') != '0')
+    # cProfile dumps of requests sent with the X-Repolens-Profile header are written here
+    app.config.setdefault('REPOLENS_PROFILE_DIR', os.environ.get('REPOLENS_PROFILE_DIR'))
+
+    if app.config['REPOLENS_METRICS']:
+        app.extensions['repolens_metrics'] = Metrics()
+        app.add_url_rule('/metrics', 'metrics', metrics_view)
+    else:
+        app.extensions.pop('repolens_metrics', None)
+    if app.config['REPOLENS_METRICS'] or app.config['REPOLENS_PROFILE_DIR']:
+        app.before_request(_start_request)
+        app.after_request(_finish_request)
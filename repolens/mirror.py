@@ -0,0 +1,87 @@
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from flask import current_app
+from repolens.utils import run_git
+
+
+class MirrorCache:
+    """Persistent bare mirrors of packaged repositories, keyed by URL.
+
+    The first sync of a URL does a ``git clone --mirror``; later syncs only
+    fetch what changed upstream. A per-mirror file lock serializes syncs of
+    the same URL across threads and processes.
+
+    Shallow (``depth``/``since``) and blobless (``partial``) mirrors are kept
+    apart from full ones, so a bounded package never truncates the mirror a
+    full package relies on.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path_for(self, repo_url, depth=None, since=None, partial=False):
+        key = repo_url
+        mode = [f'{name}={value}' for name, value in
+                (('depth', depth), ('since', since), ('partial', partial)) if value]
+        if mode:
+            key += '#' + '&'.join(mode)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, f'{digest}.git')
+
+    @contextmanager
+    def _locked(self, path):
+        os.makedirs(self.root, exist_ok=True)
+        with open(f'{path}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def sync(self, repo_url, depth=None, since=None, partial=False, timeout=None):
+        """Create or update the mirror of ``repo_url`` and return its path."""
+        path = self.path_for(repo_url, depth, since, partial)
+        history = []
+        if depth:
+            history.append(f'--depth={int(depth)}')
+        if since:
+            history.append(f'--shallow-since={since}')
+
+        with self._locked(path):
+            if os.path.isdir(path):
+                # Partial mirrors remember their filter in the remote config.
+                run_git(path, 'fetch', '--prune', '--quiet', *history, 'origin', timeout=timeout)
+            else:
+                if partial:
+                    history.append('--filter=blob:none')
+                # Clone next to the final location and rename, so an
+                # interrupted clone never leaves a half-populated mirror.
+                staging = tempfile.mkdtemp(dir=self.root, prefix='.clone-')
+                try:
+                    run_git(None, 'clone', '--mirror', '--quiet', *history, '--', repo_url, staging,
+                            timeout=timeout)
+                    os.rename(staging, path)
+                except BaseException:
+                    shutil.rmtree(staging, ignore_errors=True)
+                    raise
+        return path
+
+    def remove(self, repo_url, **mode):
+        path = self.path_for(repo_url, **mode)
+        with self._locked(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def get_mirror_cache(app=None):
+    app = app or current_app
+    return app.extensions['repolens_mirrors']
+
+
+def init_app(app):
+    app.config.setdefault('REPOLENS_MIRROR_DIR', os.environ.get(
+        'REPOLENS_MIRROR_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'repolens', 'mirrors')))
+    app.extensions['repolens_mirrors'] = MirrorCache(app.config['REPOLENS_MIRROR_DIR'])
@@ -3,16 +3,119 @@ from datetime import datetime
 
 class Repository(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    url = db.Column(db.String(200), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    name = db.Column(db.String(100), nullable=False, index=True)
+    url = db.Column(db.String(200), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     packaged_data = db.Column(db.JSON)
 
+class RepositoryFile(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    repository_id = db.Column(db.Integer, db.ForeignKey('repository.id'), nullable=False)
+    path = db.Column(db.Text, nullable=False)
+    extension = db.Column(db.Text, nullable=False)
+    size = db.Column(db.BigInteger)
+    blob = db.Column(db.String(64))
+    # Line statistics from repolens.loc; all None when the file was not
+    # scanned (blobless clones, older snapshots), line counts None for binaries
+    language = db.Column(db.Text)
+    binary = db.Column(db.Boolean)
+    lines = db.Column(db.Integer)
+    code_lines = db.Column(db.Integer)
+    comment_lines = db.Column(db.Integer)
+    blank_lines = db.Column(db.Integer)
+
+    __table_args__ = (
+        db.Index('ix_repository_file_repository_path', 'repository_id', 'path'),
+        db.Index('ix_repository_file_repository_extension', 'repository_id', 'extension'),
+    )
+
+class RepositoryCommit(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    repository_id = db.Column(db.Integer, db.ForeignKey('repository.id'), nullable=False)
+    # 0 is the newest commit, matching the order git log reports them in
+    position = db.Column(db.Integer, nullable=False)
+    hash = db.Column(db.String(64), nullable=False)
+    author = db.Column(db.String(255), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    # Commit date in UTC plus the committer's offset, so the original
+    # ISO 8601 timestamp can be reproduced exactly
+    date = db.Column(db.DateTime, nullable=False)
+    utc_offset = db.Column(db.Integer, nullable=False, default=0)
+    # Lines added and removed and files touched, from git log --numstat;
+    # None when not collected (blobless clones, shallow boundaries)
+    insertions = db.Column(db.Integer)
+    deletions = db.Column(db.Integer)
+    files_changed = db.Column(db.Integer)
+
+    __table_args__ = (
+        db.Index('ix_repository_commit_repository_position', 'repository_id', 'position'),
+        db.Index('ix_repository_commit_repository_author', 'repository_id', 'author'),
+        db.Index('ix_repository_commit_repository_date', 'repository_id', 'date'),
+    )
+
+class RepositoryFileHistory(db.Model):
+    # One author's changes to a file over the packaged history, from
+    # git log --numstat; only files in the snapshot's tree are kept, and
+    # blobless clones have no rows
+    id = db.Column(db.Integer, primary_key=True)
+    repository_id = db.Column(db.Integer, db.ForeignKey('repository.id'), nullable=False)
+    path = db.Column(db.Text, nullable=False)
+    author = db.Column(db.String(255), nullable=False)
+    commits = db.Column(db.Integer, nullable=False)
+    insertions = db.Column(db.Integer, nullable=False)
+    deletions = db.Column(db.Integer, nullable=False)
+    # UTC, like RepositoryCommit.date
+    last_modified = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_repository_file_history_repository_path', 'repository_id', 'path', 'author'),
+    )
+
+class RepositoryBranch(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    repository_id = db.Column(db.Integer, db.ForeignKey('repository.id'), nullable=False, index=True)
+    name = db.Column(db.String(255), nullable=False)
+
+class RepositoryDependency(db.Model):
+    # A package one manifest of the snapshot requires, by normalized name
+    id = db.Column(db.Integer, primary_key=True)
+    repository_id = db.Column(db.Integer, db.ForeignKey('repository.id'), nullable=False)
+    manifest = db.Column(db.Text, nullable=False)
+    ecosystem = db.Column(db.String(16), nullable=False)
+    name = db.Column(db.String(255), nullable=False)
+    spec = db.Column(db.Text)
+    # runtime, dev, optional, peer, build or indirect
+    kind = db.Column(db.String(16), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_repository_dependency_repository_manifest', 'repository_id', 'manifest'),
+        db.Index('ix_repository_dependency_package', 'ecosystem', 'name', 'repository_id'),
+    )
+
+class RepositoryPackage(db.Model):
+    # A package the snapshot publishes, named by one of its manifests
+    id = db.Column(db.Integer, primary_key=True)
+    repository_id = db.Column(db.Integer, db.ForeignKey('repository.id'), nullable=False)
+    manifest = db.Column(db.Text, nullable=False)
+    ecosystem = db.Column(db.String(16), nullable=False)
+    name = db.Column(db.String(255), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_repository_package_repository_manifest', 'repository_id', 'manifest'),
+        db.Index('ix_repository_package_package', 'ecosystem', 'name', 'repository_id'),
+    )
+
 class Analysis(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     repository_id = db.Column(db.Integer, db.ForeignKey('repository.id'), nullable=False)
     analysis_type = db.Column(db.String(50), nullable=False)
+    # ``Analyzer.version`` that produced the result; rows from other versions are not reused
+    analyzer_version = db.Column(db.Integer)
     result = db.Column(db.JSON)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     repository = db.relationship('Repository', backref=db.backref('analyses', lazy=True))
+
+    __table_args__ = (
+        db.Index('ix_analysis_repository_type', 'repository_id', 'analysis_type'),
+    )
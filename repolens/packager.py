@@ -1,61 +1,395 @@
 import os
-import json
-import git
-import shutil
 import tempfile
+from datetime import datetime, timezone
+from flask import current_app
 from repolens.models import Repository
 from repolens.database import db
+from repolens.storage import (save_package, save_incremental_package, latest_snapshot,
+                              is_normalized)
+from repolens.mirror import get_mirror_cache
+from repolens.loc import scan_files
+from repolens.dependencies import extract_manifests
+from repolens.snapshot import get_snapshot_store
+from repolens.search import get_search_index
+from repolens.blobs import get_blob_store
+from repolens.history import FileHistory
+from repolens.metrics import StageTimer, get_metrics
+from repolens.utils import run_git, iter_git_records, GitError
 
-def package_repository(repo_url):
-    # Create a unique temporary directory
+LISTING_MODES = ('tree', 'checkout')
+DEFAULT_CLONE = {'depth': None, 'since': None, 'partial': False}
+
+def _report(progress, stage=None, **counters):
+    if progress is not None:
+        progress(stage, **counters)
+
+def _repo_name(repo_url):
+    return repo_url.rstrip('/').split('/')[-1].replace('.git', '')
+
+def _walk_files(repo_path, progress):
+    files = []
+    for root, dirs, names in os.walk(repo_path):
+        if root == repo_path and '.git' in dirs:
+            dirs.remove('.git')
+        for name in names:
+            file_path = os.path.join(root, name)
+            files.append({
+                'path': os.path.relpath(file_path, repo_path),
+                'size': os.path.getsize(file_path)
+            })
+            _report(progress, files=len(files))
+    files.sort(key=lambda f: f['path'])
+    return files
+
+def _list_tree(git_dir, rev, progress, sizes=True):
+    # Paths and blob sizes come straight from the object database; nothing is
+    # written to disk. Submodules (commit entries) have no blob and are skipped.
+    # Blobless clones do not have the blobs, so their sizes are left unknown
+    # rather than fetching every blob lazily.
+    files = []
+    args = ['ls-tree', '-r', '-z', '--full-tree', rev]
+    if sizes:
+        args.insert(1, '-l')
+    for record in iter_git_records(git_dir, *args):
+        if not record:
+            continue
+        meta, path = record.split(b'\t', 1)
+        fields = meta.split()
+        if fields[1] != b'blob':
+            continue
+        size = int(fields[3]) if sizes else None
+        files.append({'path': path.decode('utf-8', 'surrogateescape'), 'size': size,
+                      'blob': fields[2].decode('ascii')})
+        _report(progress, files=len(files))
+    # Recursive ls-tree output is already in path order.
+    return files
+
+def _checkout_files(git_dir, progress):
+    # Check out a throwaway working tree that shares objects with the mirror.
     with tempfile.TemporaryDirectory() as temp_dir:
-        # Clone the repository
-        repo_name = repo_url.split('/')[-1].replace('.git', '')
-        repo_path = os.path.join(temp_dir, repo_name)
-        
-        try:
-            git.Repo.clone_from(repo_url, repo_path)
-        except git.exc.GitCommandError as e:
-            return None, f"Error cloning repository: {str(e)}"
-
-        # Collect repository data
-        repo_data = {
-            'name': repo_name,
-            'url': repo_url,
-            'files': [],
-            'commits': [],
-            'branches': []
+        repo_path = os.path.join(temp_dir, 'checkout')
+        run_git(None, 'clone', '--quiet', '--shared', '--', git_dir, repo_path)
+        return _walk_files(repo_path, progress)
+
+# One NUL-terminated field per placeholder; with -z git also terminates each
+# commit with NUL, and a commit message can never contain one.
+COMMIT_FORMAT = '%H%x00%an%x00%cI%x00%B'
+COMMIT_FIELDS = 4
+
+def extract_commits(git_dir, rev='HEAD', depth=None, since=None, stats=False, paths=False):
+    """Stream commit records for ``rev`` from a single ``git log`` process.
+
+    Yields dicts shaped like the ``commits`` entries of a package, newest
+    first, stopping at ``depth`` commits or at commits older than ``since``.
+    With ``stats`` each record also carries ``insertions``, ``deletions``
+    and ``files_changed`` from ``--numstat`` (binary files count as
+    changed files without lines; merges have no diff and count zero).
+    With ``paths`` as well, ``paths`` lists ``(path, added, deleted)`` for
+    every changed file, the line counts None for binaries.
+    """
+    args = ['log', '-z', f'--format={COMMIT_FORMAT}']
+    if stats:
+        args += ['--numstat', '--no-renames']
+    if depth:
+        args.append(f'--max-count={int(depth)}')
+    if since:
+        args.append(f'--since={since}')
+    args += [rev, '--']
+
+    fields = []
+    commit = None
+    for field in iter_git_records(git_dir, *args):
+        # --numstat entries ("added<TAB>deleted<TAB>path") follow the
+        # commit they belong to; a commit hash never contains a tab.
+        if stats and commit is not None and not fields and b'\t' in field:
+            added, deleted, path = field.lstrip(b'\n').split(b'\t', 2)
+            commit['files_changed'] += 1
+            if added != b'-':
+                added, deleted = int(added), int(deleted)
+                commit['insertions'] += added
+                commit['deletions'] += deleted
+            else:
+                added = deleted = None
+            if paths:
+                commit['paths'].append((path.decode('utf-8', 'surrogateescape'), added, deleted))
+            continue
+        fields.append(field)
+        if len(fields) < COMMIT_FIELDS:
+            continue
+        if commit is not None:
+            yield commit
+        hexsha, author, date, message = fields
+        fields = []
+        commit = {
+            'hash': hexsha.decode('ascii'),
+            'author': author.decode('utf-8', 'replace'),
+            'message': message.decode('utf-8', 'replace'),
+            'date': date.decode('ascii')
         }
+        if stats:
+            commit.update(insertions=0, deletions=0, files_changed=0)
+            if paths:
+                commit['paths'] = []
+    if commit is not None:
+        yield commit
+
+def _shallow_boundary(git_dir):
+    # Commits whose parents were cut off by a shallow clone
+    try:
+        with open(os.path.join(git_dir, 'shallow')) as f:
+            return set(f.read().split())
+    except FileNotFoundError:
+        return set()
+
+def _collect_commits(git_dir, rev, progress, depth=None, since=None, stats=False):
+    """Return the commit list and, with ``stats``, its :class:`FileHistory`."""
+    # A shallow boundary commit diffs against nothing, so its numstat would
+    # count the whole tree as added.
+    boundary = _shallow_boundary(git_dir) if stats else set()
+    file_history = FileHistory() if stats else None
+    commits = []
+    for commit in extract_commits(git_dir, rev, depth, since, stats, paths=stats):
+        paths = commit.pop('paths', ())
+        if commit['hash'] in boundary:
+            commit.update(insertions=None, deletions=None, files_changed=None)
+        elif file_history is not None:
+            file_history.add(commit, paths)
+        commits.append(commit)
+        _report(progress, commits=len(commits))
+    return commits, file_history
+
+def _list_branches(git_dir):
+    output = run_git(git_dir, 'for-each-ref', '--format=%(refname:short)', 'refs/heads/')
+    return output.decode('utf-8', 'replace').splitlines()
+
+def _blob_sizes(git_dir, shas):
+    if not shas:
+        return {}
+    output = run_git(git_dir, 'cat-file', '--batch-check=%(objectname) %(objectsize)',
+                     input=''.join(f'{sha}\n' for sha in shas).encode())
+    sizes = {}
+    for line in output.decode().splitlines():
+        sha, size = line.split()
+        sizes[sha] = int(size)
+    return sizes
+
+def _changed_paths(git_dir, old_head, new_head):
+    """Yield ``(status, path, blob_sha)`` for files that differ between two commits."""
+    output = run_git(git_dir, 'diff-tree', '-r', '-z', '--no-renames', old_head, new_head)
+    fields = output.split(b'\0')
+    for i in range(0, len(fields) - 1, 2):
+        _, new_mode, _, new_sha, status = fields[i].decode().lstrip(':').split(' ')
+        if new_mode == '160000':
+            # Submodules are not checked out, so they never appear as files.
+            continue
+        yield status, fields[i + 1].decode('utf-8', 'surrogateescape'), new_sha
+
+def _is_ancestor(git_dir, old_head, new_head):
+    try:
+        run_git(git_dir, 'merge-base', '--is-ancestor', old_head, new_head)
+    except GitError:
+        return False
+    return True
+
+def _previous_snapshot(repo_url):
+    previous = latest_snapshot(repo_url)
+    # Snapshots from before normalized storage have no head to diff against
+    if previous is None or not is_normalized(previous) or not (previous.packaged_data or {}).get('head'):
+        return None
+    return previous
+
+def _parse_since(since):
+    cutoff = datetime.fromisoformat(since)
+    if cutoff.tzinfo is None:
+        cutoff = cutoff.replace(tzinfo=timezone.utc)
+    return cutoff
+
+def _scan(git_dir, files, clone, workers, progress):
+    # Blobless clones would have to fetch every blob to count its lines
+    if clone['partial']:
+        return
+    _report(progress, 'scanning', scanned=0)
+    scan_files(git_dir, files, workers, progress)
 
-        # Collect file information
-        for root, _, files in os.walk(repo_path):
+def _manifests(git_dir, files, clone, progress, timer):
+    # Blobless clones would have to fetch the manifests one by one
+    if clone['partial']:
+        return []
+    _report(progress, 'dependencies')
+    with timer.stage('dependencies'):
+        return extract_manifests(git_dir, files)
+
+def _package_full(git_dir, head, clone, listing, scan_workers, progress, timer):
+    _report(progress, 'files', files=0)
+    with timer.stage('files'):
+        if listing == 'checkout':
+            files = _checkout_files(git_dir, progress)
+            blobs = {f['path']: f['blob'] for f in _list_tree(git_dir, head, None, sizes=False)}
             for file in files:
-                file_path = os.path.join(root, file)
-                relative_path = os.path.relpath(file_path, repo_path)
-                repo_data['files'].append({
-                    'path': relative_path,
-                    'size': os.path.getsize(file_path)
-                })
-
-        # Collect commit information
-        repo = git.Repo(repo_path)
-        for commit in repo.iter_commits():
-            repo_data['commits'].append({
-                'hash': commit.hexsha,
-                'author': str(commit.author),
-                'message': commit.message,
-                'date': commit.committed_datetime.isoformat()
-            })
+                file['blob'] = blobs.get(file['path'])
+        else:
+            files = _list_tree(git_dir, head, progress, sizes=not clone['partial'])
+    with timer.stage('scan'):
+        _scan(git_dir, files, clone, scan_workers, progress)
+    _report(progress, 'commits', commits=0)
+    with timer.stage('commits'):
+        # Blobless clones would have to fetch blobs to diff them
+        commits, file_history = _collect_commits(git_dir, head, progress, clone['depth'], clone['since'],
+                                                 stats=not clone['partial'])
+    return files, commits, file_history
+
+def _package_incremental(git_dir, head, clone, base_head, scan_workers, progress, timer):
+    with timer.stage('files'):
+        changes = list(_changed_paths(git_dir, base_head, head))
+        if clone['partial']:
+            sizes = {}
+        else:
+            sizes = _blob_sizes(git_dir, sorted({sha for status, _, sha in changes if status != 'D'}))
+
+    _report(progress, 'files', files=0)
+    changed_files = [{'path': path, 'size': sizes.get(sha), 'blob': sha}
+                     for status, path, sha in changes if status != 'D']
+    deleted_paths = {path for status, path, _ in changes if status == 'D'}
+    _report(progress, files=len(changes))
+    with timer.stage('scan'):
+        _scan(git_dir, changed_files, clone, scan_workers, progress)
+
+    _report(progress, 'commits', commits=0)
+    with timer.stage('commits'):
+        new_commits, file_history = _collect_commits(git_dir, f"{base_head}..{head}", progress, clone['depth'],
+                                                     clone['since'], stats=not clone['partial'])
+
+    return changed_files, deleted_paths, new_commits, file_history
+
+def validate_package_options(incremental=True, listing='tree', depth=None, since=None, partial=False):
+    """Return an error message for an invalid combination of package options."""
+    if listing not in LISTING_MODES:
+        return f"Invalid listing mode: {listing}"
+    if depth is not None and (not isinstance(depth, int) or isinstance(depth, bool) or depth < 1):
+        return "depth must be a positive integer"
+    if since is not None:
+        try:
+            _parse_since(since)
+        except (TypeError, ValueError):
+            return "since must be an ISO 8601 date"
+    if depth and since:
+        return "depth and since cannot be combined"
+    if partial and listing == 'checkout':
+        return "checkout listing is not available for partial clones"
+    return None
+
+def base_snapshot(repo_url):
+    """Describe the snapshot an incremental package of ``repo_url`` can build on."""
+    previous = _previous_snapshot(repo_url)
+    if previous is None:
+        return None
+    return {'id': previous.id, 'head': previous.packaged_data['head'],
+            'clone': previous.packaged_data.get('clone', DEFAULT_CLONE)}
+
+def collect_repository(repo_url, base=None, progress=None, listing='tree', depth=None, since=None,
+                       partial=False, mirror_cache=None, scan_workers=1):
+    """Do the git side of packaging without touching the database.
+
+    Returns a picklable dict for :func:`store_repository`: either the full
+    file and commit lists, or, when ``base`` (see :func:`base_snapshot`)
+    was taken with the same clone mode and the new HEAD extends it, only
+    the changes since that snapshot; parsed dependency manifests and the
+    per-file :class:`FileHistory` of the collected commits either way.
+    Line statistics are counted with ``scan_workers`` processes.
+    Per-stage timings go in ``timings``.
+    Raises :class:`GitError` when the repository cannot be fetched.
+    """
+    timer = StageTimer()
+    repo_name = _repo_name(repo_url)
+    clone = {'depth': depth, 'since': since, 'partial': bool(partial)}
+
+    # Fetch into the persistent mirror (cloning it on first use)
+    _report(progress, 'cloning')
+    mirror_cache = mirror_cache or get_mirror_cache()
+    with timer.stage('clone'):
+        git_dir = mirror_cache.sync(repo_url, timeout=getattr(progress, 'remaining', None), **clone)
+        head = run_git(git_dir, 'rev-parse', 'HEAD').decode().strip()
+
+    collected = {'metadata': {'name': repo_name, 'url': repo_url, 'head': head, 'clone': clone}, 'git_dir': git_dir}
+
+    # Reuse the last snapshot when it was taken with the same clone mode and
+    # the new HEAD simply extends it; rewritten history falls back to a full
+    # package.
+    if base and base['clone'] == clone and _is_ancestor(git_dir, base['head'], head):
+        changed_files, deleted_paths, new_commits, file_history = _package_incremental(
+            git_dir, head, clone, base['head'], scan_workers, progress, timer)
+        collected['base_id'] = base['id']
+        collected['changes'] = {'changed_files': changed_files, 'deleted_paths': deleted_paths,
+                                'new_commits': new_commits, 'file_history': file_history,
+                                'manifests': _manifests(git_dir, changed_files, clone, progress, timer)}
+    else:
+        collected['files'], collected['commits'], collected['file_history'] = _package_full(
+            git_dir, head, clone, listing, scan_workers, progress, timer)
+        collected['manifests'] = _manifests(git_dir, collected['files'], clone, progress, timer)
+    with timer.stage('branches'):
+        collected['branches'] = _list_branches(git_dir)
+    collected['timings'] = dict(timer.stages, total=timer.elapsed)
+    return collected
+
+def store_repository(collected, progress=None):
+    """Save the output of :func:`collect_repository` and return the ``Repository``.
+
+    Stage timings of both halves are recorded as one ``package`` operation.
+    """
+    timer = StageTimer()
+    _report(progress, 'saving')
+    metadata = collected['metadata']
+    with timer.stage('save'):
+        if 'changes' in collected:
+            since = metadata['clone']['since']
+            repository = save_incremental_package(
+                metadata, db.session.get(Repository, collected['base_id']), branches=collected['branches'],
+                depth=metadata['clone']['depth'], since=_parse_since(since) if since else None,
+                **collected['changes'])
+        else:
+            repository = save_package(metadata, collected['files'], collected['commits'], collected['branches'],
+                                      collected['manifests'], collected['file_history'])
+
+    store = get_snapshot_store()
+    if store is not None:
+        _report(progress, 'snapshot')
+        with timer.stage('snapshot'):
+            store.build(repository)
+            store.remove_superseded(repository)
+
+    index = get_search_index()
+    if index is not None:
+        _report(progress, 'indexing')
+        with timer.stage('index'):
+            # Blobless mirrors would fetch every blob the index reads
+            index.update(repository, None if metadata['clone']['partial'] else collected['git_dir'])
+
+    blobs = get_blob_store()
+    if blobs is not None and not metadata['clone']['partial']:
+        _report(progress, 'blobs')
+        with timer.stage('blobs'):
+            blobs.add_snapshot(repository, collected['git_dir'])
 
-        # Collect branch information
-        for branch in repo.branches:
-            repo_data['branches'].append(str(branch))
+    metrics = get_metrics()
+    if metrics is not None:
+        stages = dict(collected.get('timings', {}))
+        total = stages.pop('total', 0.0) + timer.elapsed
+        stages.update(timer.stages)
+        metrics.record('package', stages, total)
+    return repository
 
-        # Save packaged data to the database
-        repository = Repository(name=repo_name, url=repo_url, packaged_data=repo_data)
-        db.session.add(repository)
-        db.session.commit()
+def package_repository(repo_url, progress=None, incremental=True, listing='tree',
+                       depth=None, since=None, partial=False):
+    error = validate_package_options(incremental, listing, depth, since, partial)
+    if error:
+        return None, error
 
-        return repository.id, None
+    base = base_snapshot(repo_url) if incremental else None
+    try:
+        collected = collect_repository(repo_url, base, progress, listing, depth, since, partial,
+                                       scan_workers=current_app.config['REPOLENS_SCAN_WORKERS'])
+    except GitError as e:
+        return None, f"Error cloning repository: {str(e)}"
 
-    # The temporary directory and its contents are automatically cleaned up here
+    repository = store_repository(collected, progress)
+    return repository.id, None
@@ -0,0 +1,693 @@
+import base64
+import binascii
+import itertools
+import json
+import os
+import re
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+from repolens.database import db, apply_sqlite_pragmas, set_sqlite_journal_mode, sqlite_pragmas_enabled
+from repolens.loc import CHUNK_SIZE, SNIFF_BYTES
+from repolens.mirror import get_mirror_cache
+from repolens.models import Repository
+from repolens.storage import iter_file_rows, latest_snapshot
+from repolens.utils import GitError, write_lines
+
+# Larger blobs are only searchable by path
+MAX_BLOB_BYTES = 1024 * 1024
+# New blob contents are written to the index in transactions of about this size
+BATCH_BYTES = 8 * 1024 * 1024
+# Trigrams intersected per query; beyond this they rarely narrow the candidates
+MAX_QUERY_GRAMS = 24
+# Matching lines reported per file, and the characters kept of each
+MAX_LINE_MATCHES = 5
+MAX_LINE_LENGTH = 300
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+POSTING_TABLES = ('blob_postings', 'path_postings')
+
+_BRACES = re.compile(r'\{(\d*)(,\d*)?\}')
+_GLOB_WILDCARDS = re.compile(r'\*|\?|\[[!^]?\]?[^\]]*\]')
+# Characters consumed by escapes that do not stand for themselves
+_ESCAPE_LENGTHS = {'x': 4, 'u': 6, 'U': 10}
+
+
+class SearchError(Exception):
+    pass
+
+
+def trigrams(data):
+    """Return the distinct trigrams of ``data`` (bytes) as sorted integers.
+
+    ASCII letters are folded to lower case, so one index serves case
+    sensitive and insensitive queries alike.
+    """
+    if len(data) < 3:
+        return np.empty(0, dtype=np.int64)
+    values = np.frombuffer(data.lower(), dtype=np.uint8).astype(np.int64)
+    return np.unique((values[:-2] << 16) | (values[1:-1] << 8) | values[2:])
+
+
+def _skip_class(pattern, i):
+    # ``i`` is at '['; a ']' right after the opening (or its '^') is literal
+    i += 1
+    if pattern[i:i + 1] == '^':
+        i += 1
+    if pattern[i:i + 1] == ']':
+        i += 1
+    while i < len(pattern) and pattern[i] != ']':
+        i += 2 if pattern[i] == '\\' else 1
+    return i + 1
+
+
+def _skip_group(pattern, i):
+    depth = 0
+    while i < len(pattern):
+        if pattern[i] == '\\':
+            i += 2
+            continue
+        if pattern[i] == '[':
+            i = _skip_class(pattern, i)
+            continue
+        if pattern[i] == '(':
+            depth += 1
+        elif pattern[i] == ')':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return i
+
+
+def _skip_escape(pattern, i):
+    kind = pattern[i + 1:i + 2]
+    if kind in _ESCAPE_LENGTHS:
+        return i + _ESCAPE_LENGTHS[kind]
+    if kind == 'N':
+        return pattern.index('}', i) + 1
+    if kind.isdigit():
+        i += 1
+        while i < len(pattern) and pattern[i].isdigit():
+            i += 1
+        return i
+    return i + 2
+
+
+def _quantifier(pattern, i):
+    """Return the minimum repeat count of a quantifier at ``i`` (1 if none) and where it ends."""
+    if pattern[i:i + 1] in ('*', '?', '+'):
+        low, end = (1 if pattern[i] == '+' else 0), i + 1
+    else:
+        match = _BRACES.match(pattern, i)
+        if not match or not (match.group(1) or match.group(2)):
+            return 1, i
+        low, end = int(match.group(1) or 0), match.end()
+    # Lazy and possessive forms
+    if pattern[end:end + 1] in ('?', '+'):
+        end += 1
+    return low, end
+
+
+def regex_literals(pattern):
+    """Return strings that every match of ``pattern`` must contain.
+
+    A conservative reading: only literal characters outside groups and
+    character classes count, characters a quantifier makes optional are
+    dropped, and a top-level ``|`` means nothing is certain.
+    """
+    literals, run = [], ''
+    i = 0
+    while i < len(pattern):
+        char, end = None, None
+        if pattern[i] == '|':
+            return []
+        if pattern[i] == '\\':
+            escaped = pattern[i + 1:i + 2]
+            if escaped and not escaped.isalnum():
+                char, end = escaped, i + 2
+            else:
+                end = _skip_escape(pattern, i)
+        elif pattern[i] == '[':
+            end = _skip_class(pattern, i)
+        elif pattern[i] == '(':
+            end = _skip_group(pattern, i)
+        elif pattern[i] in '.^$':
+            end = i + 1
+        else:
+            char, end = pattern[i], i + 1
+
+        low, i = _quantifier(pattern, end)
+        if char is None or low == 0:
+            # Anything after a non-literal atom or an optional character
+            # starts a new run
+            if run:
+                literals.append(run)
+            run = ''
+        elif i > end:
+            # A repeated character ends one run and starts the next
+            literals.append(run + char)
+            run = char
+        else:
+            run += char
+    if run:
+        literals.append(run)
+    return literals
+
+
+def glob_literals(pattern):
+    """Return the literal segments of an SQLite ``GLOB`` pattern."""
+    return [part for part in _GLOB_WILDCARDS.split(pattern) if part]
+
+
+def _query_grams(literals, ascii_only=False):
+    grams = []
+    for literal in literals:
+        for gram in trigrams(literal.encode('utf-8')).tolist():
+            # Outside ASCII, case-insensitive matching goes beyond the byte
+            # folding of the index
+            if not (ascii_only and gram & 0x808080):
+                grams.append(gram)
+    grams = list(dict.fromkeys(grams))
+    if len(grams) > MAX_QUERY_GRAMS:
+        # Overlapping neighbours say little more than each other
+        step = len(grams) / MAX_QUERY_GRAMS
+        grams = [grams[int(k * step)] for k in range(MAX_QUERY_GRAMS)]
+    return grams
+
+
+def _regex_grams(regex):
+    if regex.flags & re.VERBOSE:
+        return []
+    return _query_grams(regex_literals(regex.pattern), ascii_only=bool(regex.flags & re.IGNORECASE))
+
+
+def _matching_lines(regex, text):
+    lines = []
+    line_start, number = 0, 1
+    for match in regex.finditer(text):
+        number += text.count('\n', line_start, match.start())
+        start = text.rfind('\n', 0, match.start()) + 1
+        if lines and lines[-1]['line'] == number:
+            continue
+        end = text.find('\n', match.start())
+        lines.append({'line': number, 'text': text[start:end if end != -1 else len(text)][:MAX_LINE_LENGTH]})
+        line_start = start
+        if len(lines) == MAX_LINE_MATCHES:
+            break
+    return lines
+
+
+def _encode_cursor(url, path):
+    return base64.urlsafe_b64encode(json.dumps([url, path]).encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor):
+    try:
+        url, path = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        raise SearchError("Invalid cursor")
+    if not isinstance(url, str) or not isinstance(path, str):
+        raise SearchError("Invalid cursor")
+    return url, path
+
+
+def read_blobs(git_dir, shas, max_bytes=MAX_BLOB_BYTES, binary=False):
+    """Yield ``(sha, content)`` for blobs streamed from one ``git cat-file --batch``.
+
+    ``content`` is None for blobs over ``max_bytes``, which are skipped
+    without being held in memory, and unless ``binary`` is set for binary
+    blobs (a NUL in the first :data:`repolens.loc.SNIFF_BYTES`). Missing
+    blobs are left out.
+    """
+    errors = tempfile.TemporaryFile()
+    process = subprocess.Popen(['git', '--git-dir', git_dir, 'cat-file', '--batch'],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=errors)
+    writer = threading.Thread(target=write_lines, args=(process.stdin, shas), daemon=True)
+    writer.start()
+    try:
+        for sha in shas:
+            header = process.stdout.readline().split()
+            if len(header) == 2 and header[1] == b'missing':
+                continue
+            if len(header) != 3 or header[1] != b'blob':
+                raise GitError(f"Cannot read blob {sha}: {b' '.join(header).decode('ascii', 'replace')}")
+            remaining = int(header[2])
+            keep = remaining <= max_bytes
+            chunks = []
+            while remaining:
+                chunk = process.stdout.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise GitError(f"Unexpected end of output while reading blob {sha}")
+                remaining -= len(chunk)
+                if keep:
+                    chunks.append(chunk)
+            process.stdout.read(1)
+            content = b''.join(chunks) if keep else None
+            if content is not None and not binary and b'\0' in content[:SNIFF_BYTES]:
+                content = None
+            yield sha, content
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        writer.join()
+        process.stdout.close()
+        errors.close()
+
+
+def _posting_rows(grams, ids, segment):
+    """Group parallel gram and id arrays into ``(gram, segment, ids)`` rows.
+
+    Each row holds a gram's sorted ids as offsets from ``segment``, in the
+    narrowest unsigned width that fits the whole segment, behind a byte
+    giving that width.
+    """
+    if not len(grams):
+        return []
+    order = np.lexsort((ids, grams))
+    grams, offsets = grams[order], ids[order] - segment
+    width = next(w for w in (1, 2, 4, 8) if w == 8 or offsets.max() < 1 << (8 * w))
+    tag, data = bytes((width,)), offsets.astype(f'<u{width}').tobytes()
+    starts = np.flatnonzero(np.r_[True, grams[1:] != grams[:-1]])
+    ends = np.r_[starts[1:], len(grams)]
+    return [(gram, segment, tag + data[start * width:end * width])
+            for gram, start, end in zip(grams[starts].tolist(), starts.tolist(), ends.tolist())]
+
+
+def _decode_ids(data, segment):
+    return segment + np.frombuffer(data, dtype=f'<u{data[0]}', offset=1).astype(np.int64)
+
+
+def _document_rows(documents):
+    # A segment is keyed by the smallest id it holds, which no other write
+    # can produce
+    documents = [(doc_id, grams) for doc_id, grams in documents if len(grams)]
+    if not documents:
+        return []
+    grams = np.concatenate([grams for _, grams in documents])
+    ids = np.repeat([doc_id for doc_id, _ in documents], [len(grams) for _, grams in documents])
+    return _posting_rows(grams, ids, min(doc_id for doc_id, _ in documents))
+
+
+def _merge_postings(rows, live, chunk=4 * 1024 * 1024):
+    """Merge rows ordered by gram into segment 0, keeping only ``live`` ids.
+
+    Segment 0 lies below every id, so it never clashes with later writes.
+    Work is done about ``chunk`` postings at a time, on gram boundaries.
+    """
+    grams, counts, ids, size = [], [], [], 0
+    for gram, group in itertools.groupby(rows, key=lambda row: row[0]):
+        for _, segment, data in group:
+            decoded = _decode_ids(data, segment)
+            grams.append(gram)
+            counts.append(len(decoded))
+            ids.append(decoded)
+            size += len(decoded)
+        if size >= chunk:
+            yield from _live_rows(np.repeat(np.array(grams, dtype=np.int64), counts), ids, live)
+            grams, counts, ids, size = [], [], [], 0
+    yield from _live_rows(np.repeat(np.array(grams, dtype=np.int64), counts), ids, live)
+
+
+def _live_rows(grams, ids, live):
+    if not ids:
+        return []
+    ids = np.concatenate(ids)
+    keep = np.isin(ids, live)
+    return [(gram, data) for gram, _, data in _posting_rows(grams[keep], ids[keep], 0)]
+
+
+class SearchIndex:
+    """Trigram index over the latest snapshot of every packaged repository URL.
+
+    Lives in its own SQLite file. Text blobs are stored once, compressed,
+    however many snapshots share them; paths are interned. Each write adds
+    a segment holding, per trigram, the sorted ids of the blobs (or paths)
+    containing it, so a posting list is a handful of rows rather than one
+    row per occurrence. A query intersects the lists of the trigrams its
+    pattern must contain, then confirms the candidates with the real
+    regular expression or glob.
+
+    Forgotten blobs are dropped from the posting lists by :meth:`compact`;
+    until then they are simply not found in the ``files`` table.
+    """
+
+    def __init__(self, path, max_blob_bytes=MAX_BLOB_BYTES, pragmas=True):
+        self.path = path
+        self.max_blob_bytes = max_blob_bytes
+        self.pragmas = pragmas
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def _connect(self):
+        if not self._schema_ready:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if self.pragmas:
+            apply_sqlite_pragmas(conn)
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    if self.pragmas:
+                        set_sqlite_journal_mode(conn)
+                    self._create_schema(conn)
+                    self._schema_ready = True
+        return conn
+
+    def _create_schema(self, conn):
+        conn.execute('CREATE TABLE IF NOT EXISTS repositories (id INTEGER PRIMARY KEY, url TEXT NOT NULL UNIQUE, '
+                     'repository_id INTEGER NOT NULL, name TEXT NOT NULL, indexed_at REAL NOT NULL)')
+        # Ids are never reused, so stale postings cannot point at new rows
+        conn.execute('CREATE TABLE IF NOT EXISTS paths (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                     'path TEXT NOT NULL UNIQUE)')
+        # ``content`` is NULL for blobs indexed by path only
+        conn.execute('CREATE TABLE IF NOT EXISTS blobs (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                     'sha TEXT NOT NULL UNIQUE, content BLOB)')
+        # ``blob`` is NULL until the content of ``sha`` has been indexed
+        conn.execute('CREATE TABLE IF NOT EXISTS files (repo INTEGER NOT NULL, path INTEGER NOT NULL, sha TEXT, '
+                     'blob INTEGER, PRIMARY KEY (repo, path)) WITHOUT ROWID')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_files_blob ON files (blob)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_files_path ON files (path)')
+        for table in POSTING_TABLES:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {table} (gram INTEGER NOT NULL, segment INTEGER NOT NULL, '
+                         'ids BLOB NOT NULL, PRIMARY KEY (gram, segment)) WITHOUT ROWID')
+
+    @contextmanager
+    def _transaction(self, conn):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _add_postings(self, conn, table, documents):
+        conn.executemany(f'INSERT INTO {table} (gram, segment, ids) VALUES (?, ?, ?)', _document_rows(documents))
+
+    def _lookup(self, conn, table, grams):
+        """Return the ids whose posting lists hold every one of ``grams``."""
+        result = None
+        for gram in grams:
+            ids = [_decode_ids(data, segment) for segment, data in
+                   conn.execute(f'SELECT segment, ids FROM {table} WHERE gram = ?', (gram,))]
+            ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+            result = ids if result is None else np.intersect1d(result, ids, assume_unique=True)
+            if not len(result):
+                break
+        return result
+
+    def _blob_ids(self, conn, shas):
+        shas = sorted(shas)
+        ids = {}
+        for start in range(0, len(shas), 500):
+            chunk = shas[start:start + 500]
+            ids.update(conn.execute(f"SELECT sha, id FROM blobs WHERE sha IN ({','.join('?' * len(chunk))})",
+                                    chunk))
+        return ids
+
+    def _add_blobs(self, conn, git_dir, shas):
+        batch, size = [], 0
+        try:
+            for sha, content in read_blobs(git_dir, shas, self.max_blob_bytes):
+                batch.append((sha, content))
+                size += len(content or b'')
+                if size >= BATCH_BYTES:
+                    self._write_blobs(conn, batch)
+                    batch, size = [], 0
+        except GitError:
+            # Whatever could not be read stays searchable by path and is
+            # retried on the next update
+            pass
+        self._write_blobs(conn, batch)
+
+    def _write_blobs(self, conn, blobs):
+        with self._transaction(conn):
+            documents = []
+            for sha, content in blobs:
+                cursor = conn.execute('INSERT OR IGNORE INTO blobs (sha, content) VALUES (?, ?)',
+                                      (sha, zlib.compress(content) if content is not None else None))
+                if cursor.rowcount and content is not None:
+                    documents.append((cursor.lastrowid, trigrams(content)))
+            self._add_postings(conn, 'blob_postings', documents)
+
+    def _path_ids(self, conn, paths):
+        ids, documents = {}, []
+        for path in paths:
+            cursor = conn.execute('INSERT OR IGNORE INTO paths (path) VALUES (?)', (path,))
+            if cursor.rowcount:
+                ids[path] = cursor.lastrowid
+                documents.append((cursor.lastrowid, trigrams(path.encode('utf-8'))))
+            else:
+                ids[path] = conn.execute('SELECT id FROM paths WHERE path = ?', (path,)).fetchone()[0]
+        self._add_postings(conn, 'path_postings', documents)
+        return ids
+
+    def _prune(self, conn, blob_ids):
+        # Forget blobs no indexed file refers to any more
+        for blob_id in blob_ids:
+            if not conn.execute('SELECT 1 FROM files WHERE blob = ? LIMIT 1', (blob_id,)).fetchone():
+                conn.execute('DELETE FROM blobs WHERE id = ?', (blob_id,))
+
+    def update(self, repository, git_dir=None, replace=False):
+        """Index ``repository`` as the latest snapshot of its URL.
+
+        Only the files that changed since the URL was last indexed are
+        touched, and only blobs the index has never seen are read from
+        ``git_dir`` (the snapshot's mirror). Without it, files are
+        searchable by path only until a later update can read them.
+        Snapshots older than the one already indexed are ignored unless
+        ``replace`` is set. Returns whether the index changed.
+        """
+        files = {row['path']: row['blob'] for row in iter_file_rows(repository)}
+        conn = self._connect()
+        try:
+            current = conn.execute('SELECT id, repository_id FROM repositories WHERE url = ?',
+                                   (repository.url,)).fetchone()
+            if current and current[1] > repository.id and not replace:
+                return False
+            previous = {}
+            if current:
+                previous = {path: (sha, blob) for path, sha, blob in conn.execute(
+                    'SELECT p.path, f.sha, f.blob FROM files f JOIN paths p ON p.id = f.path WHERE f.repo = ?',
+                    (current[0],))}
+
+            # New paths, new blobs, and blobs that could not be read last time
+            changed = {path: sha for path, sha in files.items()
+                       if path not in previous or previous[path][0] != sha or (sha and previous[path][1] is None)}
+            removed = [path for path in previous if path not in files]
+            shas = {sha for sha in changed.values() if sha}
+            if git_dir and shas:
+                unseen = shas - self._blob_ids(conn, shas).keys()
+                if unseen:
+                    self._add_blobs(conn, git_dir, sorted(unseen))
+
+            with self._transaction(conn):
+                conn.execute('INSERT INTO repositories (url, repository_id, name, indexed_at) VALUES (?, ?, ?, ?) '
+                             'ON CONFLICT (url) DO UPDATE SET repository_id = excluded.repository_id, '
+                             'name = excluded.name, indexed_at = excluded.indexed_at',
+                             (repository.url, repository.id, repository.name, time.time()))
+                repo = conn.execute('SELECT id FROM repositories WHERE url = ?', (repository.url,)).fetchone()[0]
+                path_ids = self._path_ids(conn, [*changed, *removed])
+                # Resolved inside the transaction, so a blob pruned meanwhile
+                # is simply retried next time
+                blob_ids = self._blob_ids(conn, shas)
+                conn.executemany('DELETE FROM files WHERE repo = ? AND path = ?',
+                                 ((repo, path_ids[path]) for path in removed))
+                conn.executemany('INSERT OR REPLACE INTO files (repo, path, sha, blob) VALUES (?, ?, ?, ?)',
+                                 ((repo, path_ids[path], sha, blob_ids.get(sha)) for path, sha in changed.items()))
+                self._prune(conn, {previous[path][1] for path in [*changed, *removed]
+                                   if path in previous and previous[path][1] is not None})
+            return True
+        finally:
+            conn.close()
+
+    def forget(self, repository_id, repo_url, previous=None, git_dir=None):
+        """Stop serving a deleted snapshot of ``repo_url``.
+
+        If it is the one indexed, the URL is re-pointed at ``previous``
+        (its newest remaining snapshot, read from ``git_dir``) or, without
+        one, dropped with its files. Returns whether the index changed.
+        """
+        conn = self._connect()
+        try:
+            current = conn.execute('SELECT id, repository_id FROM repositories WHERE url = ?',
+                                   (repo_url,)).fetchone()
+            if not current or current[1] != repository_id:
+                return False
+            if previous is None:
+                with self._transaction(conn):
+                    blob_ids = {blob for blob, in conn.execute(
+                        'SELECT DISTINCT blob FROM files WHERE repo = ? AND blob IS NOT NULL', (current[0],))}
+                    conn.execute('DELETE FROM files WHERE repo = ?', (current[0],))
+                    conn.execute('DELETE FROM repositories WHERE id = ?', (current[0],))
+                    self._prune(conn, blob_ids)
+                return True
+        finally:
+            conn.close()
+        return self.update(previous, git_dir, replace=True)
+
+    def _candidates(self, conn, table, postings, grams):
+        conn.execute(f'CREATE TEMP TABLE {table} (id INTEGER PRIMARY KEY)')
+        conn.executemany(f'INSERT INTO {table} (id) VALUES (?)',
+                         ((doc_id,) for doc_id in self._lookup(conn, postings, grams).tolist()))
+
+    def compact(self):
+        """Merge every posting list into one segment, leaving out forgotten blobs and paths."""
+        conn = self._connect()
+        try:
+            with self._transaction(conn):
+                for table, documents in zip(POSTING_TABLES, ('blobs', 'paths')):
+                    live = np.array([row[0] for row in conn.execute(f'SELECT id FROM {documents} ORDER BY id')],
+                                    dtype=np.int64)
+                    conn.execute(f'ALTER TABLE {table} RENAME TO old_{table}')
+                    self._create_schema(conn)
+                    rows = conn.execute(f'SELECT gram, segment, ids FROM old_{table} ORDER BY gram')
+                    conn.executemany(f'INSERT INTO {table} (gram, segment, ids) VALUES (?, 0, ?)',
+                                     _merge_postings(rows, live))
+                    conn.execute(f'DROP TABLE old_{table}')
+        finally:
+            conn.close()
+        conn = self._connect()
+        try:
+            conn.execute('VACUUM')
+        finally:
+            conn.close()
+
+    def search(self, query=None, path=None, repo_url=None, limit=DEFAULT_LIMIT, cursor=None):
+        """Find indexed files by a regular expression over their content and/or a path glob.
+
+        ``path`` uses SQLite ``GLOB`` syntax over the whole path. Results are
+        ordered by repository URL and path, at most ``limit`` at a time;
+        pass the returned cursor back to continue after the last one.
+        Returns ``(results, next_cursor)``, the cursor being None at the end.
+        """
+        regex = None
+        if query:
+            try:
+                regex = re.compile(query)
+            except re.error as e:
+                raise SearchError(f"Invalid regular expression: {e}")
+        if regex is None and not path:
+            raise SearchError("Missing q or path")
+        after = _decode_cursor(cursor) if cursor else None
+
+        conn = self._connect()
+        try:
+            joins, clauses, params = [], [], []
+            if regex is not None:
+                grams = _regex_grams(regex)
+                if grams:
+                    self._candidates(conn, 'candidate_blobs', 'blob_postings', grams)
+                    joins.append('JOIN candidate_blobs cb ON cb.id = f.blob')
+                clauses.append('b.content IS NOT NULL')
+            if path:
+                grams = _query_grams(glob_literals(path))
+                if grams:
+                    self._candidates(conn, 'candidate_paths', 'path_postings', grams)
+                    joins.append('JOIN candidate_paths cp ON cp.id = f.path')
+                clauses.append('p.path GLOB ?')
+                params.append(path)
+            if repo_url:
+                clauses.append('r.url = ?')
+                params.append(repo_url)
+            if after:
+                clauses.append('(r.url, p.path) > (?, ?)')
+                params.extend(after)
+            rows = conn.execute(
+                f"SELECT r.url, r.name, r.repository_id, p.path, b.id FROM files f {' '.join(joins)} "
+                'JOIN repositories r ON r.id = f.repo JOIN paths p ON p.id = f.path '
+                'LEFT JOIN blobs b ON b.id = f.blob '
+                f"WHERE {' AND '.join(clauses)} ORDER BY r.url, p.path", params)
+
+            results, matches = [], {}
+            for url, name, repository_id, file_path, blob_id in rows:
+                result = {'repo_url': url, 'repository_id': repository_id, 'repository_name': name,
+                          'path': file_path}
+                if regex is not None:
+                    # Files often share content across repositories
+                    if blob_id not in matches:
+                        if len(matches) >= 256:
+                            matches.clear()
+                        content = conn.execute('SELECT content FROM blobs WHERE id = ?', (blob_id,)).fetchone()[0]
+                        matches[blob_id] = _matching_lines(regex, zlib.decompress(content).decode('utf-8',
+                                                                                                 'replace'))
+                    if not matches[blob_id]:
+                        continue
+                    result['matches'] = matches[blob_id]
+                results.append(result)
+                if len(results) == limit:
+                    return results, _encode_cursor(url, file_path)
+            return results, None
+        finally:
+            conn.close()
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            return {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                    for table in ('repositories', 'files', 'blobs', 'paths')}
+        finally:
+            conn.close()
+
+
+def mirror_path(repository):
+    """Return the mirror holding the repository's blobs, or None if they are not available."""
+    clone = (repository.packaged_data or {}).get('clone') or {}
+    if clone.get('partial'):
+        # Reading blobs would make git fetch each one
+        return None
+    git_dir = get_mirror_cache().path_for(repository.url, **clone)
+    return git_dir if os.path.isdir(git_dir) else None
+
+
+def get_search_index(app=None):
+    """Return the app's search index, or None when search is disabled."""
+    app = app or current_app
+    return app.extensions['repolens_search']
+
+
+@click.command('search-index')
+@click.argument('repo_urls', nargs=-1)
+@click.option('--compact', is_flag=True, help='Merge the posting lists afterwards.')
+@with_appcontext
+def search_index_command(repo_urls, compact):
+    """Index the latest snapshot of each repository URL (every packaged URL by default)."""
+    index = get_search_index()
+    if index is None:
+        raise click.UsageError('Search is disabled (REPOLENS_SEARCH_DB is not set)')
+    repo_urls = repo_urls or db.session.scalars(select(Repository.url).distinct().order_by(Repository.url)).all()
+    for repo_url in repo_urls:
+        repository = latest_snapshot(repo_url)
+        if repository is None:
+            click.echo(f'{repo_url}: not packaged', err=True)
+            continue
+        index.update(repository, mirror_path(repository))
+        click.echo(f'{repo_url}: indexed snapshot {repository.id}')
+    if compact:
+        index.compact()
+    click.echo(json.dumps(index.stats()))
+
+
+def init_app(app):
+    app.config.setdefault('REPOLENS_SEARCH_DB', os.environ.get(
+        'REPOLENS_SEARCH_DB', os.path.join(os.path.expanduser('~'), '.cache', 'repolens', 'search.db')))
+    app.config.setdefault('REPOLENS_SEARCH_MAX_BLOB_BYTES', int(os.environ.get(
+        'REPOLENS_SEARCH_MAX_BLOB_BYTES', MAX_BLOB_BYTES)))
+    index = None
+    if app.config['REPOLENS_SEARCH_DB']:
+        index = SearchIndex(app.config['REPOLENS_SEARCH_DB'], app.config['REPOLENS_SEARCH_MAX_BLOB_BYTES'],
+                            sqlite_pragmas_enabled(app))
+    app.extensions['repolens_search'] = index
+    app.cli.add_command(search_index_command)
@@ -0,0 +1,455 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import zlib
+from array import array
+from datetime import datetime, timedelta, timezone
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, func
+from repolens.models import Repository, db
+from repolens.storage import iter_file_rows, iter_commit_rows, list_branches, COMMIT_STATS
+from repolens.utils import get_file_extension
+
+MAGIC = b'RLSNAP\x00\x01'
+VERSION = 2
+# Columns start on 8-byte boundaries so numeric ones can be cast in place
+ALIGNMENT = 8
+# Stands in for None in numeric columns
+MISSING = -1
+MISSING_DATE = -(2 ** 63)
+
+FILE_STATS = ('lines', 'code_lines', 'comment_lines', 'blank_lines')
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+for _typecode, _size in (('b', 1), ('i', 4), ('q', 8)):
+    if array(_typecode).itemsize != _size:
+        raise ImportError(f"array typecode {_typecode!r} is not {_size} bytes on this platform")
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class _Interner:
+    def __init__(self):
+        self.index = {}
+
+    def __call__(self, value):
+        if value is None:
+            return MISSING
+        return self.index.setdefault(value, len(self.index))
+
+    def values(self):
+        return list(self.index)
+
+
+class _Strings:
+    """Accumulates a string column as one byte heap plus end offsets."""
+
+    def __init__(self):
+        self.data = []
+        self.ends = array('q', [0])
+
+    def append(self, value):
+        encoded = value.encode('utf-8', 'surrogateescape')
+        self.data.append(encoded)
+        self.ends.append(self.ends[-1] + len(encoded))
+
+
+def _epoch_micros(date):
+    if date is None:
+        return MISSING_DATE, 0
+    parsed = datetime.fromisoformat(date)
+    offset = parsed.utcoffset() or timedelta(0)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    delta = parsed - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds, int(offset.total_seconds() // 60)
+
+
+def write_snapshot(path, metadata, files, commits, branches, compress=True):
+    """Write a columnar snapshot to ``path``.
+
+    ``files`` are dicts with a ``path`` and optional ``size`` and line
+    statistics (see :func:`repolens.storage.iter_file_rows`), ``commits``
+    are package commit dicts, optionally with line statistics (see
+    :func:`repolens.storage.iter_commit_rows`), and ``branches`` are names;
+    all may be iterators.
+    Paths are split into interned directories and names, and authors,
+    extensions and languages are interned. With ``compress`` set, each
+    column is zlib compressed when that saves at least a quarter of its
+    size; the rest are stored raw so readers use them straight from the
+    memory mapping.
+    """
+    dirs, exts, languages, authors = _Interner(), _Interner(), _Interner(), _Interner()
+    columns = {
+        'file.dir': array('i'), 'file.ext': array('i'), 'file.size': array('q'), 'file.language': array('i'),
+        'file.binary': array('b'), **{f'file.{stat}': array('q') for stat in FILE_STATS},
+        'commit.author': array('i'), 'commit.date': array('q'), 'commit.offset': array('i'),
+        **{f'commit.{stat}': array('q') for stat in COMMIT_STATS},
+    }
+    strings = {name: _Strings() for name in ('file.name', 'file.blob', 'commit.hash', 'commit.message',
+                                             'branch.name')}
+
+    counts = {'files': 0, 'commits': 0, 'branches': 0}
+    for file in files:
+        directory, _, name = file['path'].rpartition('/')
+        columns['file.dir'].append(dirs(directory))
+        strings['file.name'].append(name)
+        strings['file.blob'].append(file.get('blob') or '')
+        columns['file.ext'].append(exts(get_file_extension(file['path'])))
+        size = file.get('size')
+        columns['file.size'].append(MISSING if size is None else size)
+        columns['file.language'].append(languages(file.get('language')))
+        binary = file.get('binary')
+        columns['file.binary'].append(MISSING if binary is None else int(binary))
+        for stat in FILE_STATS:
+            value = file.get(stat)
+            columns[f'file.{stat}'].append(MISSING if value is None else value)
+        counts['files'] += 1
+    for commit in commits:
+        strings['commit.hash'].append(commit.get('hash') or '')
+        columns['commit.author'].append(authors(commit.get('author')))
+        strings['commit.message'].append(commit.get('message') or '')
+        date, offset = _epoch_micros(commit.get('date'))
+        columns['commit.date'].append(date)
+        columns['commit.offset'].append(offset)
+        for stat in COMMIT_STATS:
+            value = commit.get(stat)
+            columns[f'commit.{stat}'].append(MISSING if value is None else value)
+        counts['commits'] += 1
+    for branch in branches:
+        strings['branch.name'].append(branch)
+        counts['branches'] += 1
+    for name, interner in (('dirs', dirs), ('exts', exts), ('languages', languages), ('authors', authors)):
+        table = strings[f'table.{name}'] = _Strings()
+        for value in interner.values():
+            table.append(value)
+
+    blocks = []
+    for name, values in columns.items():
+        blocks.append((name, values.typecode, *_encode(_little_endian(values), compress)))
+    for name, table in strings.items():
+        blocks.append((f'{name}.ends', 'q', *_encode(_little_endian(table.ends), compress)))
+        blocks.append((f'{name}.data', 'B', *_encode(b''.join(table.data), compress)))
+
+    # Column offsets are relative to the aligned end of the header
+    directory = {}
+    offset = 0
+    for name, typecode, codec, data in blocks:
+        directory[name] = {'type': typecode, 'codec': codec, 'offset': offset, 'length': len(data)}
+        offset = _align(offset + len(data))
+    header = json.dumps({'version': VERSION, 'metadata': metadata, 'counts': counts,
+                         'columns': directory}).encode('utf-8')
+    start = _align(len(MAGIC) + 4 + len(header))
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        for name, _, _, data in blocks:
+            f.write(b'\0' * (start + directory[name]['offset'] - f.tell()))
+            f.write(data)
+    return counts
+
+
+def _encode(data, compress):
+    if compress:
+        compressed = zlib.compress(data)
+        if len(compressed) <= len(data) * 3 // 4:
+            return 'zlib', compressed
+    return 'raw', data
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class StringColumn:
+    """Sequence view of a string column inside a :class:`Snapshot`."""
+
+    def __init__(self, ends, data):
+        self.ends = ends
+        self.data = data
+
+    def __len__(self):
+        return len(self.ends) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        return bytes(self.data[self.ends[index]:self.ends[index + 1]]).decode('utf-8', 'surrogateescape')
+
+    def __iter__(self):
+        data = self.data
+        ends = self.ends
+        for i in range(len(ends) - 1):
+            yield bytes(data[ends[i]:ends[i + 1]]).decode('utf-8', 'surrogateescape')
+
+
+class Snapshot:
+    """Read-only, memory-mapped view of a snapshot file.
+
+    Raw columns are ``memoryview`` objects over the mapping, so they cost
+    no memory until touched; compressed columns are inflated on first
+    use. Use as a context manager, or call :meth:`close`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._cache = {}
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise SnapshotError(f"Empty snapshot file: {path}")
+        self._view = memoryview(self._map)
+        if bytes(self._view[:len(MAGIC)]) != MAGIC:
+            self.close()
+            raise SnapshotError(f"Not a snapshot file: {path}")
+        (header_size,) = struct.unpack_from('<I', self._map, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(bytes(self._view[start:start + header_size]))
+        self._start = _align(start + header_size)
+        if header['version'] != VERSION:
+            self.close()
+            raise SnapshotError(f"Unsupported snapshot version: {header['version']}")
+        self.metadata = header['metadata']
+        self.counts = header['counts']
+        self._directory = header['columns']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._cache.clear()
+        if self._map is not None:
+            try:
+                self._view.release()
+                self._map.close()
+            except BufferError:
+                # Columns still referenced by the caller keep the mapping
+                # alive; it is unmapped once they are garbage collected.
+                pass
+            self._map = None
+        self._file.close()
+
+    def column(self, name):
+        """Return a numeric column (``file.size``, ``commit.date``, ...) as a memoryview."""
+        if name not in self._cache:
+            entry = self._directory[name]
+            offset = self._start + entry['offset']
+            data = self._view[offset:offset + entry['length']]
+            if entry['codec'] == 'zlib':
+                data = memoryview(zlib.decompress(data))
+            if entry['type'] != 'B' and sys.byteorder == 'big':
+                values = array(entry['type'], data)
+                values.byteswap()
+                data = memoryview(values).cast('B')
+            self._cache[name] = data.cast(entry['type'])
+        return self._cache[name]
+
+    def strings(self, name):
+        """Return a string column or table (``file.name``, ``table.authors``, ...)."""
+        key = ('strings', name)
+        if key not in self._cache:
+            self._cache[key] = StringColumn(self.column(f'{name}.ends'), self.column(f'{name}.data'))
+        return self._cache[key]
+
+    def paths(self):
+        dirs = list(self.strings('table.dirs'))
+        for directory, name in zip(self.column('file.dir'), self.strings('file.name')):
+            yield f'{dirs[directory]}/{name}' if dirs[directory] else name
+
+    def iter_files(self):
+        """Yield ``{'path', 'size'}`` dicts, like :func:`repolens.storage.iter_files`."""
+        for path, size in zip(self.paths(), self.column('file.size')):
+            yield {'path': path, 'size': None if size == MISSING else size}
+
+    def iter_file_rows(self):
+        """Yield file dicts shaped like :func:`repolens.storage.iter_file_rows`."""
+        exts = list(self.strings('table.exts'))
+        languages = list(self.strings('table.languages'))
+        stats = [self.column(f'file.{stat}') for stat in FILE_STATS]
+        columns = zip(self.paths(), self.column('file.ext'), self.column('file.size'), self.strings('file.blob'),
+                      self.column('file.language'), self.column('file.binary'), *stats)
+        for path, ext, size, blob, language, binary, *values in columns:
+            row = {'path': path, 'extension': exts[ext], 'size': None if size == MISSING else size,
+                   'blob': blob or None, 'language': None if language == MISSING else languages[language],
+                   'binary': None if binary == MISSING else bool(binary)}
+            for stat, value in zip(FILE_STATS, values):
+                row[stat] = None if value == MISSING else value
+            yield row
+
+    def iter_commits(self):
+        """Yield commit dicts, newest first, like :func:`repolens.storage.iter_commits`."""
+        for commit in self.iter_commit_rows():
+            for stat in COMMIT_STATS:
+                del commit[stat]
+            yield commit
+
+    def iter_commit_rows(self):
+        """Yield commit dicts shaped like :func:`repolens.storage.iter_commit_rows`."""
+        authors = list(self.strings('table.authors'))
+        stats = [self.column(f'commit.{stat}') for stat in COMMIT_STATS]
+        columns = zip(self.strings('commit.hash'), self.column('commit.author'), self.strings('commit.message'),
+                      self.column('commit.date'), self.column('commit.offset'), *stats)
+        for hexsha, author, message, date, offset, *values in columns:
+            if date == MISSING_DATE:
+                date = None
+            else:
+                tz = timezone(timedelta(minutes=offset))
+                date = (_EPOCH + timedelta(microseconds=date)).astimezone(tz).isoformat()
+            commit = {'hash': hexsha, 'author': None if author == MISSING else authors[author],
+                      'message': message, 'date': date}
+            for stat, value in zip(COMMIT_STATS, values):
+                commit[stat] = None if value == MISSING else value
+            yield commit
+
+    def branches(self):
+        return list(self.strings('branch.name'))
+
+    def to_package(self):
+        """Return the snapshot in the single-document package shape."""
+        package = dict(self.metadata)
+        package['files'] = list(self.iter_files())
+        package['commits'] = list(self.iter_commits())
+        package['branches'] = self.branches()
+        return package
+
+
+def package_to_snapshot(package, path, compress=True):
+    """Convert a package in the JSON shape into a snapshot file."""
+    metadata = {k: v for k, v in package.items() if k not in ('files', 'commits', 'branches')}
+    return write_snapshot(path, metadata, package.get('files', []), package.get('commits', []),
+                          package.get('branches', []), compress)
+
+
+class SnapshotStore:
+    """Directory of snapshot files, one per packaged repository.
+
+    File names are derived from the repository row's identity and
+    content, so a database that reuses row ids never picks up a stale
+    snapshot. Files are written to a temporary name and renamed, so
+    concurrent builders of the same snapshot are harmless.
+    """
+
+    def __init__(self, root, compress=True):
+        self.root = root
+        self.compress = compress
+
+    def path_for(self, repository):
+        metadata = repository.packaged_data or {}
+        created = repository.created_at.isoformat() if repository.created_at else ''
+        key = json.dumps([VERSION, repository.id, repository.url, metadata.get('head'), metadata.get('clone'), created])
+        return os.path.join(self.root, f'{repository.id}-{hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]}.rls')
+
+    def build(self, repository):
+        """Write the repository's snapshot from the database and return its path."""
+        path = self.path_for(repository)
+        os.makedirs(self.root, exist_ok=True)
+        metadata = {k: v for k, v in (repository.packaged_data or {}).items()
+                    if k not in ('files', 'commits', 'branches')}
+        metadata.setdefault('name', repository.name)
+        metadata.setdefault('url', repository.url)
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        os.close(fd)
+        try:
+            write_snapshot(temp_path, metadata, iter_file_rows(repository), iter_commit_rows(repository),
+                           list_branches(repository), self.compress)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return path
+
+    def open(self, repository, build=True):
+        """Open the repository's snapshot, building it first if needed.
+
+        Returns None when the snapshot does not exist and ``build`` is false.
+        """
+        path = self.path_for(repository)
+        if not os.path.exists(path):
+            if not build:
+                return None
+            self.build(repository)
+        return Snapshot(path)
+
+    def remove(self, repository):
+        try:
+            os.unlink(self.path_for(repository))
+        except FileNotFoundError:
+            pass
+
+    def _remove_files(self, doomed):
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return 0
+        removed = 0
+        for name in names:
+            if name.endswith('.rls') and doomed(name):
+                try:
+                    os.unlink(os.path.join(self.root, name))
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def remove_superseded(self, repository):
+        """Delete the files of older snapshots of the repository's URL.
+
+        They are rebuilt on demand if an older snapshot is analyzed again.
+        """
+        older = {str(i) for i in db.session.scalars(select(Repository.id).where(
+            Repository.url == repository.url, Repository.id < repository.id))}
+        return self._remove_files(lambda name: name.split('-', 1)[0] in older)
+
+    def prune(self):
+        """Delete every file but the current one of each URL's latest snapshot; return how many."""
+        latest = Repository.query.filter(Repository.id.in_(select(func.max(Repository.id)).group_by(Repository.url)))
+        keep = {os.path.basename(self.path_for(repository)) for repository in latest}
+        return self._remove_files(lambda name: name not in keep)
+
+
+def get_snapshot_store(app=None):
+    """Return the app's snapshot store, or None when snapshots are disabled."""
+    app = app or current_app
+    return app.extensions.get('repolens_snapshots')
+
+
+@click.command('snapshots-prune')
+@with_appcontext
+def snapshots_prune_command():
+    """Delete snapshot files of superseded and deleted snapshots."""
+    store = get_snapshot_store()
+    if store is None:
+        raise click.UsageError('The snapshot store is disabled (REPOLENS_SNAPSHOT_DIR is not set)')
+    click.echo(f'Removed {store.prune()} snapshot files')
+
+
+def init_app(app):
+    app.config.setdefault('REPOLENS_SNAPSHOT_DIR', os.environ.get(
+        'REPOLENS_SNAPSHOT_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'repolens', 'snapshots')))
+    if app.config['REPOLENS_SNAPSHOT_DIR']:
+        app.extensions['repolens_snapshots'] = SnapshotStore(app.config['REPOLENS_SNAPSHOT_DIR'])
+    else:
+        app.extensions.pop('repolens_snapshots', None)
+    app.cli.add_command(snapshots_prune_command)
@@ -0,0 +1,403 @@
+import io
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import insert, select, delete, func, literal
+from repolens.models import (Repository, RepositoryFile, RepositoryCommit, RepositoryBranch, RepositoryDependency,
+                             RepositoryPackage, RepositoryFileHistory, Analysis)
+from repolens.database import db
+from repolens.utils import get_file_extension
+
+# Rows per INSERT statement when bulk-writing files and commits
+BATCH_SIZE = 5000
+
+# Per-snapshot file and commit columns, copied as is between incremental
+# snapshots
+FILE_COLUMNS = ('path', 'extension', 'size', 'blob', 'language', 'binary', 'lines', 'code_lines',
+                'comment_lines', 'blank_lines')
+COMMIT_COLUMNS = ('hash', 'author', 'message', 'date', 'utc_offset', 'insertions', 'deletions', 'files_changed')
+COMMIT_STATS = ('insertions', 'deletions', 'files_changed')
+DEPENDENCY_COLUMNS = ('manifest', 'ecosystem', 'name', 'spec', 'kind')
+PACKAGE_COLUMNS = ('manifest', 'ecosystem', 'name')
+FILE_HISTORY_COLUMNS = ('path', 'author', 'commits', 'insertions', 'deletions', 'last_modified')
+
+
+def is_normalized(repository):
+    """Whether the repository's files and commits live in their own tables.
+
+    Repositories packaged before normalized storage keep everything inside
+    ``packaged_data``; those are still readable through this module.
+    """
+    return 'files' not in (repository.packaged_data or {})
+
+
+def _file_row(repository_id, file):
+    return {
+        'repository_id': repository_id,
+        'path': file['path'],
+        'extension': get_file_extension(file['path']),
+        'size': file['size'],
+        'blob': file.get('blob'),
+        'language': file.get('language'),
+        'binary': file.get('binary'),
+        'lines': file.get('lines'),
+        'code_lines': file.get('code_lines'),
+        'comment_lines': file.get('comment_lines'),
+        'blank_lines': file.get('blank_lines'),
+    }
+
+
+def _commit_row(repository_id, position, commit):
+    date = datetime.fromisoformat(commit['date'])
+    offset = date.utcoffset() or timedelta(0)
+    return {
+        'repository_id': repository_id,
+        'position': position,
+        'hash': commit['hash'],
+        'author': commit['author'],
+        'message': commit['message'],
+        'date': (date - offset).replace(tzinfo=None),
+        'utc_offset': int(offset.total_seconds() // 60),
+        'insertions': commit.get('insertions'),
+        'deletions': commit.get('deletions'),
+        'files_changed': commit.get('files_changed'),
+    }
+
+
+def _commit_date(date, utc_offset):
+    tz = timezone(timedelta(minutes=utc_offset))
+    return date.replace(tzinfo=timezone.utc).astimezone(tz).isoformat()
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_payload(columns, rows):
+    """Render ``rows`` in the text format of PostgreSQL's ``COPY ... FROM STDIN``."""
+    return ''.join('\t'.join(_copy_value(row[column]) for column in columns) + '\n' for row in rows)
+
+
+def _insert_batch(model, batch):
+    db.session.execute(insert(model), batch)
+
+
+def _copy_batch(model, batch):
+    columns = list(batch[0])
+    preparer = db.session.get_bind().dialect.identifier_preparer
+    statement = (f"COPY {preparer.format_table(model.__table__)} "
+                 f"({', '.join(preparer.quote(column) for column in columns)}) FROM STDIN")
+    # The session's own connection, so the rows join its transaction
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(statement, io.StringIO(copy_payload(columns, batch)))
+    finally:
+        cursor.close()
+
+
+def _bulk_insert(model, rows):
+    """Insert ``rows`` in batches of :data:`BATCH_SIZE`.
+
+    PostgreSQL through psycopg2 streams each batch with ``COPY``; other
+    backends get one multi-row ``executemany`` per batch. Either way only
+    one batch is held in memory at a time.
+    """
+    dialect = db.session.get_bind().dialect
+    write = _copy_batch if (dialect.name, dialect.driver) == ('postgresql', 'psycopg2') else _insert_batch
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            write(model, batch)
+            batch = []
+    if batch:
+        write(model, batch)
+
+
+def _create_repository(metadata):
+    repository = Repository(name=metadata['name'], url=metadata['url'], packaged_data=metadata)
+    db.session.add(repository)
+    db.session.flush()
+    return repository
+
+
+def _insert_branches(repository_id, branches):
+    _bulk_insert(RepositoryBranch, ({'repository_id': repository_id, 'name': name} for name in branches))
+
+
+def _insert_manifests(repository_id, manifests):
+    _bulk_insert(RepositoryPackage, ({'repository_id': repository_id, 'manifest': m['path'],
+                                      'ecosystem': m['ecosystem'], 'name': m['package']}
+                                     for m in manifests if m['package']))
+    _bulk_insert(RepositoryDependency, ({'repository_id': repository_id, 'manifest': m['path'],
+                                         'ecosystem': m['ecosystem'], **dependency}
+                                        for m in manifests for dependency in m['dependencies']))
+
+
+def _merge_file_history(repository_id, file_history, deleted_paths):
+    # Fold the new commits into the rows copied from the base snapshot, a
+    # chunk of paths at a time; deleted files lose their history.
+    added = defaultdict(list)
+    for row in file_history.rows():
+        added[row['path']].append(row)
+    touched = sorted(deleted_paths | set(added))
+    columns = [getattr(RepositoryFileHistory, column) for column in FILE_HISTORY_COLUMNS]
+    for start in range(0, len(touched), 500):
+        chunk = touched[start:start + 500]
+        present = set(db.session.scalars(select(RepositoryFile.path).where(
+            RepositoryFile.repository_id == repository_id, RepositoryFile.path.in_(chunk))))
+        copied = [dict(zip(FILE_HISTORY_COLUMNS, row)) for row in db.session.execute(select(*columns).where(
+            RepositoryFileHistory.repository_id == repository_id, RepositoryFileHistory.path.in_(chunk)))]
+        merged = {}
+        for row in copied + [row for path in chunk for row in added.get(path, ())]:
+            if row['path'] not in present:
+                continue
+            key = (row['path'], row['author'])
+            if key not in merged:
+                merged[key] = dict(row, repository_id=repository_id)
+                continue
+            total = merged[key]
+            for column in ('commits', 'insertions', 'deletions'):
+                total[column] += row[column]
+            total['last_modified'] = max(total['last_modified'], row['last_modified'])
+        db.session.execute(delete(RepositoryFileHistory).where(
+            RepositoryFileHistory.repository_id == repository_id, RepositoryFileHistory.path.in_(chunk)))
+        _bulk_insert(RepositoryFileHistory, merged.values())
+
+
+def save_package(metadata, files, commits, branches, manifests=(), file_history=None):
+    """Store a fully packaged repository and return the new ``Repository``.
+
+    ``manifests`` are :func:`repolens.dependencies.parse_manifest` results
+    and ``file_history`` a :class:`repolens.history.FileHistory` of the
+    commits, or None when line statistics were not collected.
+    """
+    repository = _create_repository(metadata)
+    _bulk_insert(RepositoryFile, (_file_row(repository.id, f) for f in files))
+    _bulk_insert(RepositoryCommit, (_commit_row(repository.id, i, c) for i, c in enumerate(commits)))
+    _insert_branches(repository.id, branches)
+    _insert_manifests(repository.id, manifests)
+    if file_history is not None:
+        # Only files still in the tree keep their history
+        paths = {f['path'] for f in files}
+        _bulk_insert(RepositoryFileHistory, (dict(row, repository_id=repository.id)
+                                             for row in file_history.rows() if row['path'] in paths))
+    db.session.commit()
+    return repository
+
+
+def save_incremental_package(metadata, base, changed_files, deleted_paths, new_commits, branches,
+                             depth=None, since=None, manifests=(), file_history=None):
+    """Store a snapshot derived from ``base`` plus the changes since it.
+
+    Unchanged file rows and older commits are copied inside the database
+    with ``INSERT ... SELECT``, so only the delta passes through Python.
+    File history rows are copied too, then the paths the new commits
+    touched are merged; history is not trimmed to ``depth`` or ``since``.
+    """
+    repository = _create_repository(metadata)
+
+    db.session.execute(insert(RepositoryFile).from_select(
+        ['repository_id', *FILE_COLUMNS],
+        select(literal(repository.id), *(getattr(RepositoryFile, column) for column in FILE_COLUMNS))
+        .where(RepositoryFile.repository_id == base.id)))
+    for model, columns in ((RepositoryDependency, DEPENDENCY_COLUMNS), (RepositoryPackage, PACKAGE_COLUMNS),
+                           (RepositoryFileHistory, FILE_HISTORY_COLUMNS)):
+        db.session.execute(insert(model).from_select(
+            ['repository_id', *columns],
+            select(literal(repository.id), *(getattr(model, column) for column in columns))
+            .where(model.repository_id == base.id)))
+    # Drop the copied rows that changed, in chunks that stay well within the
+    # bound-parameter limits of every backend. ``manifests`` holds the
+    # changed manifests, parsed afresh.
+    replaced = sorted(deleted_paths | {f['path'] for f in changed_files})
+    for start in range(0, len(replaced), 500):
+        for column in (RepositoryFile.path, RepositoryDependency.manifest, RepositoryPackage.manifest):
+            model = column.class_
+            db.session.execute(delete(model).where(
+                model.repository_id == repository.id, column.in_(replaced[start:start + 500])))
+    _bulk_insert(RepositoryFile, (_file_row(repository.id, f) for f in changed_files))
+    _insert_manifests(repository.id, manifests)
+    if file_history is not None:
+        _merge_file_history(repository.id, file_history, deleted_paths)
+
+    shift = len(new_commits)
+    _bulk_insert(RepositoryCommit, (_commit_row(repository.id, i, c) for i, c in enumerate(new_commits)))
+    kept_commits = select(
+        literal(repository.id), RepositoryCommit.position + shift,
+        *(getattr(RepositoryCommit, column) for column in COMMIT_COLUMNS)
+    ).where(RepositoryCommit.repository_id == base.id)
+    if depth:
+        kept_commits = kept_commits.where(RepositoryCommit.position < depth - shift)
+    if since:
+        cutoff = since.astimezone(timezone.utc).replace(tzinfo=None)
+        kept_commits = kept_commits.where(RepositoryCommit.date >= cutoff)
+    db.session.execute(insert(RepositoryCommit).from_select(
+        ['repository_id', 'position', *COMMIT_COLUMNS], kept_commits))
+
+    _insert_branches(repository.id, branches)
+    db.session.commit()
+    return repository
+
+
+def delete_package(repository):
+    """Delete a snapshot with its files, commits, branches, dependencies, file history and analyses."""
+    for model in (Analysis, RepositoryFile, RepositoryCommit, RepositoryBranch, RepositoryDependency,
+                  RepositoryPackage, RepositoryFileHistory):
+        db.session.execute(delete(model).where(model.repository_id == repository.id))
+    db.session.execute(delete(Repository).where(Repository.id == repository.id))
+    db.session.commit()
+
+
+def iter_files(repository, batch_size=1000):
+    """Yield ``{'path', 'size'}`` dicts for the repository, ordered by path."""
+    if not is_normalized(repository):
+        yield from repository.packaged_data.get('files', [])
+        return
+    query = (select(RepositoryFile.path, RepositoryFile.size)
+             .where(RepositoryFile.repository_id == repository.id)
+             .order_by(RepositoryFile.path)
+             .execution_options(yield_per=batch_size))
+    for path, size in db.session.execute(query):
+        yield {'path': path, 'size': size}
+
+
+# Collations that order text by code point, as SQLite does by default;
+# PostgreSQL otherwise sorts by the locale of the database.
+_CODE_POINT_COLLATIONS = {'postgresql': 'C'}
+
+
+def _by_code_point(column, dialect_name):
+    """Order ``column`` by code point rather than by the database's default collation."""
+    collation = _CODE_POINT_COLLATIONS.get(dialect_name)
+    return column.collate(collation) if collation else column
+
+
+def iter_file_rows(repository, batch_size=1000):
+    """Yield every stored column of the repository's files, ordered by path.
+
+    Normalized rows come in code point order on every backend, which the
+    merge in :mod:`repolens.compare` and the snapshot files rely on.
+
+    Files of repositories packaged before normalized storage only have a
+    path and size; their other columns are derived or None.
+    """
+    if not is_normalized(repository):
+        for file in repository.packaged_data.get('files', []):
+            row = dict.fromkeys(FILE_COLUMNS)
+            row.update(path=file['path'], extension=get_file_extension(file['path']), size=file.get('size'))
+            yield row
+        return
+    query = (select(*(getattr(RepositoryFile, column) for column in FILE_COLUMNS))
+             .where(RepositoryFile.repository_id == repository.id)
+             .order_by(_by_code_point(RepositoryFile.path, db.session.get_bind().dialect.name))
+             .execution_options(yield_per=batch_size))
+    for row in db.session.execute(query):
+        yield dict(zip(FILE_COLUMNS, row))
+
+
+def iter_commits(repository, batch_size=1000):
+    """Yield commit dicts for the repository, newest first."""
+    if not is_normalized(repository):
+        yield from repository.packaged_data.get('commits', [])
+        return
+    query = (select(RepositoryCommit.hash, RepositoryCommit.author, RepositoryCommit.message,
+                    RepositoryCommit.date, RepositoryCommit.utc_offset)
+             .where(RepositoryCommit.repository_id == repository.id)
+             .order_by(RepositoryCommit.position)
+             .execution_options(yield_per=batch_size))
+    for hexsha, author, message, date, utc_offset in db.session.execute(query):
+        yield {'hash': hexsha, 'author': author, 'message': message, 'date': _commit_date(date, utc_offset)}
+
+
+def iter_commit_rows(repository, batch_size=1000):
+    """Yield commit dicts with line statistics, newest first.
+
+    Like :func:`iter_commits` plus ``insertions``, ``deletions`` and
+    ``files_changed``, which are None when they were not collected.
+    """
+    if not is_normalized(repository):
+        for commit in repository.packaged_data.get('commits', []):
+            yield dict(dict.fromkeys(COMMIT_STATS), **commit)
+        return
+    query = (select(*(getattr(RepositoryCommit, column) for column in COMMIT_COLUMNS))
+             .where(RepositoryCommit.repository_id == repository.id)
+             .order_by(RepositoryCommit.position)
+             .execution_options(yield_per=batch_size))
+    for hexsha, author, message, date, utc_offset, insertions, deletions, files_changed in db.session.execute(query):
+        yield {'hash': hexsha, 'author': author, 'message': message, 'date': _commit_date(date, utc_offset),
+               'insertions': insertions, 'deletions': deletions, 'files_changed': files_changed}
+
+
+def iter_file_history(repository, batch_size=1000):
+    """Yield per-author file history rows, ordered by path then author.
+
+    ``last_modified`` is an ISO 8601 string in UTC. Snapshots without line
+    statistics, and those packaged before file history was kept, have none.
+    """
+    query = (select(*(getattr(RepositoryFileHistory, column) for column in FILE_HISTORY_COLUMNS))
+             .where(RepositoryFileHistory.repository_id == repository.id)
+             .order_by(RepositoryFileHistory.path, RepositoryFileHistory.author)
+             .execution_options(yield_per=batch_size))
+    for path, author, commits, insertions, deletions, last_modified in db.session.execute(query):
+        yield {'path': path, 'author': author, 'commits': commits, 'insertions': insertions,
+               'deletions': deletions, 'last_modified': _commit_date(last_modified, 0)}
+
+
+def summarize_file_history(repository):
+    """Return ``(rows, commits, insertions, deletions)`` over the snapshot's file history."""
+    columns = (RepositoryFileHistory.commits, RepositoryFileHistory.insertions, RepositoryFileHistory.deletions)
+    row = db.session.execute(select(func.count(), *(func.coalesce(func.sum(c), 0) for c in columns))
+                             .where(RepositoryFileHistory.repository_id == repository.id)).one()
+    return tuple(int(value) for value in row)
+
+
+def iter_dependencies(repository):
+    """Yield the snapshot's dependency rows as dicts, ordered by manifest and name."""
+    query = (select(*(getattr(RepositoryDependency, column) for column in DEPENDENCY_COLUMNS))
+             .where(RepositoryDependency.repository_id == repository.id)
+             .order_by(RepositoryDependency.manifest, RepositoryDependency.name, RepositoryDependency.kind))
+    for row in db.session.execute(query):
+        yield dict(zip(DEPENDENCY_COLUMNS, row))
+
+
+def list_packages(repository):
+    """Return ``{'manifest', 'ecosystem', 'name'}`` for the packages the snapshot publishes."""
+    query = (select(*(getattr(RepositoryPackage, column) for column in PACKAGE_COLUMNS))
+             .where(RepositoryPackage.repository_id == repository.id).order_by(RepositoryPackage.manifest))
+    return [dict(zip(PACKAGE_COLUMNS, row)) for row in db.session.execute(query)]
+
+
+def list_branches(repository):
+    if not is_normalized(repository):
+        return list(repository.packaged_data.get('branches', []))
+    query = (select(RepositoryBranch.name)
+             .where(RepositoryBranch.repository_id == repository.id)
+             .order_by(RepositoryBranch.id))
+    return list(db.session.scalars(query))
+
+
+def load_package(repository):
+    """Return the repository in the original single-document package shape."""
+    package = dict(repository.packaged_data or {})
+    package.setdefault('name', repository.name)
+    package.setdefault('url', repository.url)
+    package['files'] = list(iter_files(repository))
+    package['commits'] = list(iter_commits(repository))
+    package['branches'] = list_branches(repository)
+    return package
+
+
+def count_rows(repository, model):
+    return db.session.scalar(select(func.count()).select_from(model)
+                             .where(model.repository_id == repository.id))
+
+
+def latest_snapshot(repo_url):
+    return (Repository.query.filter_by(url=repo_url)
+            .order_by(Repository.id.desc()).first())
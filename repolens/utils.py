@@ -1,5 +1,6 @@
 import os
 import subprocess
+import tempfile
 
 def clone_repository(repo_url, target_dir):
     """Clone a git repository to a target directory."""
@@ -23,3 +24,71 @@ def get_file_size(file_path):
         return os.path.getsize(file_path)
     except OSError:
         return None
+
+class GitError(Exception):
+    pass
+
+def run_git(git_dir, *args, timeout=None, input=None):
+    """Run a git command against ``git_dir`` and return its stdout as bytes."""
+    command = ['git']
+    if git_dir is not None:
+        command += ['--git-dir', git_dir]
+    try:
+        result = subprocess.run(command + list(args), input=input, capture_output=True,
+                                timeout=timeout, check=True)
+    except subprocess.CalledProcessError as e:
+        raise GitError(e.stderr.decode('utf-8', 'replace').strip() or str(e))
+    except subprocess.TimeoutExpired:
+        raise GitError(f"git {args[0]} timed out after {timeout} seconds")
+    return result.stdout
+
+def iter_git_records(git_dir, *args, sep=b'\0', chunk_size=65536):
+    """Stream the output of a git command as ``sep``-terminated records (bytes)."""
+    command = ['git']
+    if git_dir is not None:
+        command += ['--git-dir', git_dir]
+    # stderr goes to a file so a chatty command cannot block on a full pipe
+    errors = tempfile.TemporaryFile()
+    process = subprocess.Popen(command + list(args), stdout=subprocess.PIPE, stderr=errors)
+    try:
+        buffer = b''
+        while True:
+            chunk = process.stdout.read(chunk_size)
+            if not chunk:
+                break
+            buffer += chunk
+            records = buffer.split(sep)
+            buffer = records.pop()
+            yield from records
+        if buffer:
+            yield buffer
+        if process.wait() != 0:
+            errors.seek(0)
+            raise GitError(errors.read().decode('utf-8', 'replace').strip() or f"git {args[0]} failed")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        errors.close()
+
+def write_lines(stdin, lines):
+    """Write ``lines`` to a process's stdin, one per line, then close it.
+
+    Meant to run in its own thread while the caller reads stdout; stops
+    quietly if the process exits early.
+    """
+    try:
+        for line in lines:
+            stdin.write(line.encode('utf-8') + b'\n')
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass
+
+def get_file_extension(path):
+    """Return the text after the last dot of ``path``, or 'unknown'."""
+    return path.split('.')[-1] if '.' in path else 'unknown'
@@ -24,6 +24,32 @@ document.addEventListener('DOMContentLoaded', () => {
         resultsDiv.innerHTML = `<p class="error">Error: ${message}</p>`;
     }
 
+    async function waitForJob(jobId, message) {
+        while (true) {
+            const response = await fetch(`/api/jobs/${jobId}`);
+            const job = await response.json();
+
+            if (!response.ok) {
+                throw new Error(job.error);
+            }
+            if (job.status === 'done') {
+                return job.result;
+            }
+            if (job.status === 'failed') {
+                throw new Error(job.error);
+            }
+
+            const progress = job.progress || {};
+            const counters = ['files', 'commits']
+                .filter(key => progress[key] !== undefined)
+                .map(key => `${progress[key]} ${key}`)
+                .join(', ');
+            showLoading(`${message} (${progress.stage || job.status}${counters ? ': ' + counters : ''})`);
+
+            await new Promise(resolve => setTimeout(resolve, 1000));
+        }
+    }
+
     function displayResults(data, analysisId) {
         const downloadButton = `<button onclick="downloadRepositoryContent(${data.repository_id})">Download Repository Content</button>`;
         resultsDiv.innerHTML = `
@@ -50,16 +76,17 @@ document.addEventListener('DOMContentLoaded', () => {
                 body: JSON.stringify({ repo_url: repoUrl }),
             });
             
-            const data = await response.json();
+            const job = await response.json();
             
             if (response.ok) {
+                const data = await waitForJob(job.job_id, 'Packaging repository...');
                 resultsDiv.innerHTML = `
                     <p>Repository packaged successfully!</p>
                     <p>Repository: ${data.repo_name} (ID: ${data.repo_id})</p>
                     <p>Use this ID for analysis.</p>
                 `;
             } else {
-                showError(data.error);
+                showError(job.error);
             }
         } catch (error) {
             showError(error.message);
@@ -113,9 +140,10 @@ document.addEventListener('DOMContentLoaded', () => {
                 body: JSON.stringify({ repo_url: repoUrl }),
             });
             
-            const packageData = await packageResponse.json();
+            const packageJob = await packageResponse.json();
             
             if (packageResponse.ok) {
+                const packageData = await waitForJob(packageJob.job_id, 'Packaging and analyzing repository...');
                 const repoId = packageData.repo_id;
                 const analysisType = 'file_count'; // Default analysis type
                 
@@ -139,7 +167,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     showError(analyzeData.error);
                 }
             } else {
-                showError(packageData.error);
+                showError(packageJob.error);
             }
         } catch (error) {
             showError(error.message);
@@ -0,0 +1,43 @@
+import os
+import subprocess
+
+GIT_ENV = {
+    'GIT_AUTHOR_NAME': 'Test Author',
+    'GIT_AUTHOR_EMAIL': 'author@example.com',
+    'GIT_COMMITTER_NAME': 'Test Author',
+    'GIT_COMMITTER_EMAIL': 'author@example.com',
+    'GIT_CONFIG_NOSYSTEM': '1',
+    'HOME': os.devnull,
+}
+
+
+def git(repo_path, *args):
+    env = dict(os.environ, **GIT_ENV)
+    return subprocess.run(['git', '-C', repo_path, *args], check=True, env=env,
+                          capture_output=True, text=True).stdout
+
+
+def make_repo(repo_path, files=None, message='Initial commit'):
+    """Create a local git repository with one commit containing ``files``."""
+    os.makedirs(repo_path, exist_ok=True)
+    git(repo_path, 'init', '-q', '-b', 'main')
+    commit_files(repo_path, files or {'README.md': '# Test\n', 'src/app.py': 'print("hi")\n'}, message)
+    return repo_path
+
+
+def commit_files(repo_path, files, message, author=None):
+    """Write ``files`` (path -> content, or None to delete) and commit them."""
+    for path, content in files.items():
+        full_path = os.path.join(repo_path, path)
+        if content is None:
+            git(repo_path, 'rm', '-q', path)
+            continue
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'w') as f:
+            f.write(content)
+        git(repo_path, 'add', path)
+    args = ['commit', '-q', '-m', message]
+    if author:
+        args += ['--author', author]
+    git(repo_path, *args)
+    return git(repo_path, 'rev-parse', 'HEAD').strip()
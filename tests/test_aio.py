@@ -0,0 +1,162 @@
+import asyncio
+import json
+import threading
+import unittest
+from flask import Flask
+from repolens.aio import AsyncApp, wsgi_environ
+from repolens.api import api_bp, init_app
+from repolens.browser import get_browser_pool
+from repolens.models import db
+from repolens.storage import save_package
+
+
+class BlockingDriver:
+    """A fake browser whose page loads wait until ``release`` is set."""
+
+    release = None
+    loading = 0
+
+    def __init__(self):
+        self.current_url = 'about:blank'
+
+    def get(self, url):
+        BlockingDriver.loading += 1
+        BlockingDriver.release.wait(5)
+        self.current_url = url
+
+    def delete_all_cookies(self):
+        pass
+
+    def get_screenshot_as_png(self):
+        return b'\x89PNG fake'
+
+    def quit(self):
+        pass
+
+
+async def call(app, method, path, body=b'', headers=(), query_string=b''):
+    """Send one request to an ASGI app and return ``(status, headers, body chunks)``."""
+    scope = {'type': 'http', 'http_version': '1.1', 'method': method, 'path': path, 'root_path': '',
+             'scheme': 'http', 'query_string': query_string, 'headers': list(headers),
+             'server': ('testserver', 80), 'client': ('127.0.0.1', 1234)}
+    messages = [{'type': 'http.request', 'body': body[:1], 'more_body': True},
+                {'type': 'http.request', 'body': body[1:], 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    start = sent[0]
+    return start['status'], dict(start['headers']), [message['body'] for message in sent[1:]]
+
+
+def post_json(app, path, payload):
+    return call(app, 'POST', path, json.dumps(payload).encode('utf-8'),
+                headers=[(b'content-type', b'application/json')])
+
+
+class TestWsgiEnviron(unittest.TestCase):
+    def test_scope_is_translated(self):
+        environ = wsgi_environ({'type': 'http', 'method': 'GET', 'path': '/app/api/ünï', 'root_path': '/app',
+                                'query_string': b'a=1', 'headers': [(b'content-type', b'text/plain'),
+                                                                    (b'x-tag', b'a'), (b'x-tag', b'b')],
+                                'server': ('example.com', 8080)}, None)
+        self.assertEqual(environ['SCRIPT_NAME'], '/app')
+        self.assertEqual(environ['PATH_INFO'], '/api/ünï'.encode('utf-8').decode('latin-1'))
+        self.assertEqual(environ['QUERY_STRING'], 'a=1')
+        self.assertEqual(environ['CONTENT_TYPE'], 'text/plain')
+        self.assertEqual(environ['HTTP_X_TAG'], 'a,b')
+        self.assertEqual((environ['SERVER_NAME'], environ['SERVER_PORT']), ('example.com', '8080'))
+
+
+class TestAsyncApp(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['REPOLENS_SNAPSHOT_DIR'] = None
+        self.app.config['REPOLENS_SEARCH_DB'] = None
+        self.app.config['REPOLENS_ANALYSIS_CACHE_DB'] = None
+        self.app.config['REPOLENS_BLOB_DB'] = None
+        self.app.config['REPOLENS_BROWSER_POOL_SIZE'] = 1
+        self.app.config['REPOLENS_BROWSER_MAX_WAITING'] = 1
+        self.app.register_blueprint(api_bp)
+        init_app(self.app)
+        get_browser_pool(self.app).factory = BlockingDriver
+        BlockingDriver.release = threading.Event()
+        BlockingDriver.loading = 0
+        self.asgi = AsyncApp(self.app)
+        with self.app.app_context():
+            db.create_all()
+            self.repo_id = save_package({'name': 'sample', 'url': 'https://example.com/sample.git'},
+                                        [{'path': f'src/file{i}.py', 'size': i} for i in range(3000)], [],
+                                        ['main']).id
+
+    def tearDown(self):
+        BlockingDriver.release.set()
+        self.asgi.close()
+        with self.app.app_context():
+            db.drop_all()
+
+    async def test_routes_keep_their_contracts(self):
+        status, headers, body = await call(self.asgi, 'GET', f'/api/repository/{self.repo_id}')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-type'], b'application/json')
+        self.assertEqual(json.loads(b''.join(body))['name'], 'sample')
+        status, _, body = await call(self.asgi, 'GET', '/api/repository/999')
+        self.assertEqual(status, 404)
+        status, _, _ = await post_json(self.asgi, '/api/package', {})
+        self.assertEqual(status, 400)
+
+    async def test_streamed_response_matches_wsgi(self):
+        expected = self.app.test_client().get(f'/api/download/{self.repo_id}?format=ndjson').get_data()
+        status, _, body = await call(self.asgi, 'GET', f'/api/download/{self.repo_id}',
+                                     query_string=b'format=ndjson')
+        self.assertEqual(status, 200)
+        self.assertGreater(len(body), 2)
+        self.assertEqual(b''.join(body), expected)
+
+    async def test_waiting_screenshots_do_not_block_fast_routes(self):
+        first = asyncio.ensure_future(post_json(self.asgi, '/api/screenshot', {'url': 'http://a.example'}))
+        for _ in range(500):
+            if BlockingDriver.loading:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(BlockingDriver.loading, 1)
+        second = asyncio.ensure_future(post_json(self.asgi, '/api/screenshot', {'url': 'http://b.example'}))
+        await asyncio.sleep(0.05)
+
+        # The browser is busy and one request waits; the next is turned away
+        status, _, body = await post_json(self.asgi, '/api/screenshot', {'url': 'http://c.example'})
+        self.assertEqual(status, 503)
+        self.assertEqual(json.loads(b''.join(body)), {'error': 'Too many screenshot requests are waiting'})
+        status, _, _ = await asyncio.wait_for(call(self.asgi, 'GET', f'/api/repository/{self.repo_id}'), 2)
+        self.assertEqual(status, 200)
+        self.assertEqual(BlockingDriver.loading, 1)
+
+        BlockingDriver.release.set()
+        for request in (first, second):
+            status, headers, body = await request
+            self.assertEqual(status, 200)
+            self.assertEqual(headers[b'content-type'], b'image/png')
+            self.assertEqual(b''.join(body), b'\x89PNG fake')
+
+    async def test_lifespan(self):
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        await self.asgi({'type': 'lifespan'}, receive, send)
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+from repolens.analysis_cache import LRUStore, SQLiteStore, AnalysisCache, snapshot_key
+from repolens.models import Repository
+
+
+class TestAnalysisCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, 'cache.db')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_lru_evicts_least_recently_used(self):
+        store = LRUStore(max_bytes=20)
+        store.set('a', {'v': 1})
+        store.set('b', {'v': 2})
+        store.get('a')
+        store.set('c', {'v': 3})
+
+        self.assertEqual(store.get('a'), {'v': 1})
+        self.assertIsNone(store.get('b'))
+        self.assertEqual(store.get('c'), {'v': 3})
+
+    def test_sqlite_tier_is_shared_and_promoted(self):
+        AnalysisCache([LRUStore(), SQLiteStore(self.db_path)]).set('key', {'total_files': 3})
+
+        other_process = AnalysisCache([LRUStore(), SQLiteStore(self.db_path)])
+        self.assertEqual(other_process.get('key'), {'total_files': 3})
+        self.assertEqual(other_process.get('key'), {'total_files': 3})
+        self.assertIsNone(other_process.get('missing'))
+        self.assertEqual(other_process.stats(), {
+            'hits': {'memory': 1, 'sqlite': 1}, 'misses': 1, 'hit_ratio': 2 / 3})
+
+    def test_snapshot_key_depends_on_content_not_row(self):
+        metadata = {'head': 'a' * 40, 'clone': {'depth': None, 'since': None, 'partial': False}}
+        first = Repository(id=1, packaged_data=metadata)
+        second = Repository(id=2, packaged_data=dict(metadata))
+        shallow = Repository(id=3, packaged_data=dict(metadata, clone={'depth': 5, 'since': None, 'partial': False}))
+
+        self.assertEqual(snapshot_key(first, 'file_count'), snapshot_key(second, 'file_count'))
+        self.assertNotEqual(snapshot_key(first, 'file_count'), snapshot_key(first, 'file_types'))
+        self.assertNotEqual(snapshot_key(first, 'file_count'), snapshot_key(shallow, 'file_count'))
+        self.assertIsNone(snapshot_key(Repository(packaged_data={'files': []}), 'file_count'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,24 @@
 import unittest
-from repolens.analyzer import analyze_repository
+from unittest import mock
+from repolens import analyzer
+from repolens.analyzer import analyze_repository, run_analyses, Analyzer, register_analyzer
 from repolens.models import Repository, Analysis, db
-from main import app
+from repolens.storage import save_package
+from repolens.analysis_cache import get_analysis_cache
+from repolens.history import FileHistory
+from repolens.api import init_app
+from flask import Flask
 
 class TestAnalyzer(unittest.TestCase):
     def setUp(self):
-        self.app = app.test_client()
-        self.app_context = app.app_context()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        # Results stay in the in-process tier, never the shared cache file
+        self.app.config['REPOLENS_ANALYSIS_CACHE_DB'] = None
+        self.app.config['REPOLENS_SNAPSHOT_DIR'] = None
+        self.app.config['REPOLENS_SEARCH_DB'] = None
+        init_app(self.app)
+        self.app_context = self.app.app_context()
         self.app_context.push()
         db.create_all()
 
@@ -29,7 +41,7 @@ class TestAnalyzer(unittest.TestCase):
         self.app_context.pop()
 
     def test_analyze_repository(self):
-        analysis_types = ['file_count', 'commit_count', 'branch_count', 'file_types']
+        analysis_types = ['file_count', 'commit_count', 'branch_count', 'file_types', 'lines_of_code']
 
         for analysis_type in analysis_types:
             analysis_id = analyze_repository(self.test_repo.id, analysis_type)
@@ -45,5 +57,158 @@ class TestAnalyzer(unittest.TestCase):
         invalid_analysis_id = analyze_repository(self.test_repo.id, 'invalid_type')
         self.assertIsNone(invalid_analysis_id)
 
+    def test_analyze_normalized_repository(self):
+        repository = save_package(
+            {'name': 'normalized', 'url': 'https://github.com/test/normalized.git', 'head': 'abc123'},
+            files=[{'path': 'a.py', 'size': 1}, {'path': 'b.py', 'size': 2}, {'path': 'Makefile', 'size': 3}],
+            commits=[{'hash': 'abc123', 'author': 'Ann', 'message': 'm\n', 'date': '2024-01-01T00:00:00+00:00'}],
+            branches=['main']
+        )
+        expected = {
+            'file_count': {'total_files': 3},
+            'commit_count': {'total_commits': 1},
+            'branch_count': {'total_branches': 1},
+            'file_types': {'file_types': {'py': 2, 'unknown': 1}},
+        }
+
+        for analysis_type, result in expected.items():
+            analysis = db.session.get(Analysis, analyze_repository(repository.id, analysis_type))
+            self.assertEqual(analysis.result, result)
+
+    def test_repeat_analysis_reuses_results(self):
+        metadata = {'name': 'cached', 'url': 'https://github.com/test/cached.git', 'head': 'f' * 40}
+        files = [{'path': 'a.py', 'size': 1}]
+        first = save_package(metadata, files, [], ['main'])
+        second = save_package(metadata, files, [], ['main'])
+        cache = get_analysis_cache()
+
+        first_id = analyze_repository(first.id, 'file_types')
+        self.assertEqual(analyze_repository(first.id, 'file_types'), first_id)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+        second_id = analyze_repository(second.id, 'file_types')
+        self.assertNotEqual(second_id, first_id)
+        self.assertEqual(cache.stats()['hits']['memory'], 1)
+        self.assertEqual(db.session.get(Analysis, second_id).result, {'file_types': {'py': 1}})
+
+    def test_version_bump_recomputes_existing_analysis(self):
+        repository = save_package({'name': 'bumped', 'url': 'https://github.com/test/bumped.git', 'head': 'f' * 40},
+                                  [{'path': 'a.py', 'size': 1}], [], ['main'])
+        first_id = analyze_repository(repository.id, 'file_types')
+
+        with mock.patch.object(analyzer.FileTypes, 'version', 2):
+            second_id = analyze_repository(repository.id, 'file_types')
+            self.assertNotEqual(second_id, first_id)
+            self.assertEqual(analyze_repository(repository.id, 'file_types'), second_id)
+        self.assertEqual(db.session.get(Analysis, second_id).analyzer_version, 2)
+        self.assertEqual(get_analysis_cache().stats()['misses'], 2)
+
+    def test_cache_key_covers_content_head_does_not_fix(self):
+        metadata = {'name': 'forked', 'url': 'https://github.com/test/forked.git', 'head': 'e' * 40}
+        commits = [{'hash': 'e' * 40, 'author': 'Ann', 'message': 'm\n', 'date': '2024-01-01T00:00:00+00:00'}]
+        first = save_package(metadata, [{'path': 'a.py', 'size': 1}], commits, ['main'])
+        second = save_package(metadata, [{'path': 'a.py', 'size': 1}], commits, ['main', 'dev'],
+                              file_history=self._file_history(commits))
+
+        for repository, branches, files in ((first, 1, 0), (second, 2, 1)):
+            analysis_ids = run_analyses(repository.id, ['branch_count', 'hotspots'])
+            self.assertEqual(db.session.get(Analysis, analysis_ids['branch_count']).result,
+                             {'total_branches': branches})
+            self.assertEqual(db.session.get(Analysis, analysis_ids['hotspots']).result['files'], files)
+
+    def _file_history(self, commits):
+        file_history = FileHistory()
+        for commit in commits:
+            file_history.add(commit, [('a.py', 1, 0)])
+        return file_history
+
+    def test_run_analyses_single_pass(self):
+        repository = save_package(
+            {'name': 'multi', 'url': 'https://github.com/test/multi.git'},
+            files=[{'path': 'a.py', 'size': 1}, {'path': 'b.js', 'size': 2}],
+            commits=[{'hash': 'abc123', 'author': 'Ann', 'message': 'm\n', 'date': '2024-01-01T00:00:00+00:00'}],
+            branches=['main']
+        )
+        types = ['file_count', 'file_types', 'commit_count']
+
+        # Without SQL aggregates, every file analyzer shares one stream of rows
+        with mock.patch.object(analyzer, 'get_snapshot_store', return_value=None), \
+                mock.patch.object(analyzer.FileCount, 'query', return_value=None), \
+                mock.patch.object(analyzer.FileTypes, 'query', return_value=None), \
+                mock.patch.object(analyzer, 'iter_file_rows', wraps=analyzer.iter_file_rows) as file_rows, \
+                mock.patch.object(db.session, 'commit', wraps=db.session.commit) as commit:
+            analysis_ids = run_analyses(repository.id, types)
+        self.assertEqual(file_rows.call_count, 1)
+        self.assertEqual(commit.call_count, 1)
+
+        self.assertEqual(list(analysis_ids), types)
+        self.assertEqual(db.session.get(Analysis, analysis_ids['file_types']).result,
+                         {'file_types': {'py': 1, 'js': 1}})
+        self.assertEqual(db.session.get(Analysis, analysis_ids['commit_count']).result, {'total_commits': 1})
+
+        # Existing analyses are reused and only the new type is added
+        again = run_analyses(repository.id, ['file_count', 'branch_count'])
+        self.assertEqual(again['file_count'], analysis_ids['file_count'])
+        self.assertEqual(db.session.get(Analysis, again['branch_count']).result, {'total_branches': 1})
+
+        self.assertIsNone(run_analyses(repository.id, ['file_count', 'invalid_type']))
+        self.assertIsNone(run_analyses(repository.id, []))
+
+    def test_sql_aggregates_match_streamed_rows(self):
+        files = [{'path': 'a.py', 'size': 1, 'language': 'Python', 'binary': False, 'lines': 3, 'code_lines': 2,
+                  'comment_lines': 1, 'blank_lines': 0},
+                 {'path': 'b.py', 'size': 1, 'language': 'Python', 'binary': False, 'lines': 1, 'code_lines': 1,
+                  'comment_lines': 0, 'blank_lines': 0},
+                 {'path': 'NOTES', 'size': 1, 'binary': False, 'lines': 2, 'code_lines': 2, 'comment_lines': 0,
+                  'blank_lines': 0},
+                 {'path': 'logo.png', 'size': 5, 'binary': True}, {'path': 'old.js', 'size': 2}]
+        commits = [{'hash': 'abc123', 'author': 'Ann', 'message': 'm\n', 'date': '2024-01-01T00:00:00+00:00'}]
+        types = ['file_count', 'commit_count', 'branch_count', 'file_types', 'lines_of_code']
+        metadata = {'name': 'agg', 'url': 'https://github.com/test/agg.git'}
+        first = save_package(metadata, files, commits, ['main', 'dev'])
+        second = save_package(metadata, files, commits, ['main', 'dev'])
+
+        with mock.patch.object(analyzer, 'iter_file_rows', wraps=analyzer.iter_file_rows) as file_rows, \
+                mock.patch.object(analyzer, 'iter_commit_rows', wraps=analyzer.iter_commit_rows) as commit_rows:
+            aggregated = run_analyses(first.id, types)
+        file_rows.assert_not_called()
+        commit_rows.assert_not_called()
+        for cls in (analyzer.FileCount, analyzer.CommitCount, analyzer.BranchCount, analyzer.FileTypes,
+                    analyzer.LinesOfCode):
+            self.enterContext(mock.patch.object(cls, 'query', return_value=None))
+        streamed = run_analyses(second.id, types)
+        for analysis_type in types:
+            self.assertEqual(db.session.get(Analysis, aggregated[analysis_type]).result,
+                             db.session.get(Analysis, streamed[analysis_type]).result)
+        self.assertEqual(db.session.get(Analysis, aggregated['lines_of_code']).result['languages'],
+                         {'Python': {'files': 2, 'lines': 4, 'code_lines': 3, 'comment_lines': 1, 'blank_lines': 0},
+                          'unknown': {'files': 1, 'lines': 2, 'code_lines': 2, 'comment_lines': 0, 'blank_lines': 0}})
+
+    def test_registered_analyzer(self):
+        @register_analyzer('test_authors')
+        class Authors(Analyzer):
+            consumes = ('commits',)
+
+            def __init__(self):
+                self.authors = set()
+
+            def add_commit(self, commit):
+                self.authors.add(commit['author'])
+
+            def result(self):
+                return {'authors': sorted(self.authors)}
+
+        self.addCleanup(analyzer._analyzers.pop, 'test_authors')
+        repository = save_package(
+            {'name': 'plugin', 'url': 'https://github.com/test/plugin.git'}, [],
+            [{'hash': h, 'author': a, 'message': '', 'date': '2024-01-01T00:00:00+00:00'}
+             for h, a in (('a1', 'Bo'), ('b2', 'Ann'), ('c3', 'Bo'))], []
+        )
+        analysis = db.session.get(Analysis, analyze_repository(repository.id, 'test_authors'))
+        self.assertEqual(analysis.result, {'authors': ['Ann', 'Bo']})
+
+        with self.assertRaises(ValueError):
+            register_analyzer('test_invalid')(type('Invalid', (Analyzer,), {'consumes': ('blobs',)}))
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,15 +1,23 @@
+import gzip
+import importlib.util
+import json
 import unittest
 from flask import Flask
 from repolens.api import api_bp, init_app
 from repolens.models import Repository, Analysis
 from repolens.database import db
+from repolens.storage import save_package, load_package
+from sqlalchemy import event
 from sqlalchemy.orm import close_all_sessions
 
 class TestGetAnalysis(unittest.TestCase):
     def setUp(self):
         self.app = Flask(__name__)
         self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['REPOLENS_SNAPSHOT_DIR'] = None
+        self.app.config['REPOLENS_SEARCH_DB'] = None
         self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        self.app.config['REPOLENS_ANALYSIS_CACHE_DB'] = None
         self.app.register_blueprint(api_bp)
         init_app(self.app)
         
@@ -48,6 +56,27 @@ class TestGetAnalysis(unittest.TestCase):
             self.assertEqual(data['analysis_type'], 'file_count')
             self.assertEqual(data['result'], {'count': 10})
 
+    def test_analyze_multiple_types(self):
+        with self.app.app_context():
+            repo_id = save_package({'name': 'repo', 'url': 'https://github.com/test/repo.git'},
+                                   [{'path': 'a.py', 'size': 1}], [], ['main']).id
+
+        response = self.client.post('/api/analyze', json={'repo_id': repo_id,
+                                                          'analysis_types': ['file_count', 'branch_count']})
+        self.assertEqual(response.status_code, 201)
+        analysis_ids = response.get_json()['analysis_ids']
+        self.assertEqual(set(analysis_ids), {'file_count', 'branch_count'})
+        data = self.client.get(f"/api/analysis/{analysis_ids['branch_count']}").get_json()
+        self.assertEqual(data['result'], {'total_branches': 1})
+
+        response = self.client.post('/api/analyze', json={'repo_id': repo_id, 'analysis_type': 'file_count'})
+        self.assertEqual(response.get_json(), {'analysis_id': analysis_ids['file_count']})
+
+        response = self.client.post('/api/analyze', json={'repo_id': repo_id, 'analysis_types': ['nope']})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/analyze', json={'repo_id': repo_id, 'analysis_types': [1]})
+        self.assertEqual(response.status_code, 400)
+
     def test_get_nonexistent_analysis(self):
         response = self.client.get('/api/analysis/999')
         self.assertEqual(response.status_code, 404)
@@ -81,5 +110,161 @@ class TestGetAnalysis(unittest.TestCase):
                 self.assertEqual(data['repository_id'], repo.id)
                 self.assertEqual(data['repository_name'], repo.name)
 
+class TestDownload(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['REPOLENS_SNAPSHOT_DIR'] = None
+        self.app.config['REPOLENS_SEARCH_DB'] = None
+        self.app.register_blueprint(api_bp)
+        init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.repository = save_package(
+            {'name': 'sample', 'url': 'https://example.com/sample.git', 'head': 'a' * 40,
+             'clone': {'depth': None, 'since': None, 'partial': False}},
+            files=[{'path': f'src/file{i}.py', 'size': i} for i in range(50)],
+            commits=[{'hash': 'b' * 40, 'author': 'Ann', 'message': 'Init\n', 'date': '2024-01-01T00:00:00+00:00'}],
+            branches=['main']
+        )
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_json_matches_pretty_printed_package(self):
+        response = self.client.get(f'/api/download/{self.repository.id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.get_data(as_text=True), json.dumps(load_package(self.repository), indent=2))
+        self.assertIn('sample_content.txt', response.headers['Content-Disposition'])
+
+    def test_ndjson_records(self):
+        response = self.client.get(f'/api/download/{self.repository.id}?format=ndjson')
+        records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(records[0]['type'], 'repository')
+        self.assertEqual(sum(r['type'] == 'file' for r in records), 50)
+        self.assertEqual(records[-1], {'type': 'branch', 'name': 'main'})
+
+    def test_gzip_compression(self):
+        response = self.client.get(f'/api/download/{self.repository.id}?compression=gzip')
+        self.assertEqual(response.mimetype, 'application/gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.data)), load_package(self.repository))
+
+    @unittest.skipUnless(importlib.util.find_spec('zstandard'), 'zstandard is not installed')
+    def test_zstd_compression(self):
+        import zstandard
+        response = self.client.get(f'/api/download/{self.repository.id}?compression=zstd')
+        data = zstandard.ZstdDecompressor().decompressobj().decompress(response.data)
+        self.assertEqual(json.loads(data), load_package(self.repository))
+
+    def test_conditional_and_range_requests(self):
+        url = f'/api/download/{self.repository.id}'
+        full = self.client.get(url)
+        etag = full.headers['ETag']
+        self.assertIn('Last-Modified', full.headers)
+
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+
+        partial = self.client.get(url, headers={'Range': 'bytes=100-199'})
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial.data, full.data[100:200])
+        self.assertEqual(partial.headers['Content-Range'], f'bytes 100-199/{len(full.data)}')
+
+    def test_invalid_options(self):
+        response = self.client.get(f'/api/download/{self.repository.id}?format=xml')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], 'Invalid format: xml')
+
+class TestListings(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['REPOLENS_SNAPSHOT_DIR'] = None
+        self.app.config['REPOLENS_SEARCH_DB'] = None
+        self.app.register_blueprint(api_bp)
+        init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.ids = []
+        for i in range(5):
+            name = 'alpha' if i % 2 == 0 else 'beta'
+            repository = save_package({'name': name, 'url': f'https://example.com/{name}.git', 'head': str(i) * 40},
+                                      [{'path': 'a.py', 'size': 1}], [], ['main'])
+            db.session.add(Analysis(repository_id=repository.id, analysis_type='file_count', result={'count': i}))
+            self.ids.append(repository.id)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _get(self, path, **params):
+        response = self.client.get(path, query_string=params)
+        self.assertEqual(response.status_code, 200, response.get_json())
+        return response.get_json()
+
+    def test_repositories_are_paged_newest_first(self):
+        first = self._get('/api/repositories', limit=2)
+        self.assertEqual([r['id'] for r in first['repositories']], self.ids[:-3:-1])
+        self.assertEqual(set(first['repositories'][0]), {'id', 'name', 'url', 'created_at'})
+        seen = [r['id'] for r in first['repositories']]
+        cursor = first['next_cursor']
+        while cursor:
+            page = self._get('/api/repositories', limit=2, cursor=cursor)
+            seen += [r['id'] for r in page['repositories']]
+            cursor = page['next_cursor']
+        self.assertEqual(seen, self.ids[::-1])
+
+        beta = self._get('/api/repositories', name='beta')['repositories']
+        self.assertEqual([r['id'] for r in beta], [self.ids[3], self.ids[1]])
+        self.assertEqual(self._get('/api/repositories', url='https://example.com/alpha.git',
+                                   since='2000-01-01')['repositories'][-1]['id'], self.ids[0])
+
+    def test_field_projection(self):
+        items = self._get('/api/repositories', fields='id,packaged_data', limit=1)['repositories']
+        self.assertEqual(items, [{'id': self.ids[-1], 'packaged_data': {
+            'name': 'alpha', 'url': 'https://example.com/alpha.git', 'head': '4' * 40}}])
+
+        analyses = self._get('/api/analyses', repository_id=self.ids[1])['analyses']
+        self.assertEqual([set(a) for a in analyses], [{'id', 'repository_id', 'analysis_type', 'created_at'}])
+        analyses = self._get('/api/analyses', analysis_type='file_count', fields='result', limit=2)['analyses']
+        self.assertEqual(analyses, [{'result': {'count': 4}}, {'result': {'count': 3}}])
+
+    def test_conditional_requests(self):
+        response = self.client.get('/api/repositories')
+        etag = response.headers['ETag']
+        self.assertEqual(self.client.get('/api/repositories', headers={'If-None-Match': etag}).status_code, 304)
+
+        save_package({'name': 'gamma', 'url': 'https://example.com/gamma.git'}, [], [], [])
+        self.assertEqual(self.client.get('/api/repositories', headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_packaged_data_is_only_read_when_asked_for(self):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            db.session.expunge_all()
+            self.assertEqual(self._get(f'/api/repository/{self.ids[0]}')['name'], 'alpha')
+            self._get('/api/repositories')
+            self.assertFalse([s for s in statements if 'packaged_data' in s])
+            self._get('/api/repositories', fields='packaged_data')
+            self.assertTrue([s for s in statements if 'packaged_data' in s])
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+    def test_invalid_requests(self):
+        for params in ({'limit': 0}, {'cursor': 'nope'}, {'fields': 'id,secret'}, {'since': 'yesterday'}):
+            self.assertEqual(self.client.get('/api/repositories', query_string=params).status_code, 400)
+        self.assertEqual(self.client.get('/api/analyses', query_string={'limit': 501}).status_code, 400)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,134 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+from flask import Flask
+from repolens.api import api_bp, init_app
+from repolens.batch import package_batch, package_batch_command
+from repolens.jobs import get_queue, DONE
+from repolens.models import Repository
+from repolens.packager import store_repository
+from repolens.database import db
+from repolens.storage import load_package
+from gitfixtures import make_repo, commit_files
+
+
+class TestPackageBatch(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        self.app.config['REPOLENS_MIRROR_DIR'] = os.path.join(self.temp_dir.name, 'mirrors')
+        self.app.config['REPOLENS_SEARCH_DB'] = os.path.join(self.temp_dir.name, 'search.db')
+        self.app.config['REPOLENS_SNAPSHOT_DIR'] = None
+        self.app.config['REPOLENS_BLOB_DB'] = None
+        self.app.config['REPOLENS_JOBS_DB'] = os.path.join(self.temp_dir.name, 'jobs.db')
+        self.app.config['REPOLENS_JOB_WORKERS'] = 0
+        self.app.config['REPOLENS_BATCH_WORKERS'] = 2
+        self.app.register_blueprint(api_bp, url_prefix='/api')
+        init_app(self.app)
+
+        with self.app.app_context():
+            db.create_all()
+
+        self.client = self.app.test_client()
+        self.repo_paths = [
+            make_repo(os.path.join(self.temp_dir.name, name), {f'{name}.py': f'# {name}\n'})
+            for name in ('alpha', 'beta', 'gamma')
+        ]
+        self.missing = os.path.join(self.temp_dir.name, 'missing')
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        self.temp_dir.cleanup()
+
+    def test_packages_all_and_isolates_failures(self):
+        updates = []
+        with self.app.app_context():
+            summary = package_batch(self.repo_paths + [self.missing, self.repo_paths[0]],
+                                    progress=lambda stage=None, **counters: updates.append(counters))
+
+            self.assertEqual((summary['total'], summary['succeeded'], summary['failed']), (4, 3, 1))
+            results = {result['repo_url']: result for result in summary['results']}
+            self.assertIn('Error cloning repository', results[self.missing]['error'])
+            self.assertIsNone(results[self.missing]['repo_id'])
+
+            for path in self.repo_paths:
+                result = results[path]
+                self.assertIsNone(result['error'])
+                self.assertEqual(result['files'], 1)
+                package = load_package(db.session.get(Repository, result['repo_id']))
+                self.assertEqual([f['path'] for f in package['files']], [f'{result["repo_name"]}.py'])
+
+        self.assertEqual(updates[-1], {'total': 4, 'completed': 4, 'failed': 1})
+
+    def test_store_failure_does_not_stop_the_others(self):
+        failing = self.repo_paths[0]
+
+        def store(collected, *args, **kwargs):
+            if collected['metadata']['url'] == failing:
+                raise RuntimeError('database is locked')
+            return store_repository(collected, *args, **kwargs)
+
+        with self.app.app_context(), mock.patch('repolens.batch.store_repository', side_effect=store):
+            summary = package_batch(self.repo_paths)
+
+            self.assertEqual((summary['succeeded'], summary['failed']), (2, 1))
+            results = {result['repo_url']: result for result in summary['results']}
+            self.assertEqual(results[failing]['error'], 'Error storing repository: RuntimeError: database is locked')
+            self.assertIsNone(results[failing]['repo_id'])
+            for path in self.repo_paths[1:]:
+                self.assertIsNone(results[path]['error'])
+                self.assertIsNotNone(db.session.get(Repository, results[path]['repo_id']))
+
+    def test_second_batch_is_incremental(self):
+        with self.app.app_context():
+            package_batch(self.repo_paths)
+            commit_files(self.repo_paths[0], {'extra.py': 'x = 1\n'}, 'Add extra')
+            summary = package_batch(self.repo_paths)
+
+            results = {result['repo_url']: result for result in summary['results']}
+            self.assertEqual(results[self.repo_paths[0]]['files'], 1)
+            self.assertEqual(results[self.repo_paths[1]]['files'], 0)
+            package = load_package(db.session.get(Repository, results[self.repo_paths[0]]['repo_id']))
+            self.assertEqual(sorted(f['path'] for f in package['files']), ['alpha.py', 'extra.py'])
+
+    def test_invalid_options_fail_every_repository(self):
+        with self.app.app_context():
+            summary = package_batch(self.repo_paths, depth=0)
+            self.assertEqual(Repository.query.count(), 0)
+        self.assertEqual((summary['succeeded'], summary['failed']), (0, 3))
+
+    def test_batch_endpoint_runs_as_job(self):
+        response = self.client.post('/api/package/batch', json={'repo_urls': self.repo_paths, 'workers': 2})
+        self.assertEqual(response.status_code, 202)
+        job_id = response.get_json()['job_id']
+
+        get_queue(self.app).run_pending()
+
+        data = self.client.get(f'/api/jobs/{job_id}').get_json()
+        self.assertEqual(data['status'], DONE)
+        self.assertEqual(data['result']['succeeded'], 3)
+        self.assertEqual(data['progress']['completed'], 3)
+
+    def test_batch_endpoint_validates_input(self):
+        self.assertEqual(self.client.post('/api/package/batch', json={}).status_code, 400)
+        self.assertEqual(self.client.post('/api/package/batch', json={'repo_urls': 'x'}).status_code, 400)
+        response = self.client.post('/api/package/batch', json={'repo_urls': self.repo_paths, 'workers': 0})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cli_command(self):
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(package_batch_command, [*self.repo_paths[:2], '--workers', '1'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(json.loads(result.output)['succeeded'], 2)
+
+        result = runner.invoke(package_batch_command, [self.missing])
+        self.assertEqual(result.exit_code, 1)
+
+if __name__ == '__main__':
+    unittest.main()
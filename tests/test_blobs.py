@@ -0,0 +1,125 @@
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+from flask import Flask
+from repolens import blobs
+from repolens.api import api_bp, init_app
+from repolens.blobs import get_blob_store
+from repolens.models import Repository, db
+from repolens.packager import package_repository
+from repolens.search import read_blobs
+from gitfixtures import make_repo, commit_files, git
+
+FILES = {'README.md': '# Sample\n', 'src/app.py': 'print("hi")\n', 'src/copy.py': 'print("hi")\n'}
+
+
+class TestBlobStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['REPOLENS_MIRROR_DIR'] = os.path.join(self.temp_dir.name, 'mirrors')
+        self.app.config['REPOLENS_SEARCH_DB'] = None
+        self.app.config['REPOLENS_SNAPSHOT_DIR'] = None
+        self.app.config['REPOLENS_ANALYSIS_CACHE_DB'] = None
+        self.app.config['REPOLENS_BLOB_DB'] = os.path.join(self.temp_dir.name, 'cache', 'blobs.db')
+        self.app.config['REPOLENS_SCAN_WORKERS'] = 1
+        self.app.register_blueprint(api_bp)
+        init_app(self.app)
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.store = get_blob_store()
+        self.repo_path = make_repo(os.path.join(self.temp_dir.name, 'sample'), FILES)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.temp_dir.cleanup()
+
+    def _package(self, repo_path, **options):
+        repo_id, error = package_repository(repo_path, **options)
+        self.assertIsNone(error)
+        return repo_id
+
+    def _blob_sha(self, path, repo_path=None):
+        return git(repo_path or self.repo_path, 'rev-parse', f'HEAD:{path}').strip()
+
+    def _fork(self):
+        fork_path = os.path.join(self.temp_dir.name, 'fork')
+        subprocess.run(['git', 'clone', '-q', self.repo_path, fork_path], check=True, capture_output=True)
+        commit_files(fork_path, {'src/fork.py': 'print("fork")\n'}, 'Fork change')
+        return fork_path
+
+    def test_identical_content_is_stored_once(self):
+        self._package(self.repo_path)
+        self.assertEqual(self.store.stats()['blobs'], 2)
+        self.assertEqual(self.store.get(self._blob_sha('src/app.py')), b'print("hi")\n')
+        self.assertIsNone(self.store.get('0' * 40))
+
+    def test_snapshots_and_forks_only_write_new_blobs(self):
+        self._package(self.repo_path)
+        first = self.store.stats()
+        self._package(self.repo_path, incremental=False)
+        self.assertEqual(self.store.stats()['stored_bytes'], first['stored_bytes'])
+
+        self._package(self._fork())
+        stats = self.store.stats()
+        self.assertEqual(stats['blobs'], 3)
+        self.assertEqual(stats['snapshots'], 3)
+        # Shared blobs are referenced by every snapshot, the fork's own once
+        conn = self.store._connect()
+        try:
+            refs = dict(conn.execute('SELECT sha, refs FROM blobs'))
+        finally:
+            conn.close()
+        self.assertEqual(refs[self._blob_sha('README.md')], 3)
+        self.assertEqual(refs[self._blob_sha('src/fork.py', os.path.join(self.temp_dir.name, 'fork'))], 1)
+
+    def test_collect_during_packaging_keeps_referenced_blobs(self):
+        first = self._package(self.repo_path)
+        self.store.remove_snapshot(first)
+        fork_path = self._fork()
+
+        # A garbage collection runs while the fork's new blob is being read
+        def read_and_collect(*args, **kwargs):
+            self.store.collect()
+            return read_blobs(*args, **kwargs)
+        with mock.patch.object(blobs, 'read_blobs', side_effect=read_and_collect):
+            fork = self._package(fork_path)
+        self.assertEqual(self.store.get(self._blob_sha('README.md')), b'# Sample\n')
+        self.assertEqual(self.store.add_snapshot(db.session.get(Repository, fork), None)['blobs'], 3)
+
+    def test_delete_releases_and_collects(self):
+        repo_id = self._package(self.repo_path)
+        fork_id = self._package(self._fork())
+        fork_sha = self._blob_sha('src/fork.py', os.path.join(self.temp_dir.name, 'fork'))
+
+        response = self.client.delete(f'/api/repository/{fork_id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'deleted': fork_id, 'blobs_collected': 1})
+        self.assertIsNone(self.store.get(fork_sha))
+        self.assertEqual(self.client.get(f'/api/repository/{fork_id}').status_code, 404)
+        self.assertEqual(self.client.delete(f'/api/repository/{fork_id}').status_code, 404)
+
+        self.client.delete(f'/api/repository/{repo_id}')
+        self.assertEqual(self.store.stats()['blobs'], 0)
+
+    def test_blob_endpoint(self):
+        self._package(self.repo_path)
+        sha = self._blob_sha('README.md')
+        response = self.client.get(f'/api/blobs/{sha}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'# Sample\n')
+        self.assertEqual(response.headers['ETag'], f'"{sha}"')
+        self.assertEqual(self.client.get(f'/api/blobs/{sha}', headers={'If-None-Match': f'"{sha}"'}).status_code,
+                         304)
+        self.assertEqual(self.client.get('/api/blobs/missing').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import threading
+import time
+import unittest
+from unittest import mock
+from flask import Flask
+from repolens.api import api_bp, init_app
+from repolens import browser
+from repolens.browser import BrowserPool, PoolBusy, get_browser_pool
+
+
+class FakeDriver:
+    created = 0
+
+    def __init__(self):
+        FakeDriver.created += 1
+        self.alive = True
+        self.visited = []
+        self.quit_called = False
+
+    @property
+    def current_url(self):
+        if not self.alive:
+            raise RuntimeError('browser crashed')
+        return self.visited[-1] if self.visited else 'about:blank'
+
+    def get(self, url):
+        if url == 'http://fail.example':
+            raise RuntimeError('page failed to load')
+        self.visited.append(url)
+
+    def delete_all_cookies(self):
+        pass
+
+    def get_screenshot_as_png(self):
+        return b'\x89PNG fake'
+
+    def quit(self):
+        self.quit_called = True
+
+
+class TestBrowserPool(unittest.TestCase):
+    def setUp(self):
+        FakeDriver.created = 0
+
+    def test_drivers_are_reused(self):
+        pool = BrowserPool(FakeDriver, size=2)
+        for _ in range(5):
+            with pool.driver() as driver:
+                driver.get('http://example.com')
+        self.assertEqual(FakeDriver.created, 1)
+
+    def test_driver_recycled_after_max_uses(self):
+        pool = BrowserPool(FakeDriver, size=1, max_uses=2)
+        drivers = []
+        for _ in range(4):
+            with pool.driver() as driver:
+                drivers.append(driver)
+        self.assertEqual(FakeDriver.created, 2)
+        self.assertTrue(drivers[0].quit_called)
+
+    def test_unhealthy_and_failed_drivers_are_replaced(self):
+        pool = BrowserPool(FakeDriver, size=1)
+        with pool.driver() as driver:
+            first = driver
+        first.alive = False
+        with pool.driver() as driver:
+            self.assertIsNot(driver, first)
+
+        with self.assertRaises(RuntimeError):
+            with pool.driver() as driver:
+                driver.get('http://fail.example')
+        with pool.driver() as replacement:
+            self.assertIsNot(replacement, driver)
+        self.assertEqual(FakeDriver.created, 3)
+
+    def test_concurrency_and_queue_limits(self):
+        pool = BrowserPool(FakeDriver, size=1, max_waiting=1, acquire_timeout=0.2)
+        release = threading.Event()
+
+        def hold():
+            with pool.driver():
+                release.wait()
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        time.sleep(0.05)
+        with self.assertRaises(PoolBusy):
+            with pool.driver():
+                pass
+        release.set()
+        holder.join()
+        with pool.driver():
+            pass
+        self.assertEqual(FakeDriver.created, 1)
+
+    def test_warm_starts_pool_size_drivers(self):
+        pool = BrowserPool(FakeDriver, size=3)
+        pool.warm()
+        self.assertEqual(FakeDriver.created, 3)
+        pool.close()
+
+    def test_warm_in_background_reports_failures(self):
+        def broken():
+            raise RuntimeError('no chromedriver')
+
+        errors = []
+        pool = BrowserPool(broken, size=2)
+        pool.warm_in_background(errors.append).join()
+        self.assertEqual([str(e) for e in errors], ['no chromedriver'])
+        with pool._condition:
+            self.assertEqual(pool._total, 0)
+
+    def test_init_app_warms_pool_when_configured(self):
+        app = Flask(__name__)
+        app.config['REPOLENS_BROWSER_POOL_SIZE'] = 2
+        app.config['REPOLENS_BROWSER_WARM'] = True
+        warming = []
+        with mock.patch('repolens.browser.ChromeFactory', return_value=FakeDriver), \
+                mock.patch.object(BrowserPool, 'warm_in_background',
+                                  lambda pool, on_error=None: warming.append(pool.warm())):
+            browser.init_app(app)
+        self.assertEqual(len(warming), 1)
+        self.assertEqual(FakeDriver.created, 2)
+        get_browser_pool(app).close()
+
+
+class TestScreenshotEndpoint(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.register_blueprint(api_bp)
+        init_app(self.app)
+        get_browser_pool(self.app).factory = FakeDriver
+        self.client = self.app.test_client()
+
+    def test_screenshot_returns_png_bytes(self):
+        response = self.client.post('/api/screenshot', json={'url': 'http://example.com'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertEqual(response.data, b'\x89PNG fake')
+
+    def test_screenshot_error(self):
+        response = self.client.post('/api/screenshot', json={'url': 'http://fail.example'})
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.get_json()['error'], 'page failed to load')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import json
+import os
+import tempfile
+import unittest
+from flask import Flask
+from repolens.api import api_bp, init_app
+from repolens.compare import CompareError, diff_files, diff_commits
+from repolens.models import Repository, db
+from repolens.snapshot import get_snapshot_store
+from repolens.storage import save_package
+
+URL = 'https://github.com/test/sample.git'
+BASE_FILES = [
+    {'path': 'README.md', 'size': 10, 'blob': '1' * 40},
+    {'path': 'old.txt', 'size': 3, 'blob': '2' * 40},
+    {'path': 'src/app.py', 'size': 120, 'blob': '3' * 40},
+    {'path': 'src/util.py', 'size': 50, 'blob': '4' * 40},
+]
+TARGET_FILES = [
+    {'path': 'README.md', 'size': 10, 'blob': '1' * 40},
+    {'path': 'src/app.py', 'size': 140, 'blob': '5' * 40},
+    {'path': 'src/new.py', 'size': 7, 'blob': '6' * 40},
+    {'path': 'src/util.py', 'size': 50, 'blob': '7' * 40},
+]
+BASE_COMMITS = [
+    {'hash': 'b' * 40, 'author': 'Ann', 'message': 'Second\n', 'date': '2024-03-01T12:30:00+05:30'},
+    {'hash': 'a' * 40, 'author': 'Bo', 'message': 'First\n', 'date': '2024-01-01T00:00:00-08:00'},
+]
+TARGET_COMMITS = [
+    {'hash': 'c' * 40, 'author': 'Cy', 'message': 'Third\n', 'date': '2024-03-02T00:00:00+00:00'},
+    BASE_COMMITS[0],
+]
+
+
+class TestDiff(unittest.TestCase):
+    def test_diff_files(self):
+        changes = list(diff_files(BASE_FILES, TARGET_FILES))
+        self.assertEqual([(c['path'], c['status']) for c in changes], [
+            ('old.txt', 'removed'), ('src/app.py', 'resized'), ('src/new.py', 'added'), ('src/util.py', 'modified'),
+        ])
+        self.assertEqual(changes[1], {'path': 'src/app.py', 'status': 'resized', 'old_size': 120, 'new_size': 140})
+
+    def test_unknown_blobs_are_not_modifications(self):
+        files = [{'path': 'a', 'size': 1, 'blob': None}]
+        self.assertEqual(list(diff_files(files, [{'path': 'a', 'size': 1, 'blob': '9' * 40}])), [])
+
+    def test_unordered_input_is_rejected(self):
+        with self.assertRaises(CompareError):
+            list(diff_files(list(reversed(BASE_FILES)), TARGET_FILES))
+
+    def test_diff_commits(self):
+        changes = list(diff_commits(lambda: iter(BASE_COMMITS), lambda: iter(TARGET_COMMITS)))
+        self.assertEqual([(c['hash'], c['status']) for c in changes], [('c' * 40, 'added'), ('a' * 40, 'removed')])
+
+
+class TestCompareEndpoint(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['REPOLENS_SNAPSHOT_DIR'] = os.path.join(self.temp_dir.name, 'snapshots')
+        self.app.config['REPOLENS_SEARCH_DB'] = None
+        self.app.config['REPOLENS_ANALYSIS_CACHE_DB'] = None
+        self.app.config['REPOLENS_BLOB_DB'] = None
+        self.app.register_blueprint(api_bp)
+        init_app(self.app)
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.base = save_package({'name': 'sample', 'url': URL, 'head': 'b' * 40}, BASE_FILES, BASE_COMMITS, ['main'])
+        self.target = save_package({'name': 'sample', 'url': URL, 'head': 'c' * 40}, TARGET_FILES, TARGET_COMMITS,
+                                   ['main'])
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.temp_dir.cleanup()
+
+    def test_compare_json(self):
+        response = self.client.get(f'/api/compare?base={self.base.id}&target={self.target.id}')
+        self.assertEqual(response.status_code, 200)
+        result = response.get_json()
+        self.assertEqual((result['base']['id'], result['target']['head']), (self.base.id, 'c' * 40))
+        self.assertEqual([f['path'] for f in result['files']], ['old.txt', 'src/app.py', 'src/new.py', 'src/util.py'])
+        self.assertEqual([c['hash'] for c in result['commits']], ['c' * 40, 'a' * 40])
+        self.assertEqual(result['summary'], {'files': {'added': 1, 'removed': 1, 'resized': 1, 'modified': 1},
+                                             'commits': {'added': 1, 'removed': 1}})
+
+        # Snapshot files give the same answer as the database rows
+        store = get_snapshot_store()
+        for repository in (self.base, self.target):
+            store.build(repository)
+        again = self.client.get(f'/api/compare?base={self.base.id}&target={self.target.id}')
+        self.assertEqual(again.get_json(), result)
+
+    def test_compare_ndjson_and_etag(self):
+        url = f'/api/compare?base={self.target.id}&target={self.target.id}&format=ndjson'
+        response = self.client.get(url)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([r['type'] for r in records], ['comparison', 'summary'])
+
+        cached = self.client.get(url, headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(cached.status_code, 304)
+
+    def test_legacy_rows(self):
+        legacy = Repository(name='sample', url=URL, packaged_data={
+            'name': 'sample', 'url': URL, 'files': list(reversed(BASE_FILES)), 'commits': BASE_COMMITS,
+            'branches': ['main']})
+        db.session.add(legacy)
+        db.session.commit()
+        result = self.client.get(f'/api/compare?base={legacy.id}&target={self.base.id}').get_json()
+        # Legacy packages have no blob ids, so nothing counts as modified
+        self.assertEqual(result['files'], [])
+        self.assertEqual(result['commits'], [])
+
+    def test_rejects_bad_requests(self):
+        other = save_package({'name': 'other', 'url': 'https://github.com/test/other.git'}, [], [], [])
+        self.assertEqual(self.client.get(f'/api/compare?base={self.base.id}').status_code, 400)
+        self.assertEqual(self.client.get(f'/api/compare?base={self.base.id}&target=999').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/compare?base={self.base.id}&target={other.id}').status_code, 400)
+        response = self.client.get(f'/api/compare?base={self.base.id}&target={self.target.id}&format=xml')
+        self.assertEqual(response.status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import json
+import os
+import tempfile
+import unittest
+from flask import Flask
+from repolens.api import api_bp, init_app
+from repolens.context import count_tokens, order_files, split_chunks, TokenCache
+from repolens.models import db
+from repolens.packager import package_repository
+from gitfixtures import make_repo, git
+
+
+class TestPacking(unittest.TestCase):
+    def test_count_tokens(self):
+        self.assertEqual(count_tokens(b''), 0)
+        self.assertEqual(count_tokens(b'def main():\n    return 42\n'), 7)
+        # Long words are split, so no token covers more than 16 bytes
+        self.assertEqual(count_tokens(b'internationalization'), 3)
+
+    def test_token_cache(self):
+        cache = TokenCache(max_entries=2)
+        self.assertEqual(cache.count('a', b'one two'), 2)
+        self.assertEqual(cache.count('a', b'ignored'), 2)
+        cache.count('b', b'x')
+        cache.count('c', b'y')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.count('a', b'now counted'), 2)
+
+    def test_order_files(self):
+        paths = ['tests/test_app.py', 'docs/README.md', 'src/big.py', 'src/small.py', 'README.md',
+                 'logo.svg', 'setup.py', 'node_modules/x/index.js', 'poetry.lock', 'docs/guide.md']
+        files = [{'path': path, 'size': 100 if path == 'src/big.py' else 10} for path in paths]
+        included, dropped = order_files(files)
+        self.assertEqual([f['path'] for f in included], [
+            'README.md', 'setup.py', 'src/small.py', 'src/big.py', 'docs/README.md', 'docs/guide.md',
+            'tests/test_app.py', 'logo.svg'])
+        self.assertEqual([f['path'] for f in dropped], ['node_modules/x/index.js', 'poetry.lock'])
+
+    def test_split_chunks(self):
+        data = b''.join(b'line %d\n' % i for i in range(1, 11))
+        self.assertEqual(list(split_chunks(data, count_tokens(data), 100)), [(1, 10, 30, data)])
+        chunks = list(split_chunks(data, count_tokens(data), 12))
+        self.assertEqual([(start, end, tokens) for start, end, tokens, _ in chunks],
+                         [(1, 4, 12), (5, 8, 12), (9, 10, 6)])
+        self.assertEqual(b''.join(chunk for _, _, _, chunk in chunks), data)
+
+
+class TestContextEndpoint(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['REPOLENS_MIRROR_DIR'] = os.path.join(self.temp_dir.name, 'mirrors')
+        self.app.config['REPOLENS_SEARCH_DB'] = None
+        self.app.config['REPOLENS_SNAPSHOT_DIR'] = None
+        self.app.config['REPOLENS_ANALYSIS_CACHE_DB'] = None
+        self.app.config['REPOLENS_BLOB_DB'] = None
+        self.app.config['REPOLENS_SCAN_WORKERS'] = 1
+        self.app.config['REPOLENS_CONTEXT_WORKERS'] = 2
+        self.app.register_blueprint(api_bp)
+        init_app(self.app)
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.repo_path = make_repo(os.path.join(self.temp_dir.name, 'sample'), {
+            'README.md': '# Sample\n',
+            'main.py': 'from lib import run\nrun()\n',
+            'lib/__init__.py': 'def run():\n    print("run")\n',
+            'lib/copy.py': 'def run():\n    print("run")\n',
+            'lib/big.py': ''.join(f'value_{i} = {i}\n' for i in range(200)),
+            'package-lock.json': '{}\n',
+        })
+        with open(os.path.join(self.repo_path, 'logo.png'), 'wb') as f:
+            f.write(b'\x89PNG\x00\x01')
+        git(self.repo_path, 'add', 'logo.png')
+        git(self.repo_path, 'commit', '-q', '-m', 'Logo')
+        self.repo_id, error = package_repository(self.repo_path)
+        self.assertIsNone(error)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.temp_dir.cleanup()
+
+    def _context(self, **params):
+        response = self.client.get(f'/api/context/{self.repo_id}', query_string=params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    def test_packs_in_priority_order(self):
+        records = self._context(chunk_tokens=600)
+        self.assertEqual(records[0]['type'], 'context')
+        self.assertEqual([(r['type'], r['path']) for r in records[1:-1]], [
+            ('chunk', 'README.md'), ('chunk', 'main.py'), ('chunk', 'lib/__init__.py'),
+            ('duplicate', 'lib/copy.py'), ('chunk', 'lib/big.py'), ('chunk', 'lib/big.py')])
+        self.assertEqual(records[1]['content'], '# Sample\n')
+        self.assertEqual(records[4]['same_as'], 'lib/__init__.py')
+        big = [r for r in records if r.get('path') == 'lib/big.py']
+        self.assertEqual([(r['start_line'], r['end_line']) for r in big], [(1, 100), (101, 200)])
+
+        summary = records[-1]
+        self.assertEqual(summary['tokens'], sum(r['tokens'] for r in records if r['type'] == 'chunk'))
+        self.assertEqual(summary['files'], {'included': 4, 'duplicates': 1, 'skipped': {
+            'excluded': 1, 'unavailable': 0, 'binary': 1, 'too_large': 0, 'budget': 0}})
+
+    def test_budget_skips_files_that_do_not_fit(self):
+        records = self._context(budget=30)
+        self.assertEqual([r['path'] for r in records if r['type'] == 'chunk'],
+                         ['README.md', 'main.py', 'lib/__init__.py'])
+        summary = records[-1]
+        self.assertLessEqual(summary['tokens'], 30)
+        self.assertEqual(summary['files']['skipped']['budget'], 1)
+
+    def test_rejects_bad_requests(self):
+        self.assertEqual(self.client.get('/api/context/999').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/context/{self.repo_id}?budget=0').status_code, 400)
+        self.assertEqual(self.client.get(f'/api/context/{self.repo_id}?chunk_tokens=-1').status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import os
+import tempfile
+import unittest
+from flask import Flask
+from repolens.api import api_bp, init_app
+from repolens.dependencies import DependencyGraph, parse_manifest
+from repolens.models import RepositoryDependency, db
+from repolens.packager import package_repository
+from gitfixtures import make_repo, commit_files
+
+PYPROJECT = '''
+[project]
+name = "Sample_App"
+dependencies = ["Flask>=3.0", "requests[socks] (>=2.31) ; python_version >= '3.8'"]
+
+[project.optional-dependencies]
+zstd = ["zstandard"]
+
+[tool.poetry.group.test.dependencies]
+pytest = "^8.0"
+'''
+
+
+class TestParseManifest(unittest.TestCase):
+    def _dependencies(self, path, text):
+        manifest = parse_manifest(path, text)
+        return manifest['ecosystem'], manifest['package'], [
+            (d['name'], d['spec'], d['kind']) for d in manifest['dependencies']]
+
+    def test_pyproject(self):
+        self.assertEqual(self._dependencies('pyproject.toml', PYPROJECT), ('pypi', 'sample-app', [
+            ('flask', '>=3.0', 'runtime'), ('requests', '>=2.31', 'runtime'), ('zstandard', None, 'optional'),
+            ('pytest', '^8.0', 'dev')]))
+
+    def test_requirements(self):
+        text = ('# pinned\nDjango==5.0  # web\n-r base.txt\n-e .\ngit+https://example.com/x.git\n'
+                'pkg @ https://example.com/pkg.whl\nzope.interface\\\n  >=6\n')
+        self.assertEqual(self._dependencies('requirements-dev.txt', text), ('pypi', None, [
+            ('django', '==5.0', 'dev'), ('pkg', '@ https://example.com/pkg.whl', 'dev'),
+            ('zope-interface', '>=6', 'dev')]))
+        self.assertIsNotNone(parse_manifest('requirements/base.txt', 'six'))
+
+    def test_package_json(self):
+        text = '{"name": "@acme/ui", "dependencies": {"React": "^18"}, "devDependencies": {"jest": "29"}}'
+        self.assertEqual(self._dependencies('web/package.json', text), ('npm', '@acme/ui', [
+            ('react', '^18', 'runtime'), ('jest', '29', 'dev')]))
+
+    def test_go_mod(self):
+        text = ('module example.com/app\n\ngo 1.22\n\nrequire github.com/pkg/errors v0.9.1\n'
+                'require (\n\tgolang.org/x/text v0.14.0 // indirect\n\tgithub.com/google/uuid v1.6.0\n)\n')
+        self.assertEqual(self._dependencies('go.mod', text), ('go', 'example.com/app', [
+            ('github.com/pkg/errors', 'v0.9.1', 'runtime'), ('golang.org/x/text', 'v0.14.0', 'indirect'),
+            ('github.com/google/uuid', 'v1.6.0', 'runtime')]))
+
+    def test_cargo(self):
+        text = ('[package]\nname = "my_crate"\n[dependencies]\nserde = { version = "1", features = ["derive"] }\n'
+                'rand_core = "0.6"\nweb = { package = "actix-web", version = "4" }\n'
+                '[target.\'cfg(unix)\'.dev-dependencies]\nnix = "0.27"\n')
+        self.assertEqual(self._dependencies('Cargo.toml', text), ('cargo', 'my-crate', [
+            ('serde', '1', 'runtime'), ('rand-core', '0.6', 'runtime'), ('actix-web', '4', 'runtime'),
+            ('nix', '0.27', 'dev')]))
+
+    def test_skipped_files(self):
+        self.assertIsNone(parse_manifest('node_modules/react/package.json', '{"name": "react"}'))
+        self.assertIsNone(parse_manifest('src/app.py', 'import os'))
+        self.assertIsNone(parse_manifest('package.json', '{not json'))
+        self.assertIsNone(parse_manifest('pyproject.toml', '[project]\ndependencies = "flask"\nname = 1 = 2'))
+
+
+class TestDependencyGraph(unittest.TestCase):
+    def test_newer_snapshot_replaces_older(self):
+        graph = DependencyGraph()
+        graph.add(1, 'app', 'u/app', [(('pypi', 'flask'), None, 'runtime', 'requirements.txt')], [])
+        graph.add(2, 'app', 'u/app', [(('pypi', 'django'), None, 'runtime', 'requirements.txt')], [])
+        graph.add(0, 'app', 'u/app', [(('pypi', 'six'), None, 'runtime', 'requirements.txt')], [])
+        self.assertEqual(graph.dependents_of([('pypi', 'flask')]), [])
+        self.assertEqual([d['repository']['id'] for d in graph.dependents_of([('pypi', 'django')])], [2])
+        self.assertEqual(graph.dependents_of([('pypi', 'six')]), [])
+
+
+class TestDependencyApi(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['REPOLENS_MIRROR_DIR'] = os.path.join(self.temp_dir.name, 'mirrors')
+        self.app.config['REPOLENS_SEARCH_DB'] = None
+        self.app.config['REPOLENS_SNAPSHOT_DIR'] = None
+        self.app.config['REPOLENS_ANALYSIS_CACHE_DB'] = None
+        self.app.config['REPOLENS_BLOB_DB'] = None
+        self.app.config['REPOLENS_SCAN_WORKERS'] = 1
+        self.app.register_blueprint(api_bp)
+        init_app(self.app)
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        # core <- lib <- app: app requires lib, which requires core
+        self.core = self._package('core', {'pyproject.toml': '[project]\nname = "core"\ndependencies = ["numpy"]\n'})
+        self.lib = self._package('lib', {'pyproject.toml': '[project]\nname = "acme-lib"\ndependencies = ["Core>=1"]\n',
+                                         'node_modules/x/package.json': '{"dependencies": {"core": "1"}}'})
+        self.app_path = make_repo(os.path.join(self.temp_dir.name, 'app'),
+                                  {'requirements.txt': 'acme_lib==2.0\nflask\n', 'README.md': '# App\n'})
+        self.app_id = self._package(self.app_path)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.temp_dir.cleanup()
+
+    def _package(self, name_or_path, files=None):
+        path = name_or_path if files is None else make_repo(os.path.join(self.temp_dir.name, name_or_path), files)
+        repo_id, error = package_repository(path)
+        self.assertIsNone(error)
+        return repo_id
+
+    def _dependents(self, **params):
+        response = self.client.get('/api/dependents', query_string=params)
+        self.assertEqual(response.status_code, 200)
+        return [(d['repository']['id'], d['depth'], d['via']['name']) for d in response.get_json()['dependents']]
+
+    def test_dependencies_of_a_snapshot(self):
+        data = self.client.get(f'/api/dependencies/{self.lib}').get_json()
+        self.assertEqual(data['packages'], [{'manifest': 'pyproject.toml', 'ecosystem': 'pypi', 'name': 'acme-lib'}])
+        self.assertEqual(data['dependencies'], [{'manifest': 'pyproject.toml', 'ecosystem': 'pypi', 'name': 'core',
+                                                 'spec': '>=1', 'kind': 'runtime'}])
+
+        data = self.client.get(f'/api/dependencies/{self.app_id}', query_string={'transitive': 1}).get_json()
+        self.assertEqual([(d['name'], d['depth']) for d in data['transitive']],
+                         [('acme-lib', 1), ('flask', 1), ('core', 2), ('numpy', 3)])
+        self.assertEqual(data['transitive'][0]['published_by'][0]['id'], self.lib)
+        self.assertEqual(self.client.get('/api/dependencies/999').status_code, 404)
+
+    def test_dependents(self):
+        self.assertEqual(self._dependents(name='core', ecosystem='pypi'), [(self.lib, 1, 'core')])
+        self.assertEqual(self._dependents(name='numpy', transitive='1'),
+                         [(self.core, 1, 'numpy'), (self.lib, 2, 'core'), (self.app_id, 3, 'acme-lib')])
+        self.assertEqual(self._dependents(name='numpy', transitive='1', max_depth=2),
+                         [(self.core, 1, 'numpy'), (self.lib, 2, 'core')])
+        self.assertEqual(self.client.get('/api/dependents').status_code, 400)
+        self.assertEqual(self.client.get('/api/dependents?name=x&ecosystem=maven').status_code, 400)
+
+    def test_new_snapshots_and_deletes_update_the_graph(self):
+        self.assertEqual(self._dependents(name='flask'), [(self.app_id, 1, 'flask')])
+        commit_files(self.app_path, {'requirements.txt': 'acme_lib==2.0\ndjango\n'}, 'Switch to Django')
+        new_id = self._package(self.app_path)
+        self.assertEqual(self._dependents(name='flask'), [])
+        self.assertEqual(self._dependents(name='django'), [(new_id, 1, 'django')])
+        # The unchanged manifests of an incremental snapshot are copied over
+        self.assertEqual(RepositoryDependency.query.filter_by(repository_id=new_id).count(), 2)
+
+        self.client.delete(f'/api/repository/{new_id}')
+        self.assertEqual(self._dependents(name='flask'), [(self.app_id, 1, 'flask')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from flask import Flask
+from repolens import analyzer
+from repolens.api import init_app
+from repolens.analyzer import run_analyses
+from repolens.history import History, weekly_histogram, weekly_churn, contributors, bus_factor, rolling_mean
+from repolens.models import Analysis, Repository, RepositoryCommit, db
+from repolens.packager import extract_commits, package_repository
+from repolens.storage import save_package
+from gitfixtures import make_repo, commit_files, git
+
+COMMITS = [
+    {'hash': 'd', 'author': 'Ann', 'date': '2024-01-30T10:00:00+00:00', 'insertions': 2, 'deletions': 2},
+    {'hash': 'c', 'author': 'Cy', 'date': '2024-01-10T09:00:00-05:00', 'insertions': 1, 'deletions': 0},
+    {'hash': 'b', 'author': 'Bo', 'date': '2024-01-09T10:00:00+00:00', 'insertions': None, 'deletions': None},
+    {'hash': 'a', 'author': 'Ann', 'date': '2024-01-01T01:00:00+02:00', 'insertions': 5, 'deletions': 1},
+]
+
+
+class TestHistoryArrays(unittest.TestCase):
+    def setUp(self):
+        self.history = History.from_commits(COMMITS)
+
+    def test_weekly_histogram(self):
+        result = weekly_histogram(self.history)
+        # 2024-01-01T01:00+02:00 is still Sunday 2023-12-31 in UTC
+        self.assertEqual(result['weeks'], ['2023-12-25', '2024-01-01', '2024-01-08', '2024-01-15',
+                                           '2024-01-22', '2024-01-29'])
+        self.assertEqual(result['commits'], [1, 0, 2, 0, 0, 1])
+        self.assertEqual(result['rolling_mean']['4'], [1.0, 0.5, 1.0, 0.75, 0.5, 0.75])
+        self.assertEqual(result['summary']['busiest_week'], '2024-01-08')
+        self.assertEqual(result['summary']['active_weeks'], 3)
+
+    def test_weekly_churn_skips_unmeasured_commits(self):
+        result = weekly_churn(self.history)
+        self.assertEqual((result['commits_measured'], result['commits_unmeasured']), (3, 1))
+        self.assertEqual(result['insertions'], [5, 0, 1, 0, 0, 2])
+        self.assertEqual((result['total_insertions'], result['total_deletions']), (8, 3))
+
+    def test_contributors(self):
+        result = contributors(self.history, top=2)
+        self.assertEqual(result['total_authors'], 3)
+        ann, second = result['contributors']
+        self.assertEqual((ann['author'], ann['commits'], ann['active_weeks']), ('Ann', 2, 2))
+        self.assertEqual((ann['first_commit'], ann['last_commit']),
+                         ('2023-12-31T23:00:00+00:00', '2024-01-30T10:00:00+00:00'))
+        self.assertEqual((ann['insertions'], ann['deletions']), (7, 3))
+        # Ties are broken by name
+        self.assertEqual(second['author'], 'Bo')
+
+    def test_bus_factor(self):
+        result = bus_factor(self.history)
+        self.assertEqual(result['commits'], {'bus_factor': 1, 'authors': ['Ann']})
+        self.assertEqual(result['lines']['bus_factor'], 1)
+        self.assertEqual(bus_factor(self.history, threshold=0.75)['commits']['bus_factor'], 2)
+
+    def test_rolling_mean(self):
+        self.assertEqual(rolling_mean([2, 4, 6, 8], 2).tolist(), [2.0, 3.0, 5.0, 7.0])
+
+    def test_empty_history(self):
+        empty = History.from_commits([])
+        self.assertEqual(weekly_histogram(empty)['commits'], [])
+        self.assertEqual(contributors(empty), {'total_authors': 0, 'contributors': []})
+        self.assertEqual(bus_factor(empty)['commits']['bus_factor'], 0)
+
+
+class TestHistoryAnalyses(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['REPOLENS_MIRROR_DIR'] = os.path.join(self.temp_dir.name, 'mirrors')
+        self.app.config['REPOLENS_SEARCH_DB'] = os.path.join(self.temp_dir.name, 'search.db')
+        self.app.config['REPOLENS_SNAPSHOT_DIR'] = os.path.join(self.temp_dir.name, 'snapshots')
+        self.app.config['REPOLENS_ANALYSIS_CACHE_DB'] = None
+        self.app.config['REPOLENS_BLOB_DB'] = None
+        self.app.config['REPOLENS_SCAN_WORKERS'] = 1
+        init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.temp_dir.cleanup()
+
+    def test_snapshot_and_row_results_agree(self):
+        commits = [dict(c, message='') for c in COMMITS]
+        types = ['contributors', 'commit_frequency', 'churn', 'bus_factor']
+        first = save_package({'name': 'h', 'url': 'https://github.com/test/h.git'}, [], commits, [])
+        second = save_package({'name': 'h', 'url': 'https://github.com/test/h.git'}, [], commits, [])
+
+        columnar = run_analyses(first.id, types)
+        with mock.patch.object(analyzer, 'get_snapshot_store', return_value=None):
+            rows = run_analyses(second.id, types)
+        for analysis_type in types:
+            self.assertEqual(db.session.get(Analysis, columnar[analysis_type]).result,
+                             db.session.get(Analysis, rows[analysis_type]).result)
+        self.assertEqual(db.session.get(Analysis, columnar['churn']).result['total_insertions'], 8)
+
+    def test_packaging_records_commit_stats(self):
+        repo_path = make_repo(os.path.join(self.temp_dir.name, 'sample'), {'a.txt': 'one\ntwo\n'})
+        with open(os.path.join(repo_path, 'logo.bin'), 'wb') as f:
+            f.write(b'\x00\x01')
+        git(repo_path, 'add', 'logo.bin')
+        git(repo_path, 'commit', '-q', '-m', 'Add binary')
+        commit_files(repo_path, {'a.txt': 'one\n2\nthree\n'}, 'Edit')
+        git(repo_path, 'commit', '-q', '--allow-empty', '-m', 'Empty')
+
+        stats = [(c['insertions'], c['deletions'], c['files_changed'])
+                 for c in extract_commits(os.path.join(repo_path, '.git'), stats=True)]
+        self.assertEqual(stats, [(0, 0, 0), (2, 1, 1), (0, 0, 1), (2, 0, 1)])
+
+        repo_id, error = package_repository(repo_path)
+        self.assertIsNone(error)
+        rows = RepositoryCommit.query.filter_by(repository_id=repo_id).order_by(RepositoryCommit.position)
+        self.assertEqual([(c.insertions, c.deletions, c.files_changed) for c in rows], stats)
+
+    def test_shallow_boundary_has_no_stats(self):
+        repo_path = make_repo(os.path.join(self.temp_dir.name, 'sample'), {'a.txt': 'one\n'})
+        commit_files(repo_path, {'a.txt': 'one\ntwo\n'}, 'Second')
+        commit_files(repo_path, {'a.txt': 'one\ntwo\nthree\n'}, 'Third')
+
+        repo_id, error = package_repository('file://' + repo_path, depth=2)
+        self.assertIsNone(error)
+        rows = RepositoryCommit.query.filter_by(repository_id=repo_id).order_by(RepositoryCommit.position)
+        self.assertEqual([c.insertions for c in rows], [1, None])
+
+    def _hotspots(self, repo_id):
+        return db.session.get(Analysis, run_analyses(repo_id, ['hotspots'])['hotspots']).result
+
+    def test_hotspots(self):
+        repo_path = make_repo(os.path.join(self.temp_dir.name, 'sample'),
+                              {'a.py': '1\n', 'b.py': '1\n', 'gone.py': '1\n'})
+        commit_files(repo_path, {'a.py': '1\n2\n', 'gone.py': None}, 'Edit a', author='Bo <bo@example.com>')
+        commit_files(repo_path, {'a.py': '1\n2\n3\n', 'b.py': '2\n'}, 'Edit both')
+        repo_id, error = package_repository(repo_path)
+        self.assertIsNone(error)
+
+        result = self._hotspots(repo_id)
+        self.assertEqual((result['files'], result['total_changes']), (2, 5))
+        top = result['hotspots'][0]
+        self.assertEqual({key: top[key] for key in ('path', 'changes', 'authors', 'insertions', 'deletions',
+                                                    'top_author')},
+                         {'path': 'a.py', 'changes': 3, 'authors': 2, 'insertions': 3, 'deletions': 0,
+                          'top_author': 'Test Author'})
+        self.assertEqual([(h['path'], h['changes'], h['authors']) for h in result['hotspots']],
+                         [('a.py', 3, 2), ('b.py', 2, 1)])
+
+        # An incremental snapshot merges the new commits into the copied history
+        commit_files(repo_path, {'b.py': '3\n', 'c.py': '1\n'}, 'More', author='Cy <cy@example.com>')
+        commit_files(repo_path, {'a.py': None}, 'Drop a')
+        incremental, _ = package_repository(repo_path)
+        full, _ = package_repository(repo_path, incremental=False)
+        self.assertEqual(db.session.get(Repository, incremental).packaged_data['head'],
+                         db.session.get(Repository, full).packaged_data['head'])
+        result = self._hotspots(incremental)
+        self.assertEqual([(h['path'], h['changes'], h['authors']) for h in result['hotspots']],
+                         [('b.py', 3, 2), ('c.py', 1, 1)])
+        self.assertEqual(result, self._hotspots(full))
+
+    def test_hotspots_without_history(self):
+        repository = save_package({'name': 'h', 'url': 'https://github.com/test/h.git'},
+                                  [{'path': 'a.py', 'size': 1}], [dict(c, message='') for c in COMMITS], [])
+        self.assertEqual(self._hotspots(repository.id), {'files': 0, 'total_changes': 0, 'hotspots': []})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import os
+import tempfile
+import time
+import unittest
+from flask import Flask
+from repolens.api import api_bp, init_app
+from repolens.jobs import JobStore, JobQueue, Progress, JobTimeout, job_handler, get_queue, DONE, FAILED, QUEUED
+from repolens.models import Repository
+from repolens.database import db
+from gitfixtures import make_repo
+
+
+@job_handler('test_sleep')
+def _sleep_job(params, progress):
+    time.sleep(params['seconds'])
+    return {'slept': params['seconds']}
+
+
+class TestJobStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = JobStore(os.path.join(self.temp_dir.name, 'jobs.db'))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_claim_is_fifo_and_exclusive(self):
+        first = self.store.enqueue('package', {'n': 1})
+        second = self.store.enqueue('package', {'n': 2})
+
+        self.assertEqual(self.store.claim()['id'], first)
+        self.assertEqual(self.store.claim()['id'], second)
+        self.assertIsNone(self.store.claim())
+
+    def test_expired_job_keeps_timeout_error(self):
+        job_id = self.store.enqueue('package', {}, timeout=0.01)
+        self.store.claim()
+        time.sleep(0.05)
+        self.store.expire()
+        self.store.finish(job_id, {'repo_id': 1})
+
+        job = self.store.get(job_id)
+        self.assertEqual(job['status'], FAILED)
+        self.assertEqual(job['error'], 'Job timed out')
+        self.assertIsNone(job['result'])
+
+    def test_progress_raises_after_deadline(self):
+        job_id = self.store.enqueue('package', {})
+        self.store.claim()
+        progress = Progress(self.store, job_id, timeout=0.01)
+        progress('files', files=3)
+        self.assertEqual(self.store.get(job_id)['progress'], {'stage': 'files', 'files': 3})
+
+        time.sleep(0.05)
+        with self.assertRaises(JobTimeout):
+            progress(files=4)
+
+    def test_only_jobs_with_expired_leases_are_requeued(self):
+        live = self.store.enqueue('package', {'n': 1})
+        dead = self.store.enqueue('package', {'n': 2})
+        self.store.claim('other-host:1')
+        self.store.claim('other-host:2')
+        time.sleep(0.05)
+        self.store.heartbeat('other-host:1')
+
+        self.store.requeue_expired(0.04)
+        self.assertEqual(self.store.get(live)['status'], 'running')
+        self.assertEqual(self.store.get(dead)['status'], QUEUED)
+
+        # The worker that lost its lease cannot complete the job it gave up
+        self.assertEqual(self.store.claim('this-host:1')['id'], dead)
+        self.store.finish(dead, {'repo_id': 1}, 'other-host:2')
+        self.assertEqual(self.store.get(dead)['status'], 'running')
+        self.store.finish(dead, {'repo_id': 1}, 'this-host:1')
+        self.assertEqual(self.store.get(dead)['status'], DONE)
+
+    def test_starting_a_queue_leaves_jobs_running_elsewhere(self):
+        job_id = self.store.enqueue('package', {})
+        self.store.claim('other-host:1')
+
+        queue = JobQueue(Flask(__name__), self.store, max_workers=0, lease=60)
+        queue.start()
+        self.assertEqual(self.store.get(job_id)['status'], 'running')
+
+
+class TestPackageJobs(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        self.app.config['REPOLENS_MIRROR_DIR'] = os.path.join(self.temp_dir.name, 'mirrors')
+        self.app.config['REPOLENS_JOBS_DB'] = os.path.join(self.temp_dir.name, 'jobs.db')
+        self.app.config['REPOLENS_SEARCH_DB'] = os.path.join(self.temp_dir.name, 'search.db')
+        self.app.config['REPOLENS_SNAPSHOT_DIR'] = None
+        self.app.config['REPOLENS_BLOB_DB'] = None
+        self.app.config['REPOLENS_JOB_WORKERS'] = 0
+        self.app.register_blueprint(api_bp, url_prefix='/api')
+        init_app(self.app)
+
+        with self.app.app_context():
+            db.create_all()
+
+        self.client = self.app.test_client()
+        self.repo_path = make_repo(os.path.join(self.temp_dir.name, 'sample'))
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        self.temp_dir.cleanup()
+
+    def test_package_returns_job_and_completes(self):
+        response = self.client.post('/api/package', json={'repo_url': self.repo_path})
+        self.assertEqual(response.status_code, 202)
+        job_id = response.get_json()['job_id']
+        self.assertTrue(response.headers['Location'].endswith(f'/api/jobs/{job_id}'))
+
+        self.assertEqual(self.client.get(f'/api/jobs/{job_id}').get_json()['status'], QUEUED)
+
+        get_queue(self.app).run_pending()
+
+        data = self.client.get(f'/api/jobs/{job_id}').get_json()
+        self.assertEqual(data['status'], DONE)
+        self.assertEqual(data['result']['repo_name'], 'sample')
+        self.assertGreater(data['progress']['commits'], 0)
+        with self.app.app_context():
+            repository = db.session.get(Repository, data['result']['repo_id'])
+            self.assertEqual(repository.url, self.repo_path)
+
+    def test_failed_clone_marks_job_failed(self):
+        response = self.client.post('/api/package', json={'repo_url': os.path.join(self.temp_dir.name, 'missing')})
+        job_id = response.get_json()['job_id']
+
+        get_queue(self.app).run_pending()
+
+        data = self.client.get(f'/api/jobs/{job_id}').get_json()
+        self.assertEqual(data['status'], FAILED)
+        self.assertIn('Error cloning repository', data['error'])
+
+    def test_unknown_job(self):
+        response = self.client.get('/api/jobs/doesnotexist')
+        self.assertEqual(response.status_code, 404)
+
+    def test_worker_pool_respects_concurrency_limit(self):
+        queue = JobQueue(self.app, get_queue(self.app).store, max_workers=2, poll_interval=0.05)
+        job_ids = [queue.submit('test_sleep', {'seconds': 0.3}) for _ in range(4)]
+        try:
+            time.sleep(0.15)
+            statuses = [queue.get(job_id)['status'] for job_id in job_ids]
+            self.assertEqual(statuses.count('running'), 2)
+
+            deadline = time.time() + 5
+            while time.time() < deadline and any(queue.get(j)['status'] != DONE for j in job_ids):
+                time.sleep(0.05)
+            self.assertTrue(all(queue.get(j)['status'] == DONE for j in job_ids))
+        finally:
+            queue.stop()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import os
+import tempfile
+import unittest
+from flask import Flask
+from repolens.api import init_app
+from repolens.analyzer import analyze_repository
+from repolens.loc import LineCounter, count_lines, detect_language, scan_files
+from repolens.models import Analysis, RepositoryFile, db
+from repolens.packager import package_repository
+from gitfixtures import make_repo, commit_files, git
+
+C_SOURCE = b"""// header
+#include <stdio.h>
+
+/* block
+   comment */
+int main(void) { /* trailing
+   still comment */
+    return 0; /* inline */
+}
+"""
+
+
+class TestLineCounter(unittest.TestCase):
+    def test_counts_code_comments_and_blanks(self):
+        stats = count_lines([C_SOURCE], 'C')
+        self.assertEqual(stats, {'binary': False, 'lines': 9, 'code_lines': 4, 'comment_lines': 4,
+                                 'blank_lines': 1})
+
+    def test_result_does_not_depend_on_chunking(self):
+        chunked = count_lines([C_SOURCE[i:i + 3] for i in range(0, len(C_SOURCE), 3)], 'C')
+        self.assertEqual(chunked, count_lines([C_SOURCE], 'C'))
+
+    def test_last_line_without_newline(self):
+        stats = count_lines([b'# comment\nx = 1'], 'Python')
+        self.assertEqual((stats['lines'], stats['code_lines'], stats['comment_lines']), (2, 1, 1))
+
+    def test_binary_detection(self):
+        counter = LineCounter('C')
+        counter.feed(b'text\n' * 10)
+        counter.feed(b'\x00\x01')
+        self.assertTrue(counter.close()['binary'])
+        # NUL bytes past the sniffed prefix do not make a file binary
+        self.assertFalse(count_lines([b'a' * 9000, b'\x00'])['binary'])
+
+    def test_detect_language(self):
+        self.assertEqual(detect_language('src/app.PY'), 'Python')
+        self.assertEqual(detect_language('docker/Dockerfile'), 'Dockerfile')
+        self.assertIsNone(detect_language('LICENSE'))
+
+
+class TestScanning(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['REPOLENS_MIRROR_DIR'] = os.path.join(self.temp_dir.name, 'mirrors')
+        self.app.config['REPOLENS_SEARCH_DB'] = os.path.join(self.temp_dir.name, 'search.db')
+        self.app.config['REPOLENS_SNAPSHOT_DIR'] = None
+        self.app.config['REPOLENS_JOBS_DB'] = os.path.join(self.temp_dir.name, 'jobs.db')
+        self.app.config['REPOLENS_ANALYSIS_CACHE_DB'] = None
+        self.app.config['REPOLENS_BLOB_DB'] = None
+        self.app.config['REPOLENS_SCAN_WORKERS'] = 1
+        init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.repo_path = make_repo(os.path.join(self.temp_dir.name, 'sample'), {
+            'main.c': C_SOURCE.decode(),
+            'app.py': '# app\n\nprint(1)\n',
+            'copy.py': '# app\n\nprint(1)\n',
+        })
+        with open(os.path.join(self.repo_path, 'logo.png'), 'wb') as f:
+            f.write(b'\x89PNG\r\n\x1a\n\x00\x00')
+        git(self.repo_path, 'add', 'logo.png')
+        git(self.repo_path, 'commit', '-q', '-m', 'Add logo')
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.temp_dir.cleanup()
+
+    def _files(self, repo_id):
+        return {f.path: f for f in RepositoryFile.query.filter_by(repository_id=repo_id)}
+
+    def test_parallel_scan_matches_serial(self):
+        git_dir = os.path.join(self.repo_path, '.git')
+        listing = git(self.repo_path, 'ls-tree', '-r', 'HEAD').splitlines()
+        files = [{'path': line.split('\t')[1], 'blob': line.split()[2]} for line in listing]
+        serial = scan_files(git_dir, [dict(f) for f in files])
+        parallel = scan_files(git_dir, [dict(f) for f in files], workers=2, batch_size=1)
+        self.assertEqual(serial, parallel)
+
+    def test_package_stores_line_statistics(self):
+        repo_id, error = package_repository(self.repo_path)
+        self.assertIsNone(error)
+
+        files = self._files(repo_id)
+        self.assertEqual((files['main.c'].language, files['main.c'].code_lines), ('C', 4))
+        self.assertEqual((files['app.py'].lines, files['app.py'].comment_lines), (3, 1))
+        self.assertTrue(files['logo.png'].binary)
+        self.assertIsNone(files['logo.png'].lines)
+
+        analysis = db.session.get(Analysis, analyze_repository(repo_id, 'lines_of_code'))
+        self.assertEqual(analysis.result['total_lines'], 15)
+        self.assertEqual(analysis.result['binary_files'], 1)
+        self.assertEqual(analysis.result['unscanned_files'], 0)
+        self.assertEqual(analysis.result['languages']['Python'], {
+            'files': 2, 'lines': 6, 'code_lines': 2, 'comment_lines': 2, 'blank_lines': 2})
+
+    def test_incremental_package_scans_only_changes(self):
+        first_id, _ = package_repository(self.repo_path)
+        commit_files(self.repo_path, {'app.py': 'print(1)\nprint(2)\n', 'copy.py': None}, 'Edit')
+        second_id, _ = package_repository(self.repo_path)
+
+        files = self._files(second_id)
+        self.assertNotIn('copy.py', files)
+        self.assertEqual((files['app.py'].lines, files['app.py'].code_lines), (2, 2))
+        self.assertEqual(files['main.c'].lines, self._files(first_id)['main.c'].lines)
+
+    def test_partial_clone_is_not_scanned(self):
+        git(self.repo_path, 'config', 'uploadpack.allowFilter', 'true')
+        repo_id, error = package_repository('file://' + self.repo_path, partial=True)
+        self.assertIsNone(error)
+
+        analysis = db.session.get(Analysis, analyze_repository(repo_id, 'lines_of_code'))
+        self.assertEqual(analysis.result['unscanned_files'], 4)
+        self.assertEqual(analysis.result['languages'], {})
+
+if __name__ == '__main__':
+    unittest.main()
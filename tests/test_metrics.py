@@ -0,0 +1,108 @@
+import os
+import pstats
+import tempfile
+import unittest
+from flask import Flask
+from repolens.api import api_bp, init_app
+from repolens.metrics import Histogram, get_metrics, span
+from repolens.models import db
+from repolens.packager import package_repository
+from gitfixtures import make_repo
+
+
+class TestHistogram(unittest.TestCase):
+    def test_render(self):
+        histogram = Histogram('demo_seconds', 'Demo.', ('stage',), buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.5, 3):
+            histogram.observe(value, 'clone')
+        histogram.observe(0.1, 'say "hi"')
+        self.assertEqual(histogram.render(), [
+            '# HELP demo_seconds Demo.',
+            '# TYPE demo_seconds histogram',
+            'demo_seconds_bucket{stage="clone",le="0.1"} 1',
+            'demo_seconds_bucket{stage="clone",le="1.0"} 3',
+            'demo_seconds_bucket{stage="clone",le="+Inf"} 4',
+            'demo_seconds_sum{stage="clone"} 4.05',
+            'demo_seconds_count{stage="clone"} 4',
+            'demo_seconds_bucket{stage="say \\"hi\\"",le="0.1"} 1',
+            'demo_seconds_bucket{stage="say \\"hi\\"",le="1.0"} 1',
+            'demo_seconds_bucket{stage="say \\"hi\\"",le="+Inf"} 1',
+            'demo_seconds_sum{stage="say \\"hi\\""} 0.1',
+            'demo_seconds_count{stage="say \\"hi\\""} 1',
+        ])
+
+    def test_span_without_app_is_a_no_op(self):
+        with span('package', 'clone'):
+            pass
+        self.assertIsNone(get_metrics())
+
+
+class MetricsTestCase(unittest.TestCase):
+    config = {}
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['REPOLENS_MIRROR_DIR'] = os.path.join(self.temp_dir.name, 'mirrors')
+        self.app.config['REPOLENS_SEARCH_DB'] = None
+        self.app.config['REPOLENS_SNAPSHOT_DIR'] = None
+        self.app.config['REPOLENS_ANALYSIS_CACHE_DB'] = None
+        self.app.config['REPOLENS_BLOB_DB'] = None
+        self.app.config['REPOLENS_SCAN_WORKERS'] = 1
+        self.app.config['REPOLENS_PROFILE_DIR'] = os.path.join(self.temp_dir.name, 'profiles')
+        self.app.config.update(self.config)
+        self.app.register_blueprint(api_bp)
+        init_app(self.app)
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.temp_dir.cleanup()
+
+
+class TestMetricsEndpoint(MetricsTestCase):
+    def test_records_packaging_and_analysis_stages(self):
+        repo_id, error = package_repository(make_repo(os.path.join(self.temp_dir.name, 'sample')))
+        self.assertIsNone(error)
+        response = self.client.post('/api/analyze', json={'repo_id': repo_id, 'analysis_type': 'file_count'})
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        text = response.get_data(as_text=True)
+        for stage in ('clone', 'files', 'scan', 'commits', 'branches', 'save'):
+            self.assertIn(f'repolens_stage_duration_seconds_count{{operation="package",stage="{stage}"}} 1', text)
+        self.assertIn('repolens_operation_duration_seconds_count{operation="package"} 1', text)
+        self.assertIn('repolens_stage_duration_seconds_count{operation="analyze",stage="compute"} 1', text)
+        self.assertIn('repolens_request_duration_seconds_count{method="POST",endpoint="api.analyze",status="201"} 1',
+                      text)
+
+    def test_profile_header_dumps_stats(self):
+        self.assertNotIn('X-Repolens-Profile', self.client.get('/api/repository/1').headers)
+        response = self.client.get('/api/repository/1', headers={'X-Repolens-Profile': '1'})
+        self.assertEqual(response.status_code, 404)
+        name = response.headers['X-Repolens-Profile']
+        self.assertTrue(name.endswith('-api.get_repository.prof'))
+        stats = pstats.Stats(os.path.join(self.app.config['REPOLENS_PROFILE_DIR'], name))
+        self.assertTrue(stats.total_calls)
+
+
+class TestMetricsDisabled(MetricsTestCase):
+    config = {'REPOLENS_METRICS': False, 'REPOLENS_PROFILE_DIR': None}
+
+    def test_disabled(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        self.assertIsNone(get_metrics())
+        self.assertEqual(self.app.before_request_funcs, {})
+        repo_id, error = package_repository(make_repo(os.path.join(self.temp_dir.name, 'sample')))
+        self.assertIsNone(error)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,33 +1,214 @@
+import os
+import tempfile
 import unittest
-from repolens.packager import package_repository
+from flask import Flask
+from repolens.api import init_app
+from repolens.packager import package_repository, extract_commits
+import git as gitpython
 from repolens.models import Repository, db
-from main import app
+from repolens.storage import load_package
+from gitfixtures import make_repo, commit_files, git
 
-class TestPackager(unittest.TestCase):
+class PackagerTestCase(unittest.TestCase):
     def setUp(self):
-        self.app = app.test_client()
-        self.app_context = app.app_context()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['REPOLENS_MIRROR_DIR'] = os.path.join(self.temp_dir.name, 'mirrors')
+        self.app.config['REPOLENS_SEARCH_DB'] = os.path.join(self.temp_dir.name, 'search.db')
+        self.app.config['REPOLENS_SNAPSHOT_DIR'] = None
+        self.app.config['REPOLENS_BLOB_DB'] = None
+        self.app.config['REPOLENS_JOBS_DB'] = os.path.join(self.temp_dir.name, 'jobs.db')
+        init_app(self.app)
+        self.app_context = self.app.app_context()
         self.app_context.push()
         db.create_all()
 
+        self.repo_path = make_repo(os.path.join(self.temp_dir.name, 'sample'), {
+            'README.md': '# Sample\n',
+            'src/app.py': 'print("hi")\n',
+            'src/old.py': 'pass\n',
+        })
+
     def tearDown(self):
         db.session.remove()
         db.drop_all()
         self.app_context.pop()
+        self.temp_dir.cleanup()
+
+    def _package(self, url=None, **kwargs):
+        repo_id, error = package_repository(url or self.repo_path, **kwargs)
+        self.assertIsNone(error)
+        return load_package(db.session.get(Repository, repo_id))
 
+class TestPackager(PackagerTestCase):
     def test_package_repository(self):
-        repo_url = 'https://github.com/psf/requests.git'
-        repo_id = package_repository(repo_url)
+        # A local fixture keeps the test offline
+        repo_id, error = package_repository(self.repo_path)
 
+        self.assertIsNone(error)
         self.assertIsNotNone(repo_id)
-        
-        repository = Repository.query.get(repo_id)
+
+        repository = db.session.get(Repository, repo_id)
         self.assertIsNotNone(repository)
-        self.assertEqual(repository.url, repo_url)
+        self.assertEqual(repository.url, self.repo_path)
         self.assertIsNotNone(repository.packaged_data)
-        self.assertIn('files', repository.packaged_data)
-        self.assertIn('commits', repository.packaged_data)
-        self.assertIn('branches', repository.packaged_data)
+        package = load_package(repository)
+        self.assertIn('files', package)
+        self.assertIn('commits', package)
+        self.assertIn('branches', package)
+
+class TestIncrementalPackaging(PackagerTestCase):
+    def test_full_package_excludes_git_internals(self):
+        data = self._package()
+        self.assertEqual([f['path'] for f in data['files']], ['README.md', 'src/app.py', 'src/old.py'])
+        self.assertEqual(data['head'], git(self.repo_path, 'rev-parse', 'HEAD').strip())
+        self.assertEqual(len(data['commits']), 1)
+        self.assertEqual(data['branches'], ['main'])
+
+    def test_tree_listing_matches_checkout(self):
+        commit_files(self.repo_path, {'a.b': 'x\n', 'a/b.txt': 'yy\n', 'a0': 'zzz\n'}, 'Tricky paths')
+
+        tree = self._package(incremental=False)
+        checkout = self._package(incremental=False, listing='checkout')
+        self.assertEqual(tree['files'], checkout['files'])
+
+    def test_invalid_listing_mode(self):
+        repo_id, error = package_repository(self.repo_path, listing='nope')
+        self.assertIsNone(repo_id)
+        self.assertEqual(error, 'Invalid listing mode: nope')
+
+    def test_repackage_applies_only_changes(self):
+        first = self._package()
+        head = commit_files(self.repo_path, {
+            'src/app.py': 'print("hello world")\n',
+            'src/old.py': None,
+            'docs/guide.md': 'guide\n',
+        }, 'Second commit')
+
+        stages = []
+        second = self._package(progress=lambda stage=None, **counters: stages.append(stage))
+
+        self.assertEqual(second['head'], head)
+        self.assertEqual(second['files'], [
+            {'path': 'README.md', 'size': 9},
+            {'path': 'docs/guide.md', 'size': 6},
+            {'path': 'src/app.py', 'size': 21},
+        ])
+        self.assertEqual([c['hash'] for c in second['commits']],
+                         [head, first['commits'][0]['hash']])
+        self.assertTrue(os.path.isdir(os.path.join(self.temp_dir.name, 'mirrors')))
+        self.assertIn('commits', stages)
+
+    def test_repackage_copies_rows_without_reading_them(self):
+        first = self._package()
+        commit_files(self.repo_path, {'README.md': '# Changed\n'}, 'Edit readme')
+
+        repo_id, error = package_repository(self.repo_path)
+        self.assertIsNone(error)
+        repository = db.session.get(Repository, repo_id)
+        self.assertEqual(load_package(repository)['commits'][1:], first['commits'])
+        self.assertNotIn('files', repository.packaged_data)
+
+    def test_incremental_matches_full_package(self):
+        self._package()
+        commit_files(self.repo_path, {'src/new.py': 'x = 1\n', 'README.md': None}, 'Change files')
+
+        incremental = self._package()
+        full = self._package(incremental=False)
+
+        self.assertEqual(incremental['files'], full['files'])
+        self.assertEqual(incremental['commits'], full['commits'])
+
+    def test_rewritten_history_falls_back_to_full_package(self):
+        self._package()
+        git(self.repo_path, 'commit', '-q', '--amend', '-m', 'Rewritten')
+
+        data = self._package()
+        self.assertEqual(len(data['commits']), 1)
+        self.assertEqual(data['commits'][0]['message'].strip(), 'Rewritten')
+
+class TestCommitExtraction(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.repo_path = make_repo(os.path.join(self.temp_dir.name, 'sample'))
+        commit_files(self.repo_path, {'a.txt': 'a\n'}, 'Subject line\n\nBody with\nseveral lines\n',
+                     author='Jos\u00e9 Example <jose@example.com>')
+        commit_files(self.repo_path, {'b.txt': 'b\n'}, 'Separators \x1f and | in message')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_matches_gitpython(self):
+        repo = gitpython.Repo(self.repo_path)
+        expected = [{
+            'hash': commit.hexsha,
+            'author': str(commit.author),
+            'message': commit.message,
+            'date': commit.committed_datetime.isoformat()
+        } for commit in repo.iter_commits()]
+        repo.close()
+
+        git_dir = os.path.join(self.repo_path, '.git')
+        self.assertEqual(list(extract_commits(git_dir)), expected)
+        self.assertEqual(expected[1]['author'], 'Jos\u00e9 Example')
+
+    def test_depth_stops_early(self):
+        git_dir = os.path.join(self.repo_path, '.git')
+        commits = list(extract_commits(git_dir, depth=2))
+        self.assertEqual([c['message'].split('\n')[0] for c in commits],
+                         ['Separators \x1f and | in message', 'Subject line'])
+
+class TestCloneModes(PackagerTestCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(4):
+            commit_files(self.repo_path, {f'notes/{i}.txt': f'note {i}\n'}, f'Note {i}')
+        git(self.repo_path, 'config', 'uploadpack.allowFilter', 'true')
+        # Shallow and partial clones are ignored for plain local paths
+        self.file_url = f'file://{self.repo_path}'
+
+    def test_depth_limits_commits(self):
+        data = self._package(self.file_url, depth=2)
+        self.assertEqual(len(data['commits']), 2)
+        self.assertEqual(data['commits'][0]['message'].strip(), 'Note 3')
+        self.assertEqual(data['clone'], {'depth': 2, 'since': None, 'partial': False})
+        self.assertEqual(len(data['files']), 7)
+
+    def test_depth_bounds_incremental_package(self):
+        self._package(self.file_url, depth=2)
+        commit_files(self.repo_path, {'notes/new.txt': 'new\n'}, 'New note')
+
+        data = self._package(self.file_url, depth=2)
+        self.assertEqual([c['message'].strip() for c in data['commits']], ['New note', 'Note 3'])
+        self.assertIn('notes/new.txt', [f['path'] for f in data['files']])
+
+    def test_since_limits_commits(self):
+        data = self._package(self.file_url, since='2000-01-01')
+        self.assertEqual(len(data['commits']), 5)
+
+        repo_id, error = package_repository(self.file_url, since='2099-01-01')
+        self.assertIsNone(repo_id)
+        self.assertIn('no commits selected', error)
+
+    def test_partial_clone_skips_blob_sizes(self):
+        data = self._package(self.file_url, partial=True)
+        self.assertEqual(len(data['files']), 7)
+        self.assertTrue(all(f['size'] is None for f in data['files']))
+        self.assertEqual(len(data['commits']), 5)
+
+        full = self._package(self.file_url, incremental=False)
+        self.assertTrue(all(f['size'] is not None for f in full['files']))
+
+    def test_invalid_options(self):
+        cases = [
+            ({'depth': 0}, 'depth must be a positive integer'),
+            ({'since': 'yesterday'}, 'since must be an ISO 8601 date'),
+            ({'depth': 1, 'since': '2020-01-01'}, 'depth and since cannot be combined'),
+            ({'partial': True, 'listing': 'checkout'}, 'checkout listing is not available for partial clones'),
+        ]
+        for options, message in cases:
+            self.assertEqual(package_repository(self.file_url, **options), (None, message))
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,151 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from flask import Flask
+from repolens.api import api_bp, init_app
+from repolens.models import db
+from repolens.packager import package_repository
+from repolens.search import regex_literals, glob_literals, get_search_index
+from gitfixtures import make_repo, commit_files, git
+
+
+class TestQueryLiterals(unittest.TestCase):
+    def test_regex_literals(self):
+        self.assertEqual(regex_literals(r'api_key\s*=\s*"'), ['api_key', '=', '"'])
+        self.assertEqual(regex_literals(r'foo\.bar'), ['foo.bar'])
+        self.assertEqual(regex_literals('colou?r'), ['colo', 'r'])
+        self.assertEqual(regex_literals('ab+cd'), ['ab', 'bcd'])
+        self.assertEqual(regex_literals(r'[abc]def(ghi)*\x41jkl'), ['def', 'jkl'])
+        self.assertEqual(regex_literals('(?i)Token'), ['Token'])
+        self.assertEqual(regex_literals('abc|def'), [])
+
+    def test_glob_literals(self):
+        self.assertEqual(glob_literals('src/*/[!_]conf?.py'), ['src/', '/', 'conf', '.py'])
+
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['REPOLENS_MIRROR_DIR'] = os.path.join(self.temp_dir.name, 'mirrors')
+        self.app.config['REPOLENS_SEARCH_DB'] = os.path.join(self.temp_dir.name, 'search.db')
+        self.app.config['REPOLENS_SNAPSHOT_DIR'] = None
+        self.app.config['REPOLENS_ANALYSIS_CACHE_DB'] = None
+        self.app.config['REPOLENS_BLOB_DB'] = None
+        self.app.config['REPOLENS_SCAN_WORKERS'] = 1
+        self.app.register_blueprint(api_bp)
+        init_app(self.app)
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.alpha = make_repo(os.path.join(self.temp_dir.name, 'alpha'), {
+            'README.md': '# Alpha\n',
+            'config/settings.ini': '[server]\nport = 8080\nSECRET_KEY = abc\n',
+            'src/app.py': 'import os\nprint(os.environ["SECRET_KEY"])\n',
+        })
+        self.beta = make_repo(os.path.join(self.temp_dir.name, 'beta'), {
+            'setup.cfg': '[metadata]\nname = beta\n',
+            'src/app.py': 'import os\nprint(os.environ["SECRET_KEY"])\n',
+        })
+        for path in (self.alpha, self.beta):
+            self._package(path)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.temp_dir.cleanup()
+
+    def _package(self, path):
+        repo_id, error = package_repository(path)
+        self.assertIsNone(error)
+        return repo_id
+
+    def _search(self, **params):
+        response = self.client.get('/api/search', query_string=params)
+        self.assertEqual(response.status_code, 200, response.get_json())
+        return response.get_json()
+
+    def _paths(self, **params):
+        return [(os.path.basename(r['repo_url']), r['path']) for r in self._search(**params)['results']]
+
+    def test_content_search(self):
+        result = self._search(q=r'SECRET_KEY\s*=')
+        self.assertEqual(len(result['results']), 1)
+        match = result['results'][0]
+        self.assertEqual((match['repo_url'], match['path']), (self.alpha, 'config/settings.ini'))
+        self.assertEqual(match['matches'], [{'line': 3, 'text': 'SECRET_KEY = abc'}])
+
+        self.assertEqual(self._paths(q='secret_key'), [])
+        self.assertEqual(self._paths(q='(?i)secret_key'), [
+            ('alpha', 'config/settings.ini'), ('alpha', 'src/app.py'), ('beta', 'src/app.py')])
+        # No certain literal: every text file is scanned
+        self.assertEqual(self._paths(q='(?m)^n.me|^p.rt'), [('alpha', 'config/settings.ini'), ('beta', 'setup.cfg')])
+
+    def test_path_and_repository_filters(self):
+        self.assertEqual(self._paths(path='*.cfg'), [('beta', 'setup.cfg')])
+        self.assertEqual(self._paths(path='src/*', q='environ', repo_url=self.beta), [('beta', 'src/app.py')])
+        self.assertNotIn('matches', self._search(path='*.cfg')['results'][0])
+
+    def test_pagination(self):
+        first = self._search(path='*', limit=3)
+        self.assertEqual([r['path'] for r in first['results']], ['README.md', 'config/settings.ini', 'src/app.py'])
+        rest = self._search(path='*', limit=3, cursor=first['next_cursor'])
+        self.assertEqual([r['path'] for r in rest['results']], ['setup.cfg', 'src/app.py'])
+        self.assertEqual(rest['results'][0]['repo_url'], self.beta)
+        self.assertIsNone(rest['next_cursor'])
+
+    def test_update_is_incremental(self):
+        index = get_search_index()
+        with open(os.path.join(self.alpha, 'logo.png'), 'wb') as f:
+            f.write(b'\x89PNG\x00SECRET_KEY')
+        git(self.alpha, 'add', 'logo.png')
+        commit_files(self.alpha, {'config/settings.ini': '[server]\nport = 9090\n', 'README.md': None}, 'Edit')
+        self._package(self.alpha)
+
+        self.assertEqual(self._paths(q='SECRET_KEY =', repo_url=self.alpha), [])
+        self.assertEqual(self._paths(q='port = 9090'), [('alpha', 'config/settings.ini')])
+        # Binary files are found by path only
+        self.assertEqual(self._paths(q='PNG'), [])
+        self.assertEqual(self._paths(path='*.png'), [('alpha', 'logo.png')])
+        self.assertEqual(self._paths(path='README*'), [])
+
+        # The replaced settings blob is gone; the shared src/app.py blob stays
+        self.assertEqual(index.stats()['repositories'], 2)
+        conn = sqlite3.connect(index.path)
+        orphans = conn.execute('SELECT COUNT(*) FROM blobs WHERE id NOT IN '
+                               '(SELECT blob FROM files WHERE blob IS NOT NULL)').fetchone()[0]
+        conn.close()
+        self.assertEqual(orphans, 0)
+
+        index.compact()
+        self.assertEqual(self._paths(q='port = 9090'), [('alpha', 'config/settings.ini')])
+        self.assertEqual(self._paths(q='SECRET_KEY ='), [])
+        self.assertEqual(self._paths(path='*.png'), [('alpha', 'logo.png')])
+
+    def test_deleted_snapshots_leave_the_index(self):
+        old_id = self._search(path='setup.cfg')['results'][0]['repository_id']
+        commit_files(self.beta, {'setup.cfg': '[metadata]\nname = gamma\n'}, 'Rename')
+        new_id = self._package(self.beta)
+        self.assertEqual(self._paths(q='gamma'), [('beta', 'setup.cfg')])
+
+        # Deleting the indexed snapshot falls back to the previous one
+        self.assertEqual(self.client.delete(f'/api/repository/{new_id}').status_code, 200)
+        self.assertEqual(self._paths(q='gamma'), [])
+        self.assertEqual(self._search(q='name = beta')['results'][0]['repository_id'], old_id)
+
+        # Deleting the last one drops the URL
+        self.client.delete(f'/api/repository/{old_id}')
+        self.assertEqual(self._paths(q='environ'), [('alpha', 'src/app.py')])
+        self.assertEqual(get_search_index().stats()['repositories'], 1)
+
+    def test_bad_requests(self):
+        for params in ({}, {'q': '('}, {'q': 'x', 'cursor': 'nope'}, {'q': 'x', 'limit': 0}):
+            self.assertEqual(self.client.get('/api/search', query_string=params).status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
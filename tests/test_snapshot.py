@@ -0,0 +1,166 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+from flask import Flask
+from repolens import analyzer
+from repolens.api import api_bp, init_app
+from repolens.analyzer import run_analyses
+from repolens.models import Analysis, db
+from repolens.snapshot import Snapshot, SnapshotError, package_to_snapshot, get_snapshot_store
+from repolens.storage import save_package, load_package
+
+PACKAGE = {
+    'name': 'sample',
+    'url': 'https://github.com/test/sample.git',
+    'head': 'a' * 40,
+    'files': [
+        {'path': 'README.md', 'size': 10},
+        {'path': 'src/app.py', 'size': 120},
+        {'path': 'src/util.py', 'size': None},
+        {'path': 'src/nested/ünï.c', 'size': 7},
+    ],
+    'commits': [
+        {'hash': 'b' * 40, 'author': 'Ann', 'message': 'Second\n', 'date': '2024-03-01T12:30:00+05:30'},
+        {'hash': 'c' * 40, 'author': 'Bo', 'message': 'First\n\nBody\n', 'date': '2024-01-01T00:00:00-08:00'},
+        {'hash': 'd' * 40, 'author': 'Ann', 'message': '', 'date': '1969-12-31T23:59:59+00:00'},
+    ],
+    'branches': ['main', 'feature/x'],
+}
+
+
+class TestSnapshotFormat(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'sample.rls')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_round_trip(self):
+        package_to_snapshot(PACKAGE, self.path)
+        with Snapshot(self.path) as snapshot:
+            self.assertEqual(snapshot.to_package(), PACKAGE)
+            self.assertEqual(snapshot.counts, {'files': 4, 'commits': 3, 'branches': 2})
+
+    def test_columns_are_interned_and_mapped(self):
+        package_to_snapshot(PACKAGE, self.path)
+        with Snapshot(self.path) as snapshot:
+            self.assertEqual(list(snapshot.strings('table.dirs')), ['', 'src', 'src/nested'])
+            self.assertEqual(list(snapshot.strings('table.authors')), ['Ann', 'Bo'])
+            self.assertEqual(list(snapshot.column('commit.author')), [0, 1, 0])
+            sizes = snapshot.column('file.size')
+            self.assertIsInstance(sizes, memoryview)
+            self.assertEqual(sizes.tolist(), [10, 120, -1, 7])
+
+    def test_compression_is_smaller_than_json(self):
+        package = dict(PACKAGE, files=[{'path': f'src/module{i}/file{i}.py', 'size': i} for i in range(2000)],
+                       commits=[dict(PACKAGE['commits'][i % 3], hash=f'{i:040x}') for i in range(2000)])
+        package_to_snapshot(package, self.path)
+        compressed = os.path.getsize(self.path)
+        package_to_snapshot(package, self.path, compress=False)
+        self.assertLess(compressed, os.path.getsize(self.path))
+        self.assertLess(compressed * 3, len(json.dumps(package, indent=2)))
+        with Snapshot(self.path) as snapshot:
+            self.assertEqual(snapshot.to_package(), package)
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'{"name": "not a snapshot"}')
+        with self.assertRaises(SnapshotError):
+            Snapshot(self.path)
+
+
+class TestSnapshotStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        self.app.config['REPOLENS_SNAPSHOT_DIR'] = os.path.join(self.temp_dir.name, 'snapshots')
+        self.app.config['REPOLENS_SEARCH_DB'] = None
+        self.app.config['REPOLENS_ANALYSIS_CACHE_DB'] = None
+        self.app.config['REPOLENS_BLOB_DB'] = None
+        self.app.register_blueprint(api_bp)
+        init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        files = [dict(f, language='Python', binary=False, lines=3, code_lines=2, comment_lines=1,
+                      blank_lines=0) for f in PACKAGE['files'] if f['path'].endswith('.py')]
+        files.append({'path': 'logo.png', 'size': 5, 'binary': True})
+        files.append({'path': 'NOTES', 'size': 1})
+        metadata = {k: v for k, v in PACKAGE.items() if k not in ('files', 'commits', 'branches')}
+        self.repository = save_package(metadata, files, PACKAGE['commits'], PACKAGE['branches'])
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.temp_dir.cleanup()
+
+    def test_open_builds_once(self):
+        store = get_snapshot_store()
+        with store.open(self.repository) as snapshot:
+            self.assertEqual(snapshot.to_package(), load_package(self.repository))
+        self.assertIsNotNone(store.open(self.repository, build=False))
+        with mock.patch.object(store, 'build') as build:
+            store.open(self.repository).close()
+        build.assert_not_called()
+
+    def test_columnar_results_match_row_results(self):
+        types = list(analyzer.analysis_types())
+        get_snapshot_store().build(self.repository)
+        columnar = {t: db.session.get(Analysis, i).result for t, i in run_analyses(self.repository.id, types).items()}
+
+        other = save_package({'name': 'sample', 'url': self.repository.url}, list(analyzer.iter_file_rows(
+            self.repository)), PACKAGE['commits'], PACKAGE['branches'])
+        with mock.patch.object(analyzer, 'get_snapshot_store', return_value=None):
+            rows = {t: db.session.get(Analysis, i).result for t, i in run_analyses(other.id, types).items()}
+        self.assertEqual(columnar, rows)
+        self.assertEqual(columnar['lines_of_code']['unscanned_files'], 1)
+        self.assertEqual(columnar['lines_of_code']['languages']['Python']['code_lines'], 4)
+
+    def test_snapshot_download(self):
+        response = self.app.test_client().get(f'/api/download/{self.repository.id}?format=snapshot')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/vnd.repolens.snapshot')
+        path = os.path.join(self.temp_dir.name, 'download.rls')
+        with open(path, 'wb') as f:
+            f.write(response.get_data())
+        with Snapshot(path) as snapshot:
+            self.assertEqual(snapshot.to_package(), load_package(self.repository))
+
+    def test_superseded_snapshots_are_pruned(self):
+        store = get_snapshot_store()
+        first = store.build(self.repository)
+        newer = save_package({'name': 'sample', 'url': self.repository.url}, [], [], ['main'])
+        latest = store.build(newer)
+        self.assertEqual(store.remove_superseded(newer), 1)
+        self.assertFalse(os.path.exists(first))
+
+        other = save_package({'name': 'other', 'url': 'https://github.com/test/other.git'}, [], [], [])
+        store.build(other)
+        db.session.delete(other)
+        db.session.commit()
+        store.build(self.repository)
+        result = self.app.test_cli_runner().invoke(args=['snapshots-prune'])
+        self.assertIn('Removed 2 snapshot files', result.output)
+        self.assertEqual(os.listdir(store.root), [os.path.basename(latest)])
+
+    def test_analyzing_a_superseded_snapshot_does_not_rebuild_it(self):
+        store = get_snapshot_store()
+        store.build(self.repository)
+        newer = save_package({'name': 'sample', 'url': self.repository.url}, [], [], ['main'])
+        latest = store.build(newer)
+        store.remove_superseded(newer)
+
+        with mock.patch.object(store, 'build') as build:
+            self.assertIsNotNone(run_analyses(self.repository.id, ['file_count', 'lines_of_code']))
+        build.assert_not_called()
+        self.assertEqual(os.listdir(store.root), [os.path.basename(latest)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from flask import Flask
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from repolens import database, jobs
+from repolens.database import db
+from repolens.models import Repository, RepositoryFile
+from repolens.storage import (_by_code_point, save_package, save_incremental_package, load_package, is_normalized,
+                              copy_payload, iter_file_rows)
+
+
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        db.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.metadata = {'name': 'sample', 'url': 'https://example.com/sample.git', 'head': 'a' * 40}
+        self.files = [{'path': 'README', 'size': 10}, {'path': 'src/app.py', 'size': 20}]
+        self.commits = [
+            {'hash': 'b' * 40, 'author': 'Ann', 'message': 'Second\n', 'date': '2024-03-01T09:30:00-05:00'},
+            {'hash': 'c' * 40, 'author': 'Bob', 'message': 'First\n', 'date': '2024-02-29T23:00:00+05:30'},
+        ]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_round_trip_preserves_package_shape(self):
+        repository = save_package(self.metadata, self.files, self.commits, ['main', 'dev'])
+
+        self.assertTrue(is_normalized(repository))
+        self.assertNotIn('files', repository.packaged_data)
+        self.assertEqual(load_package(repository), dict(
+            self.metadata, files=self.files, commits=self.commits, branches=['main', 'dev']))
+
+    def test_incremental_package_copies_unchanged_rows(self):
+        base = save_package(self.metadata, self.files, self.commits, ['main'])
+        new_commit = {'hash': 'd' * 40, 'author': 'Cy', 'message': 'Third\n', 'date': '2024-03-02T00:00:00+00:00'}
+
+        repository = save_incremental_package(
+            dict(self.metadata, head='d' * 40), base,
+            changed_files=[{'path': 'src/app.py', 'size': 25}, {'path': 'docs/new.md', 'size': 5}],
+            deleted_paths={'README'}, new_commits=[new_commit], branches=['main'], depth=2)
+
+        package = load_package(repository)
+        self.assertEqual(package['files'], [{'path': 'docs/new.md', 'size': 5}, {'path': 'src/app.py', 'size': 25}])
+        self.assertEqual(package['commits'], [new_commit, self.commits[0]])
+        self.assertEqual(RepositoryFile.query.filter_by(repository_id=base.id).count(), 2)
+
+    def test_legacy_rows_are_still_readable(self):
+        legacy = dict(self.metadata, files=self.files, commits=self.commits, branches=['main'])
+        repository = Repository(name='sample', url=self.metadata['url'], packaged_data=legacy)
+        db.session.add(repository)
+        db.session.commit()
+
+        self.assertFalse(is_normalized(repository))
+        self.assertEqual(load_package(repository), legacy)
+
+    def test_file_rows_are_ordered_by_code_point(self):
+        save_package(self.metadata, [{'path': p, 'size': 1} for p in ('b', 'B', '_a', 'a/z', 'a.z')], [], [])
+        paths = [row['path'] for row in iter_file_rows(Repository.query.one())]
+        self.assertEqual(paths, sorted(paths))
+        # PostgreSQL would otherwise sort by the database locale
+        order = _by_code_point(RepositoryFile.path, 'postgresql').compile(dialect=postgresql.dialect())
+        self.assertIn('COLLATE "C"', str(order))
+
+    def test_copy_payload_escapes_values(self):
+        rows = [{'path': 'a\tb\\c', 'message': 'line\r\nnext', 'binary': False, 'lines': None,
+                 'date': datetime(2024, 3, 1, 9, 30)}]
+        self.assertEqual(copy_payload(['path', 'message', 'binary', 'lines', 'date'], rows),
+                         'a\\tb\\\\c\tline\\r\\nnext\tf\t\\N\t2024-03-01 09:30:00\n')
+
+
+class TestDatabase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.temp_dir.name, 'repolens.db')
+        self.app.config['REPOLENS_DB_POOL_SIZE'] = 3
+        database.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        self.app_context.pop()
+        self.temp_dir.cleanup()
+
+    def test_pool_and_pragmas(self):
+        self.assertEqual(db.engine.pool.size(), 3)
+        self.assertEqual(db.session.execute(text('PRAGMA journal_mode')).scalar(), 'wal')
+        self.assertEqual(db.session.execute(text('PRAGMA synchronous')).scalar(), 1)
+
+    def test_side_stores_follow_the_pragma_setting(self):
+        def journal_mode(store):
+            conn = store._connect()
+            try:
+                return conn.execute('PRAGMA journal_mode').fetchone()[0]
+            finally:
+                conn.close()
+
+        app = Flask(__name__)
+        app.config['REPOLENS_SQLITE_PRAGMAS'] = False
+        app.config['REPOLENS_JOBS_DB'] = os.path.join(self.temp_dir.name, 'plain.db')
+        jobs.init_app(app)
+        self.assertEqual(journal_mode(jobs.get_queue(app).store), 'delete')
+
+        store = jobs.JobStore(os.path.join(self.temp_dir.name, 'jobs.db'))
+        self.assertEqual(journal_mode(store), 'wal')
+        # Set once with the schema; later connections find it in the file
+        self.assertEqual(journal_mode(store), 'wal')
+
+    def test_readers_are_not_blocked_by_a_writer(self):
+        db.create_all()
+        save_package({'name': 'sample', 'url': 'https://example.com/sample.git'}, [], [], [])
+        writer = db.engine.connect()
+        try:
+            transaction = writer.begin()
+            writer.execute(text("UPDATE repository SET name = 'renamed'"))
+            # A second connection still reads the last committed state
+            with db.engine.connect() as reader:
+                self.assertEqual(reader.execute(text('SELECT name FROM repository')).scalar(), 'sample')
+            transaction.rollback()
+        finally:
+            writer.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,10 +5,13 @@ import tempfile
 import os
 import shutil
 
+COMMIT_LIMIT = 10
+
 def convert_repository(repo_url):
     with tempfile.TemporaryDirectory() as temp_dir:
         try:
-            Repo.clone_from(repo_url, temp_dir)
+            # Only the most recent commits are reported, so skip the rest of the history
+            Repo.clone_from(repo_url, temp_dir, depth=COMMIT_LIMIT)
             
             repo_data = {
                 'url': repo_url,
@@ -28,7 +31,7 @@ def convert_repository(repo_url):
                     })
             
             repo = Repo(temp_dir)
-            for commit in list(repo.iter_commits())[:10]:  # Limit to last 10 commits
+            for commit in repo.iter_commits(max_count=COMMIT_LIMIT):
                 repo_data['commit_history'].append({
                     'hash': commit.hexsha,
                     'author': str(commit.author),